@@ -0,0 +1,152 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable
+
+
+# настройки допуска к записи: token bucket на агента и общий лимит одновременных записей
+class admissionsettings:
+    def __init__(self) -> None:
+        # пачек в секунду на агента, 0 — без ограничения
+        self.agent_rate = max(0.0, float(os.getenv("INGEST_AGENT_RATE", "1")))
+        self.agent_burst = max(1.0, float(os.getenv("INGEST_AGENT_BURST", "10")))
+        self.max_agents = max(1, int(os.getenv("INGEST_RATE_MAX_AGENTS", "100000")))
+        self.max_inflight = max(1, int(os.getenv("INGEST_MAX_INFLIGHT", "32")))
+        self.max_waiting = max(0, int(os.getenv("INGEST_MAX_WAITING", "256")))
+        self.wait_ms = max(0, int(os.getenv("INGEST_ADMISSION_WAIT_MS", "1000")))
+
+
+class ratelimited(Exception):
+    def __init__(self, agent_id: str, retry_after: int) -> None:
+        super().__init__(f"rate limit exceeded for {agent_id}")
+        self.retry_after = retry_after
+
+
+class overloaded(Exception):
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.retry_after = 1
+
+
+# агент -> (токены, время последнего списания); порядок — от давно молчавших к недавним.
+# ведро, простоявшее burst / rate секунд, снова полное и ничем не отличается от отсутствующего,
+# поэтому такие агенты удаляются с головы без потери состояния
+class agentbuckets:
+    def __init__(self, settings: admissionsettings | None = None) -> None:
+        self.settings = settings or admissionsettings()
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.limited = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.agent_rate > 0
+
+    def expire(self, now: float) -> None:
+        refill = self.settings.agent_burst / self.settings.agent_rate
+        while self.buckets:
+            _, (_, stamp) = next(iter(self.buckets.items()))
+            if now - stamp < refill:
+                break
+            self.buckets.popitem(last=False)
+
+    # токены списываются только если хватает у всех агентов запроса
+    def take(self, agent_ids: Iterable[str], now: float | None = None) -> None:
+        if not self.enabled:
+            return
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        rate = self.settings.agent_rate
+        burst = self.settings.agent_burst
+        levels = {}
+        for agent_id in agent_ids:
+            tokens, stamp = self.buckets.get(agent_id, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens < 1:
+                self.limited += 1
+                raise ratelimited(agent_id, max(1, math.ceil((1 - tokens) / rate)))
+            levels[agent_id] = tokens - 1
+        for agent_id, tokens in levels.items():
+            self.buckets[agent_id] = (tokens, now)
+            self.buckets.move_to_end(agent_id)
+        while len(self.buckets) > self.settings.max_agents:
+            self.buckets.popitem(last=False)
+            self.evicted += 1
+
+    def clear(self) -> None:
+        self.buckets.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "agents": len(self.buckets),
+            "rate": self.settings.agent_rate,
+            "burst": self.settings.agent_burst,
+            "limited": self.limited,
+            "evicted": self.evicted,
+        }
+
+
+# не больше max_inflight записей сразу; до max_waiting ждут слота не дольше wait_ms, остальные получают 503.
+# очередь перед писателем остается короткой, и хвост задержки не растет вместе с всплеском.
+# освободившийся слот передается первому ожидающему напрямую, новые запросы не обгоняют очередь
+class concurrencygate:
+    def __init__(self, settings: admissionsettings | None = None) -> None:
+        self.settings = settings or admissionsettings()
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.shed = 0
+
+    async def acquire(self) -> None:
+        if self.active < self.settings.max_inflight and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.settings.max_waiting:
+            self.shed += 1
+            raise overloaded("ingest is overloaded")
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.settings.wait_ms / 1000)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            raise overloaded("timed out waiting for a write slot")
+        except asyncio.CancelledError:
+            # слот успели передать, но запрос уже отменен: возвращаем слот следующему
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self) -> None:
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": len(self.waiters),
+            "max_inflight": self.settings.max_inflight,
+            "max_waiting": self.settings.max_waiting,
+            "shed": self.shed,
+        }
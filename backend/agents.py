@@ -0,0 +1,117 @@
+import math
+import time
+from typing import Any, Iterable, Optional
+
+# постоянная времени сглаживания потока событий агента, секунды
+rate_tau = 60.0
+
+
+# последнее состояние агента: O(1) памяти на агента
+class agentstate:
+    __slots__ = (
+        "agent_id",
+        "platform",
+        "last_seen",
+        "last_ts",
+        "metric_ts",
+        "cpu",
+        "mem_free",
+        "rate",
+        "rate_at",
+    )
+
+    def __init__(self, agent_id: str) -> None:
+        self.agent_id = agent_id
+        self.platform: Optional[str] = None
+        self.last_seen: Optional[str] = None
+        self.last_ts: Optional[str] = None
+        self.metric_ts: Optional[str] = None
+        self.cpu: Optional[float] = None
+        self.mem_free: Optional[int] = None
+        # экспоненциально затухающий счетчик: событий в секунду за ~rate_tau
+        self.rate = 0.0
+        self.rate_at = 0.0
+
+    def observe(self, record: dict[str, Any]) -> None:
+        self.platform = record["platform"]
+        self.last_seen = record["ingested_at"]
+        self.last_ts = record["ts"]
+        if record["event_type"] == "metric":
+            self.metric_ts = record["ts"]
+            self.cpu = record["cpu"]
+            self.mem_free = record["mem_free"]
+
+    def count(self, events: int, now: float) -> None:
+        self.rate = self.current_rate(now) + events / rate_tau
+        self.rate_at = now
+
+    def current_rate(self, now: float) -> float:
+        if not self.rate:
+            return 0.0
+        return self.rate * math.exp(-max(0.0, now - self.rate_at) / rate_tau)
+
+    def render(self, now: float) -> dict[str, Any]:
+        return {
+            "agent_id": self.agent_id,
+            "platform": self.platform,
+            "last_seen": self.last_seen.replace(" ", "T", 1) if self.last_seen else None,
+            "last_ts": self.last_ts,
+            "metric": {"ts": self.metric_ts, "cpu": self.cpu, "mem_free": self.mem_free}
+            if self.metric_ts is not None
+            else None,
+            "events_per_second": round(self.current_rate(now), 3),
+        }
+
+# индекс последних состояний: обновляется после каждой записи, при старте собирается из sqlite
+class agentindex:
+    def __init__(self) -> None:
+        self.states: dict[str, agentstate] = {}
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def state(self, agent_id: str) -> agentstate:
+        current = self.states.get(agent_id)
+        if current is None:
+            current = self.states[agent_id] = agentstate(agent_id)
+        return current
+
+    # строки идут по возрастанию id, поэтому последняя запись агента побеждает
+    def apply(self, records: Iterable[dict[str, Any]], now: float | None = None) -> None:
+        moment = now if now is not None else time.time()
+        counts: dict[str, int] = {}
+        for record in records:
+            agent_id = record["agent_id"]
+            self.state(agent_id).observe(record)
+            counts[agent_id] = counts.get(agent_id, 0) + 1
+        for agent_id, events in counts.items():
+            self.states[agent_id].count(events, moment)
+
+    # latest — последняя строка агента, metric — последняя метрика (может быть старше)
+    # сборка после старта идет фоном, пока ingest уже пишет: состояние из живого потока новее базы,
+    # из базы берется только то, чего в нем еще нет (агент целиком или его последняя метрика)
+    def merge(self, rows: Iterable[tuple[dict[str, Any], Optional[dict[str, Any]]]]) -> None:
+        for latest, metric in rows:
+            current = self.states.get(latest["agent_id"])
+            if current is None:
+                current = self.state(latest["agent_id"])
+                if metric is not None:
+                    current.observe(metric)
+                current.observe(latest)
+            elif current.metric_ts is None and metric is not None:
+                current.metric_ts = metric["ts"]
+                current.cpu = metric["cpu"]
+                current.mem_free = metric["mem_free"]
+
+    def remove(self, agent_id: Optional[str]) -> None:
+        if agent_id:
+            self.states.pop(agent_id, None)
+        else:
+            self.states = {}
+
+    def snapshot(self, agent_id: Optional[str] = None, now: float | None = None) -> list[dict[str, Any]]:
+        moment = now if now is not None else time.time()
+        if agent_id:
+            current = self.states.get(agent_id)
+            return [current.render(moment)] if current is not None else []
+        return [current.render(moment) for current in self.states.values()]
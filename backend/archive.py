@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import quote
+from . import database
+from .retention import parse_duration
+
+# pyarrow импортируется при первом обращении к архиву, а не при старте: это ~0.1 с холодного запуска,
+# которые без ARCHIVE_AFTER и запросов к /api/archive не нужны
+pa: Any = None
+ds: Any = None
+pq: Any = None
+arrow_missing = False
+
+logger = logging.getLogger(__name__)
+
+# колонки файла; agent_id и day — партиции каталога (hive: day=2025-11-12/agent_id=host-01)
+file_columns = ("id", "ts", "platform", "event_type", "cpu", "mem_free", "pid", "proc_name", "rss", "ingested_at")
+
+
+def available() -> bool:
+    global pa, ds, pq, arrow_missing
+    if pa is None and not arrow_missing:
+        try:
+            import pyarrow
+            import pyarrow.dataset
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:  # архив необязателен, без pyarrow он просто выключен
+            arrow_missing = True
+        else:
+            pa, ds, pq = pyarrow, pyarrow.dataset, pyarrow.parquet
+    return pa is not None
+
+
+def require_arrow() -> None:
+    if not available():
+        raise RuntimeError("archive requires pyarrow")
+
+
+def file_schema() -> "pa.Schema":
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("ts", pa.timestamp("us", tz="UTC")),
+            ("platform", pa.string()),
+            ("event_type", pa.string()),
+            ("cpu", pa.float64()),
+            ("mem_free", pa.int64()),
+            ("pid", pa.int64()),
+            ("proc_name", pa.string()),
+            ("rss", pa.int64()),
+            ("ingested_at", pa.timestamp("us", tz="UTC")),
+        ]
+    )
+
+
+def scan_schema() -> "pa.Schema":
+    schema = file_schema()
+    return schema.insert(1, pa.field("agent_id", pa.string()))
+
+
+def partition_schema() -> "pa.Schema":
+    return pa.schema([("day", pa.string()), ("agent_id", pa.string())])
+
+
+def parse_utc(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+# настройки архива
+class archivesettings:
+    def __init__(self) -> None:
+        after = os.getenv("ARCHIVE_AFTER", "")
+        self.after = parse_duration(after) if after else 0
+        self.root = os.getenv("ARCHIVE_DIR", "")
+        self.interval = float(os.getenv("ARCHIVE_INTERVAL", "300"))
+        self.chunk_rows = max(1, int(os.getenv("ARCHIVE_CHUNK_ROWS", "50000")))
+        self.max_rows = max(1, int(os.getenv("ARCHIVE_QUERY_MAX_ROWS", "10000")))
+
+    @property
+    def enabled(self) -> bool:
+        return self.after > 0
+
+    # по умолчанию каталог archive рядом с базой
+    @property
+    def directory(self) -> Path:
+        return Path(self.root) if self.root else database.get_db_path().with_name("archive")
+
+# перенос старых событий в parquet по дням и агентам с удалением из sqlite
+class archiveengine:
+    def __init__(self, settings: archivesettings | None = None) -> None:
+        self.settings = settings or archivesettings()
+        self.task: Optional[asyncio.Task] = None
+        self.rows_archived = 0
+        self.files_written = 0
+        self.passes = 0
+        self.seconds_spent = 0.0
+        self.last_pass_at: Optional[str] = None
+
+    async def start(self) -> None:
+        if self.task is not None or not self.settings.enabled:
+            return
+        if not available():
+            logger.warning("ARCHIVE_AFTER is set but pyarrow is not installed, archiving is off")
+            return
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("archive pass failed")
+            await asyncio.sleep(self.settings.interval)
+
+    # порция -> файлы -> delete того же диапазона; повтор после сбоя перезапишет те же файлы
+    async def run_once(self) -> int:
+        started = time.perf_counter()
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=self.settings.after)).strftime("%Y-%m-%d %H:%M:%S")
+        archived = 0
+        after_id = 0
+        while True:
+            rows = await database.fetch_archivable(cutoff, after_id, self.settings.chunk_rows)
+            if not rows:
+                break
+            first_id, last_id = rows[0]["id"], rows[-1]["id"]
+            self.files_written += await asyncio.to_thread(self.write_chunk, rows)
+            await database.delete_archived(first_id, last_id, cutoff)
+            archived += len(rows)
+            self.rows_archived += len(rows)
+            after_id = last_id
+            if len(rows) < self.settings.chunk_rows:
+                break
+        self.passes += 1
+        self.seconds_spent += time.perf_counter() - started
+        self.last_pass_at = datetime.now(timezone.utc).isoformat()
+        return archived
+
+    def write_chunk(self, rows: list[dict[str, Any]]) -> int:
+        require_arrow()
+        groups: dict[tuple[str, str], list[dict[str, Any]]] = {}
+        for row in rows:
+            ts = parse_utc(row["ts"])
+            record = {**row, "ts": ts, "ingested_at": parse_utc(row["ingested_at"])}
+            groups.setdefault((ts.strftime("%Y-%m-%d"), row["agent_id"]), []).append(record)
+        schema = file_schema()
+        for (day, agent_id), records in groups.items():
+            folder = self.settings.directory / f"day={day}" / f"agent_id={quote(agent_id, safe='')}"
+            folder.mkdir(parents=True, exist_ok=True)
+            target = folder / f"part-{records[0]['id']:012d}-{records[-1]['id']:012d}.parquet"
+            table = pa.table({name: [record[name] for record in records] for name in file_columns}, schema=schema)
+            # точка в начале имени: недописанный файл не попадает в dataset
+            temporary = folder / f".{target.name}.tmp"
+            pq.write_table(table, temporary, compression="zstd")
+            os.replace(temporary, target)
+        return len(groups)
+
+    def dataset(self) -> "ds.Dataset":
+        return ds.dataset(
+            self.settings.directory,
+            format="parquet",
+            partitioning=ds.partitioning(partition_schema(), flavor="hive"),
+        )
+
+    # фильтр по agent_id и времени отсекает каталоги партиций и row group'ы по статистике.
+    # дни идут по порядку, внутри дня держим только первые limit строк среди прочитанных батчей,
+    # и чтение останавливается, как только набрано limit: в памяти не больше limit строк плюс один батч
+    def scan(self, agent_id: Optional[str], start: datetime, end: datetime, limit: int) -> "pa.Table":
+        require_arrow()
+        schema = scan_schema()
+        if not self.settings.directory.exists():
+            return schema.empty_table()
+        first_day = start.astimezone(timezone.utc).strftime("%Y-%m-%d")
+        last_day = end.astimezone(timezone.utc).strftime("%Y-%m-%d")
+        days = sorted(
+            path.name[len("day=") :]
+            for path in self.settings.directory.iterdir()
+            if path.name.startswith("day=") and first_day <= path.name[len("day=") :] <= last_day
+        )
+        condition = (ds.field("ts") >= pa.scalar(start, pa.timestamp("us", tz="UTC"))) & (
+            ds.field("ts") < pa.scalar(end, pa.timestamp("us", tz="UTC"))
+        )
+        if agent_id:
+            condition = condition & (ds.field("agent_id") == agent_id)
+        dataset = self.dataset()
+        order = [("ts", "ascending"), ("id", "ascending")]
+        parts = []
+        remaining = limit
+        for day in days:
+            best: Optional["pa.Table"] = None
+            for batch in dataset.to_batches(columns=schema.names, filter=condition & (ds.field("day") == day)):
+                if not batch.num_rows:
+                    continue
+                chunk = pa.Table.from_batches([batch])
+                best = (chunk if best is None else pa.concat_tables([best, chunk])).sort_by(order).slice(0, remaining)
+            if best is not None:
+                parts.append(best)
+                remaining -= best.num_rows
+                if not remaining:
+                    break
+        return pa.concat_tables(parts).combine_chunks() if parts else schema.empty_table()
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.settings.enabled,
+            "available": available(),
+            "running": self.task is not None and not self.task.done(),
+            "passes": self.passes,
+            "rows_archived": self.rows_archived,
+            "files_written": self.files_written,
+            "seconds_spent": round(self.seconds_spent, 3),
+            "last_pass_at": self.last_pass_at,
+        }
+
+
+def render_archived(table: "pa.Table") -> list[dict[str, Any]]:
+    rows = table.to_pylist()
+    for row in rows:
+        row["ts"] = row["ts"].isoformat().replace("+00:00", "Z")
+        row["ingested_at"] = row["ingested_at"].replace(tzinfo=None).isoformat()
+    return rows
+
+
+def arrow_stream(table: "pa.Table") -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as stream:
+        stream.write_table(table)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,367 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Mapping, Optional
+import orjson
+from fastapi import WebSocket
+
+# история для догонки из базы: (agent_id, event_type, since_id, до id включительно или None, limit) -> события по возрастанию id
+historyloader = Callable[[Optional[str], Optional[str], int, Optional[int], int], Awaitable[list[dict[str, Any]]]]
+
+# кадры одного массива при догонке пакетного клиента
+replay_chunk = 500
+
+
+# настройки рассылки
+class broadcastsettings:
+    def __init__(self) -> None:
+        self.queue_size = max(1, int(os.getenv("WS_QUEUE_SIZE", "256")))
+        self.slow_policy = os.getenv("WS_SLOW_POLICY", "drop_oldest").lower()
+        self.send_timeout = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+        # последние разосланные события для /ws?since_id=N и предел догонки на одно подключение
+        self.replay_buffer = max(0, int(os.getenv("WS_REPLAY_BUFFER", "10000")))
+        self.replay_max = max(1, int(os.getenv("WS_REPLAY_MAX", "5000")))
+        if self.slow_policy not in ("drop_oldest", "disconnect"):
+            raise ValueError(f"unknown WS_SLOW_POLICY: {self.slow_policy}")
+
+
+def encode(payload: dict) -> str:
+    return orjson.dumps(payload).decode()
+
+# режим кадров клиента: batch_ms/max_rate склеивают события в массив, latest оставляет последнюю метрику агента
+class streamoptions:
+    def __init__(self, batch_ms: int = 0, max_rate: float = 0.0, latest: bool = False) -> None:
+        if batch_ms < 0 or max_rate < 0:
+            raise ValueError("batch_ms and max_rate must be non-negative")
+        self.batch_ms = batch_ms
+        self.max_rate = max_rate
+        self.latest = latest
+
+    @classmethod
+    def from_query(cls, params: Mapping[str, str]) -> "streamoptions":
+        return cls(
+            batch_ms=int(params.get("batch_ms") or 0),
+            max_rate=float(params.get("max_rate") or 0),
+            latest=(params.get("latest") or "").lower() in ("1", "true", "yes"),
+        )
+
+    @property
+    def batched(self) -> bool:
+        return self.batch_ms > 0 or self.max_rate > 0 or self.latest
+
+    @property
+    def min_gap(self) -> float:
+        return 1 / self.max_rate if self.max_rate > 0 else 0.0
+
+
+# подписчик: своя очередь кадров и своя задача отправки
+class subscriber:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        agent_id: Optional[str],
+        queue_size: int,
+        options: streamoptions | None = None,
+    ) -> None:
+        self.websocket = websocket
+        self.agent_id = agent_id
+        self.options = options or streamoptions()
+        # элемент очереди: (ключ склейки для latest, готовый json)
+        self.queue: asyncio.Queue[tuple[Optional[str], str]] = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+        self.last_sent = 0.0
+        # пока идет догонка, живые события копятся здесь: (id, элемент очереди)
+        self.pending: Optional[deque[tuple[Optional[int], tuple[Optional[str], str]]]] = None
+        # id, уже отданные догонкой; их живые копии пропускаются
+        self.replayed: set[int] = set()
+
+    # фильтр по типу для чтения истории: latest получает только метрики
+    @property
+    def event_type(self) -> Optional[str]:
+        return "metric" if self.options.latest else None
+
+    def wants(self, agent_id: Optional[str], event_type: Optional[str]) -> bool:
+        if self.agent_id and agent_id != self.agent_id:
+            return False
+        return not (self.options.latest and event_type is not None and event_type != "metric")
+
+
+# менеджер подключений: индекс подписок по agent_id плюс подписчики без фильтра
+class connectionmanager:
+    def __init__(self, settings: broadcastsettings | None = None, history: historyloader | None = None) -> None:
+        self.settings = settings or broadcastsettings()
+        self.history = history
+        self.by_socket: dict[WebSocket, subscriber] = {}
+        self.by_agent: dict[str, set[subscriber]] = {}
+        self.wildcard: set[subscriber] = set()
+        self.dropped = 0
+        self.slow_disconnects = 0
+        # кольцо последних событий: (id, agent_id, event_type, json или payload, если подписчиков не было)
+        self.recent: deque[tuple[int, Optional[str], Optional[str], str | dict]] = deque()
+        # в кольце есть все разосланные события с id больше этого; None — граница неизвестна, догонка идет из базы
+        self.covered_from: Optional[int] = None
+        self.resumes = 0
+        self.history_reads = 0
+        self.resyncs = 0
+
+    @property
+    def connections(self) -> int:
+        return len(self.by_socket)
+
+    # hold=True: подписчик сразу получает события, но отправка ждет start() — между ними идет догонка
+    async def connect(
+        self,
+        websocket: WebSocket,
+        agent_id: Optional[str],
+        options: streamoptions | None = None,
+        hold: bool = False,
+    ) -> subscriber:
+        await websocket.accept()
+        client = subscriber(websocket, agent_id, self.settings.queue_size, options)
+        self.by_socket[websocket] = client
+        if agent_id:
+            self.by_agent.setdefault(agent_id, set()).add(client)
+        else:
+            self.wildcard.add(client)
+        if hold:
+            client.pending = deque()
+        else:
+            client.task = asyncio.create_task(self.sender(client))
+        return client
+
+    # первые кадры, затем накопленные за догонку события, дальше обычная отправка
+    def start(self, client: subscriber, frames: list[str]) -> None:
+        pending = client.pending or deque()
+        client.pending = None
+        if client.closed:
+            return
+        for text in frames:
+            self.enqueue(client, (None, text))
+        for event_id, item in pending:
+            if event_id is not None and event_id in client.replayed:
+                client.replayed.discard(event_id)
+                continue
+            self.enqueue(client, item)
+        client.task = asyncio.create_task(self.sender(client))
+
+    # события после since_id: из кольца, а то, что старше его границы, — одним чтением из базы по индексу.
+    # False — пропущено больше WS_REPLAY_MAX событий (или базы нет), клиенту нужен полный снимок
+    async def resume(self, client: subscriber, since_id: int) -> bool:
+        self.resumes += 1
+        floor = self.covered_from
+        recent = [
+            (event_id, body)
+            for event_id, agent_id, event_type, body in self.recent
+            if event_id > since_id and client.wants(agent_id, event_type)
+        ]
+        events: dict[int, str] = {}
+        limit = self.settings.replay_max
+        if floor is None or since_id < floor:
+            if self.history is None:
+                self.resyncs += 1
+                return False
+            self.history_reads += 1
+            # фильтр клиента уходит в запрос: предел считается по событиям, которые он получит
+            rows = await self.history(client.agent_id, client.event_type, since_id, floor, limit + 1)
+            if len(rows) > limit:
+                self.resyncs += 1
+                return False
+            for row in rows:
+                if client.wants(row.get("agent_id"), row.get("event_type")):
+                    events[row["id"]] = encode(row)
+            if floor is None:
+                recent = []
+        for event_id, body in recent:
+            if event_id not in events:
+                events[event_id] = body if isinstance(body, str) else encode(body)
+        if len(events) > limit:
+            self.resyncs += 1
+            return False
+        ordered = sorted(events)
+        client.replayed = set(ordered)
+        texts = [events[event_id] for event_id in ordered]
+        frames = texts
+        if client.options.batched:
+            frames = [
+                "[" + ",".join(texts[offset : offset + replay_chunk]) + "]" for offset in range(0, len(texts), replay_chunk)
+            ]
+        for text in frames:
+            await asyncio.wait_for(client.websocket.send_text(text), self.settings.send_timeout)
+        return True
+
+    # граница кольца после рестарта: все, что до last_id, есть только в базе
+    def resume_from(self, last_id: int) -> None:
+        if self.settings.replay_buffer == 0:
+            return
+        self.covered_from = last_id if self.covered_from is None else max(self.covered_from, last_id)
+
+    def remember(self, event_id: int, agent_id: Optional[str], event_type: Optional[str], body: str | dict) -> None:
+        self.recent.append((event_id, agent_id, event_type, body))
+        while len(self.recent) > self.settings.replay_buffer:
+            evicted = self.recent.popleft()[0]
+            if self.covered_from is not None and evicted > self.covered_from:
+                self.covered_from = evicted
+
+    # после очистки удаленные события не должны вернуться догонкой
+    def forget(self, agent_id: Optional[str]) -> None:
+        if agent_id:
+            self.recent = deque(entry for entry in self.recent if entry[1] != agent_id)
+        else:
+            self.recent.clear()
+
+    async def disconnect(self, websocket: WebSocket) -> None:
+        client = self.by_socket.get(websocket)
+        if client is not None:
+            self.remove(client)
+
+    def remove(self, client: subscriber) -> None:
+        if client.closed:
+            return
+        client.closed = True
+        self.by_socket.pop(client.websocket, None)
+        if client.agent_id:
+            group = self.by_agent.get(client.agent_id)
+            if group is not None:
+                group.discard(client)
+                if not group:
+                    del self.by_agent[client.agent_id]
+        else:
+            self.wildcard.discard(client)
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def targets(self, agent_id: Optional[str]) -> list[subscriber]:
+        result = list(self.wildcard)
+        if agent_id:
+            result.extend(self.by_agent.get(agent_id, ()))
+        return result
+
+    # сериализация один раз на событие и только при подписчиках: без них в кольцо ложится payload,
+    # и json собирается, только если событие понадобится догонке. отправка не ждет сокетов
+    async def broadcast(self, payload: dict) -> None:
+        agent_id = payload.get("agent_id")
+        event_id = payload.get("id")
+        event_type = payload.get("event_type")
+        targets = self.targets(agent_id)
+        record = event_id is not None and self.settings.replay_buffer > 0
+        if not targets:
+            if record:
+                self.remember(event_id, agent_id, event_type, payload)
+            return
+        text = encode(payload)
+        if record:
+            self.remember(event_id, agent_id, event_type, text)
+        key = agent_id if event_type == "metric" else None
+        for client in targets:
+            if client.options.latest and event_type is not None and event_type != "metric":
+                continue
+            if client.pending is not None:
+                self.hold(client, event_id, (key, text))
+                continue
+            if client.replayed and event_id in client.replayed:
+                # событие уже ушло догонкой из базы, а опубликовано только сейчас
+                client.replayed.discard(event_id)
+                continue
+            self.enqueue(client, (key, text))
+
+    # очередь догонки ограничена и переполняется так же, как очередь отправки
+    def hold(self, client: subscriber, event_id: Optional[int], item: tuple[Optional[str], str]) -> None:
+        assert client.pending is not None
+        if len(client.pending) >= self.settings.queue_size:
+            if self.settings.slow_policy == "disconnect":
+                self.slow_disconnects += 1
+                self.remove(client)
+                asyncio.create_task(self.close(client))
+                return
+            client.pending.popleft()
+            client.dropped += 1
+            self.dropped += 1
+        client.pending.append((event_id, item))
+
+    def enqueue(self, client: subscriber, item: tuple[Optional[str], str]) -> None:
+        try:
+            client.queue.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.settings.slow_policy == "disconnect":
+            self.slow_disconnects += 1
+            self.remove(client)
+            asyncio.create_task(self.close(client))
+            return
+        client.queue.get_nowait()
+        client.queue.put_nowait(item)
+        client.dropped += 1
+        self.dropped += 1
+
+    async def sender(self, client: subscriber) -> None:
+        try:
+            while True:
+                item = await client.queue.get()
+                if client.options.batched:
+                    text = await self.collect(client, item)
+                else:
+                    text = item[1]
+                await asyncio.wait_for(client.websocket.send_text(text), self.settings.send_timeout)
+                client.last_sent = time.monotonic()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.remove(client)
+            await self.close(client)
+
+    # ждем окно batch_ms (и паузу max_rate), затем склеиваем очередь в один кадр-массив
+    async def collect(self, client: subscriber, first: tuple[Optional[str], str]) -> str:
+        options = client.options
+        now = time.monotonic()
+        wake = max(now + options.batch_ms / 1000, client.last_sent + options.min_gap)
+        if wake > now:
+            await asyncio.sleep(wake - now)
+        items = [first]
+        while not client.queue.empty():
+            items.append(client.queue.get_nowait())
+        if options.latest:
+            latest: dict[object, str] = {}
+            for index, (key, text) in enumerate(items):
+                latest.pop(key if key is not None else index, None)
+                latest[key if key is not None else index] = text
+            texts = list(latest.values())
+        else:
+            texts = [text for _, text in items]
+        return "[" + ",".join(texts) + "]"
+
+    # остановка при shutdown: гасим задачи отправки и закрываем сокеты
+    async def close_all(self) -> None:
+        clients = list(self.by_socket.values())
+        for client in clients:
+            self.remove(client)
+        for client in clients:
+            if client.task is not None:
+                try:
+                    await client.task
+                except BaseException:
+                    pass
+            await self.close(client)
+
+    async def close(self, client: subscriber) -> None:
+        try:
+            await client.websocket.close()
+        except Exception:
+            pass
+
+    def snapshot(self) -> dict:
+        return {
+            "connections": self.connections,
+            "agents_subscribed": len(self.by_agent),
+            "queued_frames": sum(client.queue.qsize() for client in self.by_socket.values()),
+            "dropped_frames": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "replay_buffer": len(self.recent),
+            "replay_covered_from": self.covered_from,
+            "resumes": self.resumes,
+            "resume_history_reads": self.history_reads,
+            "resyncs": self.resyncs,
+        }
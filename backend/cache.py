@@ -0,0 +1,101 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+# ключ версии для выборок без agent_id: их инвалидирует запись любого агента
+all_agents = "*"
+
+# ключ ответа: agent_id (None — все агенты), дальше параметры запроса
+cachekey = tuple[Optional[str], *tuple[Hashable, ...]]
+
+
+# настройки кэша ответов
+class responsecachesettings:
+    def __init__(self) -> None:
+        self.ttl = float(os.getenv("EVENTS_CACHE_TTL", "5"))
+        self.max_entries = max(0, int(os.getenv("EVENTS_CACHE_SIZE", "256")))
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+# ttl/lru кэш готовых тел ответа; ключ начинается с agent_id, инвалидация по агенту
+class responsecache:
+    def __init__(self, settings: responsecachesettings | None = None) -> None:
+        self.settings = settings or responsecachesettings()
+        self.entries: OrderedDict[cachekey, tuple[float, bytes]] = OrderedDict()
+        self.by_agent: dict[str, set[cachekey]] = {}
+        # версии растут при каждой инвалидации; запрос, начатый до нее, не кладет результат
+        self.versions: dict[str, int] = {}
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def scope(agent_id: Optional[str]) -> str:
+        return agent_id or all_agents
+
+    def version(self, agent_id: Optional[str]) -> tuple[int, int]:
+        return self.epoch, self.versions.get(self.scope(agent_id), 0)
+
+    def get(self, key: cachekey) -> Optional[bytes]:
+        if not self.settings.enabled:
+            return None
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.discard(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: cachekey, version: tuple[int, int], body: bytes) -> None:
+        if not self.settings.enabled:
+            return
+        scope = self.scope(key[0])
+        if self.version(key[0]) != version:
+            return
+        self.entries[key] = (time.monotonic() + self.settings.ttl, body)
+        self.entries.move_to_end(key)
+        self.by_agent.setdefault(scope, set()).add(key)
+        while len(self.entries) > self.settings.max_entries:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, key: cachekey) -> None:
+        self.entries.pop(key, None)
+        scope = self.scope(key[0])
+        keys = self.by_agent.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_agent[scope]
+
+    # запись или удаление событий агентов: их выборки и общие выборки устаревают
+    def invalidate(self, agent_ids: set[str]) -> None:
+        if not agent_ids:
+            return
+        self.invalidations += 1
+        for scope in (*agent_ids, all_agents):
+            self.versions[scope] = self.versions.get(scope, 0) + 1
+            for key in self.by_agent.pop(scope, ()):
+                self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.invalidations += 1
+        self.epoch += 1
+        self.versions.clear()
+        self.entries.clear()
+        self.by_agent.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.settings.enabled,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,61 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+
+# запуск режима шардов: один процесс-писатель (база, /ws, чтение) и N воркеров ingest на общем порту
+#   python -m backend.cluster --workers 4 --port 8000 --writer-port 8001
+
+
+def run_writer(host: str, port: int) -> None:
+    import uvicorn
+
+    uvicorn.run("backend.main:app", host=host, port=port, log_level="info")
+
+
+def wait_for_socket(address: str, process: multiprocessing.Process, timeout: float = 30.0) -> None:
+    if address.startswith("tcp://"):
+        return
+    deadline = time.monotonic() + timeout
+    while not Path(address).exists():
+        if not process.is_alive():
+            raise RuntimeError("writer process exited during startup")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"writer did not open {address} in {timeout:.0f}s")
+        time.sleep(0.1)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Telemetry backend with sharded ingest workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000, help="agents post /api/ingest here")
+    parser.add_argument("--writer-port", type=int, default=8001, help="dashboard api and /ws")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument(
+        "--socket",
+        default=os.getenv("INGEST_SOCKET") or str(Path(tempfile.gettempdir()) / "telemetry-ingest.sock"),
+        help="unix socket path or tcp://host:port",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    import uvicorn
+
+    args = parse_args()
+    # переменная наследуется и писателем, и воркерами
+    os.environ["INGEST_SOCKET"] = args.socket
+    writer = multiprocessing.Process(target=run_writer, args=(args.host, args.writer_port), name="telemetry-writer")
+    writer.start()
+    try:
+        wait_for_socket(args.socket, writer)
+        uvicorn.run("backend.shard:app", host=args.host, port=args.port, workers=args.workers, log_level="info")
+    finally:
+        writer.terminate()
+        writer.join()
+
+
+if __name__ == "__main__":
+    main()
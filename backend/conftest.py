@@ -0,0 +1,15 @@
+import pytest_asyncio
+from .database import close_pool
+from .main import agent_index, agent_limits, events_cache, idempotency, manager
+
+# пул соединений, кэш ответов, индексы агентов и идемпотентности, лимиты агентов привязаны к DB_PATH теста, сбрасываем их после каждого теста
+@pytest_asyncio.fixture(autouse=True)
+async def close_database_pool():
+    yield
+    await close_pool()
+    events_cache.clear()
+    agent_index.remove(None)
+    idempotency.clear()
+    agent_limits.clear()
+    manager.forget(None)
+    manager.covered_from = None
@@ -1,149 +1,702 @@
+import asyncio
+import logging
 import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Iterable, Optional
+from typing import Any, AsyncIterator, Iterable, Optional
 import aiosqlite
+from . import procstats, rollups
+from .instrumentation import timed
+from .lookups import interncache, lookup_schema
+from .migrations import migration, migrationrunner
+
+logger = logging.getLogger(__name__)
 
 
 def get_db_path() -> Path:
     env_path = os.getenv("DB_PATH")
     return Path(env_path) if env_path else Path(__file__).with_name("telemetry.db")
 
-# инициализация базы
+# настройки пула и pragma
+class databasesettings:
+    def __init__(self) -> None:
+        self.readers = max(1, int(os.getenv("DB_READERS", "4")))
+        self.journal_mode = os.getenv("DB_JOURNAL_MODE", "wal")
+        self.synchronous = os.getenv("DB_SYNCHRONOUS", "normal")
+        self.mmap_size = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+        self.cache_size = int(os.getenv("DB_CACHE_SIZE", "-65536"))
+        self.busy_timeout = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))
+
+# пул: одно соединение на запись, N на чтение
+class connectionpool:
+    def __init__(self, path: Path, settings: databasesettings | None = None) -> None:
+        self.path = path
+        self.settings = settings or databasesettings()
+        self.writer_conn: Optional[aiosqlite.Connection] = None
+        self.write_lock = asyncio.Lock()
+        self.readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self.reader_conns: list[aiosqlite.Connection] = []
+        self.opened: list[aiosqlite.Connection] = []
+        # словари строк привязаны к файлу базы, поэтому живут вместе с пулом
+        self.lookups = interncache()
+
+    async def open(self) -> None:
+        self.writer_conn = await self.connect()
+        # auto_vacuum применяется только к новому файлу, поэтому до смены journal_mode
+        await self.writer_conn.execute_fetchall("pragma auto_vacuum=incremental")
+        await self.writer_conn.execute_fetchall(f"pragma journal_mode={self.settings.journal_mode}")
+        for _ in range(self.settings.readers):
+            conn = await self.connect()
+            await conn.execute_fetchall("pragma query_only=on")
+            self.reader_conns.append(conn)
+            self.readers.put_nowait(conn)
+
+    async def connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path)
+        self.opened.append(conn)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute_fetchall(f"pragma busy_timeout={self.settings.busy_timeout}")
+        await conn.execute_fetchall(f"pragma synchronous={self.settings.synchronous}")
+        await conn.execute_fetchall(f"pragma mmap_size={self.settings.mmap_size}")
+        await conn.execute_fetchall(f"pragma cache_size={self.settings.cache_size}")
+        return conn
+
+    async def close(self) -> None:
+        async with self.write_lock:
+            self.writer_conn = None
+            for conn in self.opened:
+                await conn.close()
+        self.opened = []
+        self.reader_conns = []
+        self.readers = asyncio.Queue()
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self.write_lock:
+            if self.writer_conn is None:
+                raise RuntimeError("database pool is closed")
+            try:
+                yield self.writer_conn
+            except BaseException:
+                await self.writer_conn.rollback()
+                self.lookups.reset()
+                raise
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = await self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put_nowait(conn)
+
+
+pool: Optional[connectionpool] = None
+pool_lock = asyncio.Lock()
+
+# пул открывается в startup, но поднимается лениво, если DB_PATH сменился
+async def get_pool() -> connectionpool:
+    global pool
+    path = get_db_path()
+    if pool is not None and pool.path == path:
+        return pool
+    async with pool_lock:
+        if pool is not None and pool.path != path:
+            await pool.close()
+            pool = None
+        if pool is None:
+            candidate = connectionpool(path)
+            try:
+                await candidate.open()
+            except BaseException:
+                await candidate.close()
+                raise
+            pool = candidate
+        return pool
+
+
+async def open_pool() -> connectionpool:
+    return await get_pool()
+
+
+async def close_pool() -> None:
+    global pool, pool_lock
+    if pool is not None:
+        await pool.close()
+        pool = None
+    pool_lock = asyncio.Lock()
+
+
+@asynccontextmanager
+async def writer() -> AsyncIterator[aiosqlite.Connection]:
+    current = await get_pool()
+    async with current.writer() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def reader() -> AsyncIterator[aiosqlite.Connection]:
+    current = await get_pool()
+    async with current.reader() as conn:
+        yield conn
+
+
+async def lookup_cache() -> interncache:
+    return (await get_pool()).lookups
+
+
+# время в базе — целые миллисекунды unix epoch; наружу отдается iso-8601 в utc
+def epoch_ms(value: str) -> int:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return round(parsed.timestamp() * 1000)
+
+
+def format_ts(value: int) -> str:
+    seconds, millis = divmod(value, 1000)
+    text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+    return f"{text}.{millis:03d}Z" if millis else f"{text}Z"
+
+
+# ingested_at в прежнем виде datetime('now'): секунды, через пробел
+def format_ingested(value: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(value // 1000))
+
+# компактная строка: строки вынесены в словари (lookups), время — целые мс epoch
+def events_schema(table: str = "events") -> str:
+    return f"""
+        create table if not exists {table} (
+            id integer primary key autoincrement,
+            agent integer not null,
+            ts integer not null,
+            platform integer not null,
+            type integer not null,
+            cpu real,
+            mem_free integer,
+            pid integer,
+            proc integer,
+            rss integer,
+            ingested_at integer not null
+        )
+        """
+
+
+# инициализация базы: все шаги схемы сразу (тесты, утилиты). приложение вызывает prepare_db
 async def init_db() -> None:
-    async with aiosqlite.connect(get_db_path()) as conn:
+    await migrationrunner(schema_migrations).upgrade(writer)
+
+
+# старт приложения: быстрые шаги сейчас, долгие (индексы) остаются в schema.pending и идут фоном
+async def prepare_db() -> None:
+    await schema.upgrade(writer, background=True)
+
+
+# базовые таблицы; на базе до версионирования (user_version = 0) все уже есть, и шаг ничего не делает
+async def create_base_schema(conn: aiosqlite.Connection) -> None:
+    for statement in lookup_schema():
+        await conn.execute(statement)
+    await conn.execute(events_schema())
+    for statement in rollups.rollup_schema():
+        await conn.execute(statement)
+    for statement in procstats.procstats_schema():
+        await conn.execute(statement)
+
+
+# перевод старой таблицы с текстовыми колонками в компактную; id и позиция autoincrement сохраняются
+async def migrate_text_events(conn: aiosqlite.Connection) -> None:
+    columns = {row[1] for row in await conn.execute_fetchall("pragma table_info(events)")}
+    if "agent_id" not in columns:
+        return
+    rss = "e.rss" if "rss" in columns else "null"
+    sequence = await conn.execute_fetchall("select seq from sqlite_sequence where name = 'events'")
+    for table, column in (
+        ("agents", "agent_id"),
+        ("platforms", "platform"),
+        ("event_types", "event_type"),
+        ("proc_names", "proc_name"),
+    ):
         await conn.execute(
-            """
-            create table if not exists events (
-                id integer primary key autoincrement,
-                agent_id text not null,
-                ts text not null,
-                platform text not null,
-                event_type text not null,
-                cpu real,
-                mem_free integer,
-                pid integer,
-                proc_name text,
-                rss integer,
-                ingested_at text not null default (datetime('now'))
-            )
-            """
+            f"insert or ignore into {table} (name) select distinct {column} from events where {column} is not null"
         )
-        await conn.commit()
-        try:
-            await conn.execute("alter table events add column rss integer")
-            await conn.commit()
-        except aiosqlite.OperationalError:
-            pass
+    await conn.execute("drop table if exists events_compact")
+    await conn.execute(events_schema("events_compact"))
+    # julianday понимает любое смещение и дробные секунды
+    await conn.execute(
+        f"""
+        insert into events_compact (id, agent, ts, platform, type, cpu, mem_free, pid, proc, rss, ingested_at)
+        select
+            e.id,
+            a.id,
+            coalesce(
+                cast(round((julianday(e.ts) - 2440587.5) * 86400000) as integer),
+                cast(round((julianday(e.ingested_at) - 2440587.5) * 86400000) as integer)
+            ),
+            p.id,
+            t.id,
+            e.cpu,
+            e.mem_free,
+            e.pid,
+            n.id,
+            {rss},
+            cast(round((julianday(e.ingested_at) - 2440587.5) * 86400000) as integer)
+        from events e
+        join agents a on a.name = e.agent_id
+        join platforms p on p.name = e.platform
+        join event_types t on t.name = e.event_type
+        left join proc_names n on n.name = e.proc_name
+        order by e.id
+        """
+    )
+    moved = (await conn.execute_fetchall("select count(*) from events_compact"))[0][0]
+    await conn.execute("drop table events")
+    await conn.execute("alter table events_compact rename to events")
+    if sequence:
+        await conn.execute(
+            "update sqlite_sequence set seq = max(seq, ?) where name = 'events'", (sequence[0][0],)
+        )
+    logger.info("moved %d events to the compact layout", moved)
+
+
+# страницы старой таблицы уходят в freelist; при auto_vacuum=incremental возвращаем их сразу
+async def finish_text_events(conn: aiosqlite.Connection) -> None:
+    await conn.execute_fetchall("pragma incremental_vacuum")
+    (await get_pool()).lookups.reset()
 
-# запись событий
+
+# (id) уже покрыт rowid, отдельный индекс не нужен
+async def create_agent_index(conn: aiosqlite.Connection) -> None:
+    await conn.execute("create index if not exists events_agent_id on events (agent, id)")
+
+
+# ретеншн по возрасту удаляет порцию по диапазону индекса, не сканируя таблицу под блокировкой писателя
+async def create_retention_index(conn: aiosqlite.Connection) -> None:
+    await conn.execute("create index if not exists events_type_ingested on events (type, ingested_at)")
+
+
+# шаги схемы по порядку, номер — pragma user_version после шага. новые шаги только дописываются в конец;
+# построение индексов на большой таблице помечается background
+schema_migrations = (
+    migration(1, "base tables", create_base_schema),
+    migration(2, "compact events layout", migrate_text_events, finish=finish_text_events),
+    migration(3, "events (agent, id) index", create_agent_index, background=True),
+    migration(4, "events (type, ingested_at) index", create_retention_index, background=True),
+)
+
+schema = migrationrunner(schema_migrations)
+
+# колонки входной строки для insert_events
+insert_columns = (
+    "agent_id",
+    "ts",
+    "platform",
+    "event_type",
+    "cpu",
+    "mem_free",
+    "pid",
+    "proc_name",
+    "rss",
+)
+
+# колонки хранения: agent/platform/type/proc — ключи словарей, ts/ingested_at — мс epoch
+stored_columns = ("agent", "ts", "platform", "type", "cpu", "mem_free", "pid", "proc", "rss", "ingested_at")
+
+# лимит строк на один multi-row insert (10 параметров на строку, держимся ниже 999)
+insert_chunk_rows = 90
+
+
+def build_insert_sql(count: int) -> str:
+    placeholders = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"] * count)
+    return f"insert into events ({', '.join(stored_columns)}) values {placeholders} returning id"
+
+# запись событий: один insert ... returning на пачку, без select по каждой строке
+@timed()
 async def insert_events(rows: Iterable[tuple[Any, ...]]) -> list[dict[str, Any]]:
-    async with aiosqlite.connect(get_db_path()) as conn:
-        conn.row_factory = aiosqlite.Row
-        inserted: list[dict[str, Any]] = []
-        for row in rows:
-            cursor = await conn.execute(
-                """
-                insert into events (
-                    agent_id,
-                    ts,
-                    platform,
-                    event_type,
-                    cpu,
-                    mem_free,
-                    pid,
-                    proc_name,
-                    rss
-                )
-                values (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                row,
-            )
-            event_id = cursor.lastrowid
-            detail_cursor = await conn.execute(
-                """
-                select
-                    id,
-                    agent_id,
-                    ts,
-                    platform,
-                    event_type,
+    pending = list(rows)
+    inserted: list[dict[str, Any]] = []
+    if not pending:
+        return inserted
+    now = round(time.time() * 1000)
+    ingested_at = format_ingested(now)
+    # в пачке один-два разных ts: разбираем каждый один раз
+    stamps: dict[str, int] = {}
+    for row in pending:
+        if row[1] not in stamps:
+            stamps[row[1]] = epoch_ms(row[1])
+    texts = {value: format_ts(value) for value in set(stamps.values())}
+    cache = await lookup_cache()
+    async with writer() as conn:
+        agents = await cache.intern(conn, "agents", (row[0] for row in pending))
+        platforms = await cache.intern(conn, "platforms", (row[2] for row in pending))
+        types = await cache.intern(conn, "event_types", (row[3] for row in pending))
+        procs = await cache.intern(conn, "proc_names", (row[7] for row in pending))
+        for offset in range(0, len(pending), insert_chunk_rows):
+            chunk = pending[offset : offset + insert_chunk_rows]
+            params: list[Any] = []
+            for agent_id, ts, platform, event_type, cpu, mem_free, pid, proc_name, rss in chunk:
+                params += (
+                    agents[agent_id],
+                    stamps[ts],
+                    platforms[platform],
+                    types[event_type],
                     cpu,
                     mem_free,
                     pid,
-                    proc_name,
+                    procs[proc_name] if proc_name is not None else None,
                     rss,
-                    ingested_at
-                from events
-                where id = ?
-                """,
-                (event_id,),
-            )
-            detail = await detail_cursor.fetchone()
-            if detail:
-                inserted.append(dict(detail))
+                    now,
+                )
+            cursor = await conn.execute(build_insert_sql(len(chunk)), params)
+            returned = sorted(item[0] for item in await cursor.fetchall())
+            for row, event_id in zip(chunk, returned):
+                record = dict(zip(insert_columns, row))
+                record["id"] = event_id
+                record["ts"] = texts[stamps[row[1]]]
+                record["ingested_at"] = ingested_at
+                inserted.append(record)
+        await rollups.apply(conn, inserted)
+        await procstats.apply(conn, inserted)
         await conn.commit()
-        return inserted
+    return inserted
 
-# выборка
-async def fetch_events(agent_id: Optional[str], limit: int) -> list[dict[str, Any]]:
-    async with aiosqlite.connect(get_db_path()) as conn:
-        conn.row_factory = aiosqlite.Row
+# колонки выдачи
+select_columns = (
+    "id",
+    "agent_id",
+    "ts",
+    "platform",
+    "event_type",
+    "cpu",
+    "mem_free",
+    "pid",
+    "proc_name",
+    "rss",
+    "ingested_at",
+)
+
+# те же колонки в хранении
+read_columns = ", ".join(("id", "agent", "ts", "platform", "type", "cpu", "mem_free", "pid", "proc", "rss", "ingested_at"))
+
+
+# строки хранения -> словари в прежнем виде: имена вместо ключей, время текстом; одинаковое время форматируем один раз
+async def decode_events(conn: aiosqlite.Connection, rows: Iterable[Any]) -> list[dict[str, Any]]:
+    rows = list(rows)
+    if not rows:
+        return []
+    cache = await lookup_cache()
+    agents = await cache.resolve(conn, "agents", (row[1] for row in rows))
+    platforms = await cache.resolve(conn, "platforms", (row[3] for row in rows))
+    types = await cache.resolve(conn, "event_types", (row[4] for row in rows))
+    procs = await cache.resolve(conn, "proc_names", (row[8] for row in rows))
+    stamps: dict[int, str] = {}
+    added: dict[int, str] = {}
+    result = []
+    for event_id, agent, ts, platform, kind, cpu, mem_free, pid, proc, rss, ingested_at in rows:
+        ts_text = stamps.get(ts)
+        if ts_text is None:
+            ts_text = stamps[ts] = format_ts(ts)
+        ingested_text = added.get(ingested_at)
+        if ingested_text is None:
+            ingested_text = added[ingested_at] = format_ingested(ingested_at)
+        result.append(
+            {
+                "id": event_id,
+                "agent_id": agents[agent],
+                "ts": ts_text,
+                "platform": platforms[platform],
+                "event_type": types[kind],
+                "cpu": cpu,
+                "mem_free": mem_free,
+                "pid": pid,
+                "proc_name": procs[proc] if proc is not None else None,
+                "rss": rss,
+                "ingested_at": ingested_text,
+            }
+        )
+    return result
+
+
+async def agent_key(conn: aiosqlite.Connection, agent_id: str) -> Optional[int]:
+    return await (await lookup_cache()).key(conn, "agents", agent_id)
+
+# выборка: новые сверху, курсор по id (before_id — страница старее, after_id — новее)
+@timed()
+async def fetch_events(
+    agent_id: Optional[str],
+    limit: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    event_type: Optional[str] = None,
+) -> list[dict[str, Any]]:
+    conditions: list[str] = []
+    params: list[Any] = []
+    if before_id is not None:
+        conditions.append("id < ?")
+        params.append(before_id)
+    if after_id is not None:
+        conditions.append("id > ?")
+        params.append(after_id)
+    # при after_id без before_id берем ближайшие к курсору строки и разворачиваем
+    ascending = after_id is not None and before_id is None
+    order = "asc" if ascending else "desc"
+    async with reader() as conn:
+        if event_type is not None:
+            type_key = await (await lookup_cache()).key(conn, "event_types", event_type)
+            if type_key is None:
+                return []
+            conditions.append("type = ?")
+            params.append(type_key)
         if agent_id:
-            cursor = await conn.execute(
-                """
-                select
-                    id,
-                    agent_id,
-                    ts,
-                    platform,
-                    event_type,
-                    cpu,
-                    mem_free,
-                    pid,
-                    proc_name,
-                    rss,
-                    ingested_at
-                from events
-                where agent_id = ?
-                order by ingested_at desc
-                limit ?
-                """,
-                (agent_id, limit),
-            )
-        else:
-            cursor = await conn.execute(
-                """
-                select
-                    id,
-                    agent_id,
-                    ts,
-                    platform,
-                    event_type,
-                    cpu,
-                    mem_free,
-                    pid,
-                    proc_name,
-                    rss,
-                    ingested_at
-                from events
-                order by ingested_at desc
-                limit ?
-                """,
-                (limit,),
-            )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+            key = await agent_key(conn, agent_id)
+            if key is None:
+                return []
+            conditions.insert(0, "agent = ?")
+            params.insert(0, key)
+        where = f"where {' and '.join(conditions)}" if conditions else ""
+        params.append(limit)
+        cursor = await conn.execute(
+            f"""
+            select {read_columns}
+            from events
+            {where}
+            order by id {order}
+            limit ?
+            """,
+            params,
+        )
+        rows = await decode_events(conn, await cursor.fetchall())
+    if ascending:
+        rows.reverse()
+    return rows
+
+# выгрузка: страница на одно короткое чтение, внутри нее fetchmany порциями
+stream_page_rows = 5000
+stream_fetch_rows = 500
 
-# очистка
+# все подходящие строки по возрастанию id; читатель пула не держится, пока клиент читает ответ
+async def iter_events(
+    agent_id: Optional[str],
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    after_id: int = 0,
+) -> AsyncIterator[list[dict[str, Any]]]:
+    conditions = ["id > ?"]
+    filters: list[Any] = []
+    if agent_id:
+        async with reader() as conn:
+            key = await agent_key(conn, agent_id)
+        if key is None:
+            return
+        conditions.append("agent = ?")
+        filters.append(key)
+    # ts — целые мс utc, сравнение без разбора строк
+    if start is not None:
+        conditions.append("ts >= ?")
+        filters.append(epoch_ms(start))
+    if end is not None:
+        conditions.append("ts < ?")
+        filters.append(epoch_ms(end))
+    sql = f"""
+        select {read_columns}
+        from events
+        where {' and '.join(conditions)}
+        order by id
+        limit ?
+        """
+    cursor_id = after_id
+    while True:
+        batches: list[list[dict[str, Any]]] = []
+        async with reader() as conn:
+            cursor = await conn.execute(sql, (cursor_id, *filters, stream_page_rows))
+            while True:
+                rows = await cursor.fetchmany(stream_fetch_rows)
+                if not rows:
+                    break
+                batches.append(await decode_events(conn, rows))
+            await cursor.close()
+        for batch in batches:
+            yield batch
+        fetched = sum(len(batch) for batch in batches)
+        if fetched < stream_page_rows:
+            return
+        cursor_id = batches[-1][-1]["id"]
+
+# размер одного delete при очистке и ретеншне; писатель освобождается между порциями
+delete_chunk_rows = 1000
+
+
+@timed()
+async def delete_chunk(where: str, params: Iterable[Any], limit: int) -> int:
+    async with writer() as conn:
+        cursor = await conn.execute(
+            f"""
+            delete from events
+            where id in (select id from events where {where} limit ?)
+            """,
+            (*params, limit),
+        )
+        await conn.commit()
+        return cursor.rowcount or 0
+
+# очистка порциями, чтобы не держать блокировку на всю таблицу
 async def remove_events(agent_id: Optional[str]) -> int:
-    async with aiosqlite.connect(get_db_path()) as conn:
-        if agent_id:
-            cursor = await conn.execute(
-                "delete from events where agent_id = ?",
-                (agent_id,),
-            )
+    where, params = "1 = 1", ()
+    if agent_id:
+        async with reader() as conn:
+            key = await agent_key(conn, agent_id)
+        # агент без ключа в словаре: строк у него нет
+        where, params = ("agent = ?", (key,)) if key is not None else ("0 = 1", ())
+    removed = 0
+    while True:
+        deleted = await delete_chunk(where, params, delete_chunk_rows)
+        removed += deleted
+        if deleted < delete_chunk_rows:
+            break
+    async with writer() as conn:
+        await rollups.remove(conn, agent_id)
+        await procstats.remove(conn, agent_id)
+        await conn.commit()
+    return removed
+
+# порция старых событий; types=None — все типы, кроме excluded
+async def delete_expired(
+    cutoff: str,
+    types: Optional[list[str]],
+    excluded: list[str],
+    limit: int,
+) -> int:
+    conditions = ["ingested_at < ?"]
+    params: list[Any] = [epoch_ms(cutoff)]
+    cache = await lookup_cache()
+    async with reader() as conn:
+        if types is not None:
+            keys = await cache.keys(conn, "event_types", types)
         else:
-            cursor = await conn.execute("delete from events")
+            # "все, кроме" разворачивается в явный список типов, чтобы выборка шла по (type, ingested_at)
+            skipped = set(await cache.keys(conn, "event_types", excluded))
+            keys = [row[0] for row in await conn.execute_fetchall("select id from event_types") if row[0] not in skipped]
+    conditions.append(f"type in ({', '.join('?' for _ in keys)})")
+    params.extend(keys)
+    return await delete_chunk(" and ".join(conditions), params, limit)
+
+# порция строк старше cutoff для выгрузки в архив, по возрастанию id
+@timed()
+async def fetch_archivable(cutoff: str, after_id: int, limit: int) -> list[dict[str, Any]]:
+    async with reader() as conn:
+        cursor = await conn.execute(
+            f"""
+            select {read_columns}
+            from events
+            where id > ? and ingested_at < ?
+            order by id
+            limit ?
+            """,
+            (after_id, epoch_ms(cutoff), limit),
+        )
+        return await decode_events(conn, await cursor.fetchall())
+
+# удаление выгруженного диапазона; условие то же, что при выборке
+async def delete_archived(first_id: int, last_id: int, cutoff: str) -> int:
+    removed = 0
+    while True:
+        deleted = await delete_chunk(
+            "id between ? and ? and ingested_at < ?", (first_id, last_id, epoch_ms(cutoff)), delete_chunk_rows
+        )
+        removed += deleted
+        if deleted < delete_chunk_rows:
+            return removed
+
+# агенты, у которых строк больше лимита
+@timed()
+async def agents_over_limit(max_rows: int) -> list[tuple[str, int]]:
+    async with reader() as conn:
+        rows = await conn.execute_fetchall(
+            "select agent, count(*) from events group by agent having count(*) > ?",
+            (max_rows,),
+        )
+        names = await (await lookup_cache()).resolve(conn, "agents", (row[0] for row in rows))
+    return [(names[row[0]], row[1]) for row in rows]
+
+# порция строк агента сверх последних keep
+@timed()
+async def trim_agent(agent_id: str, keep: int, limit: int) -> int:
+    async with reader() as conn:
+        key = await agent_key(conn, agent_id)
+        rows = await conn.execute_fetchall(
+            "select id from events where agent = ? order by id desc limit 1 offset ?",
+            (key, keep),
+        )
+    if not rows:
+        return 0
+    return await delete_chunk("agent = ? and id <= ?", (key, rows[0][0]), limit)
+
+# возврат свободных страниц и checkpoint wal
+@timed()
+async def compact(vacuum_pages: int) -> None:
+    async with writer() as conn:
+        await conn.execute_fetchall(f"pragma incremental_vacuum({vacuum_pages})")
+        await conn.execute_fetchall("pragma wal_checkpoint(passive)")
+
+# ряд метрик из сверток
+@timed()
+async def fetch_metric_series(
+    agent_id: str,
+    start: float,
+    end: float,
+    step: Optional[int],
+) -> dict[str, Any]:
+    async with reader() as conn:
+        return await rollups.fetch_series(conn, agent_id, start, end, step)
+
+
+# порция устаревших корзин сверток процессов
+@timed()
+async def prune_proc_rollups(resolution: int, cutoff: float, limit: int) -> int:
+    async with writer() as conn:
+        deleted = await procstats.prune(conn, resolution, cutoff, limit)
         await conn.commit()
-        return cursor.rowcount or 0
+        return deleted
+
+# top-N процессов из сверток
+@timed()
+async def fetch_top_procs(
+    agent_id: str,
+    start: float,
+    window: int,
+    by: str,
+    limit: int,
+) -> dict[str, Any]:
+    async with reader() as conn:
+        return await procstats.fetch_top(conn, agent_id, start, window, by, limit)
+
+# последняя строка и последняя метрика каждого агента; агенты берутся из словаря, строки — по индексу (agent, id)
+@timed()
+async def fetch_latest_states() -> list[tuple[dict[str, Any], Optional[dict[str, Any]]]]:
+    result: list[tuple[dict[str, Any], Optional[dict[str, Any]]]] = []
+    async with reader() as conn:
+        metric = await (await lookup_cache()).key(conn, "event_types", "metric")
+        for (key,) in await conn.execute_fetchall("select id from agents order by name"):
+            latest = await conn.execute_fetchall(
+                f"select {read_columns} from events where agent = ? order by id desc limit 1", (key,)
+            )
+            if not latest:
+                continue
+            metrics = []
+            if metric is not None:
+                metrics = await conn.execute_fetchall(
+                    f"select {read_columns} from events where agent = ? and type = ? order by id desc limit 1",
+                    (key, metric),
+                )
+            decoded = await decode_events(conn, [*latest, *metrics])
+            result.append((decoded[0], decoded[1] if len(decoded) > 1 else None))
+    return result
+
 
+# последний выданный id событий; sqlite_sequence помнит и удаленные строки
+@timed()
+async def latest_event_id() -> int:
+    async with reader() as conn:
+        rows = await conn.execute_fetchall("select seq from sqlite_sequence where name = 'events'")
+    return rows[0][0] if rows else 0
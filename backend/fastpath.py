@@ -0,0 +1,179 @@
+import math
+import re
+from datetime import datetime
+from typing import Any, Optional
+import orjson
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from .models import ingestbatch
+
+# только канонический ISO-8601; все прочие формы (epoch, недели, 't'/'z') разбирает pydantic
+iso_datetime = re.compile(
+    r"\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d{1,9})?)?(Z|[+-]\d{2}:\d{2})?)?"
+)
+
+batch_keys = frozenset(("agent_id", "ts", "platform", "events"))
+event_keys = frozenset(("type", "cpu", "mem_free", "pid", "name", "rss"))
+
+
+class slowpath(Exception):
+    pass
+
+
+def check_int(value: Any) -> Optional[int]:
+    if value is None or (type(value) is int):
+        return value
+    raise slowpath()
+
+
+def check_float(value: Any) -> Optional[float]:
+    if value is None:
+        return None
+    kind = type(value)
+    if kind is float:
+        # NaN/inf разбирает pydantic, он же дает понятную 422
+        if not math.isfinite(value):
+            raise slowpath()
+        return value
+    if kind is int:
+        return float(value)
+    raise slowpath()
+
+
+def check_text(value: Any) -> str:
+    if type(value) is not str or not value:
+        raise slowpath()
+    return value
+
+# быстрый разбор типичного тела по правилам models.py; при любом отклонении — slowpath
+def fast_rows(payload: Any) -> list[tuple[Any, ...]]:
+    if type(payload) is not dict or payload.keys() != batch_keys:
+        raise slowpath()
+    agent_id = check_text(payload["agent_id"])
+    platform = check_text(payload["platform"]).lower()
+    ts = payload["ts"]
+    if type(ts) is not str or not iso_datetime.fullmatch(ts):
+        raise slowpath()
+    try:
+        ts_value = datetime.fromisoformat(ts).isoformat()
+    except ValueError:
+        raise slowpath()
+    events = payload["events"]
+    if type(events) is not list or not events:
+        raise slowpath()
+    rows = []
+    for event in events:
+        if type(event) is not dict or not event.keys() <= event_keys:
+            raise slowpath()
+        name = event.get("name")
+        if name is not None and type(name) is not str:
+            raise slowpath()
+        rows.append(
+            (
+                agent_id,
+                ts_value,
+                platform,
+                check_text(event.get("type")).lower(),
+                check_float(event.get("cpu")),
+                check_int(event.get("mem_free")),
+                check_int(event.get("pid")),
+                name,
+                check_int(event.get("rss")),
+            )
+        )
+    return rows
+
+
+def model_rows(batch: ingestbatch) -> list[tuple[Any, ...]]:
+    ts_value = batch.ts.isoformat()
+    return [
+        (
+            batch.agent_id,
+            ts_value,
+            batch.platform,
+            event.type,
+            event.cpu,
+            event.mem_free,
+            event.pid,
+            event.name,
+            event.rss,
+        )
+        for event in batch.events
+    ]
+
+# тело запроса -> строки для insert_events; ошибки валидации — как у pydantic
+def decode_rows(body: bytes) -> list[tuple[Any, ...]]:
+    try:
+        return fast_rows(orjson.loads(body))
+    except (slowpath, orjson.JSONDecodeError):
+        pass
+    try:
+        batch = ingestbatch.model_validate_json(body)
+    except ValidationError as exc:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in exc.errors()]
+        )
+    return model_rows(batch)
+
+
+# строка базы -> payload как у eventrecord.from_row(...).model_dump(mode="json")
+def render_event(row: dict[str, Any]) -> dict[str, Any]:
+    ts = row["ts"]
+    if ts.endswith("+00:00"):
+        ts = ts[:-6] + "Z"
+    return {
+        "id": row["id"],
+        "agent_id": row["agent_id"],
+        "ts": ts,
+        "platform": row["platform"],
+        "event_type": row["event_type"],
+        "cpu": row["cpu"],
+        "mem_free": row["mem_free"],
+        "pid": row["pid"],
+        "proc_name": row["proc_name"],
+        "rss": row["rss"],
+        "ingested_at": row["ingested_at"].replace(" ", "T", 1),
+    }
+
+
+# разобранный объект пачки -> строки; ValidationError, если не проходит модели
+def payload_rows(payload: Any) -> list[tuple[Any, ...]]:
+    try:
+        return fast_rows(payload)
+    except slowpath:
+        pass
+    return model_rows(ingestbatch.model_validate(payload))
+
+
+def describe_error(exc: ValidationError) -> str:
+    error = exc.errors()[0]
+    location = ".".join(str(part) for part in error["loc"])
+    return f"{location}: {error['msg']}" if location else error["msg"]
+
+
+# тело backlog: {"batches": [{"batch_id": "...", "batch": {...}}, ...]} -> (batch_id, строки или текст ошибки).
+# битая пачка не валит весь запрос: агент получает по ней ошибку и может выбросить ее из очереди
+def decode_backlog(body: bytes) -> list[tuple[Optional[str], list[tuple[Any, ...]] | str]]:
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise RequestValidationError([{"type": "json_invalid", "loc": ("body",), "msg": "invalid json", "input": None}])
+    batches = payload.get("batches") if type(payload) is dict else None
+    if type(batches) is not list:
+        raise RequestValidationError(
+            [{"type": "list_type", "loc": ("body", "batches"), "msg": "batches must be a list", "input": None}]
+        )
+    decoded: list[tuple[Optional[str], list[tuple[Any, ...]] | str]] = []
+    for item in batches:
+        if type(item) is not dict or "batch" not in item:
+            decoded.append((None, "item must be an object with a batch"))
+            continue
+        batch_id = item.get("batch_id")
+        if batch_id is not None and type(batch_id) is not str:
+            decoded.append((None, "batch_id must be a string"))
+            continue
+        try:
+            decoded.append((batch_id, payload_rows(item["batch"])))
+        except ValidationError as exc:
+            decoded.append((batch_id, describe_error(exc)))
+    return decoded
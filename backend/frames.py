@@ -0,0 +1,285 @@
+import gzip
+import math
+import os
+import struct
+import zlib
+from datetime import datetime
+from typing import Any, Iterator, Optional
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from .fastpath import decode_backlog, decode_rows, fast_rows, iso_datetime, model_rows, slowpath
+from .models import ingestbatch
+
+try:
+    import msgpack
+except ImportError:  # msgpack необязателен
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен
+    zstandard = None
+
+json_types = ("application/json", "")
+frame_type = "application/x-telemetry-frame"
+msgpack_types = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+# колоночный кадр, little endian:
+#   b"TLF1", text agent_id, text ts, text platform      (text = u16 длина + utf-8)
+#   u8 число типов, text * число типов
+#   u32 n, u8[n] индекс типа, u8[n] флаги присутствия полей
+#   f64 cpu, i64 mem_free, i64 pid, i64 rss — только присутствующие значения, колонками
+#   text name для событий с флагом name
+frame_magic = b"TLF1"
+has_cpu = 1
+has_mem_free = 2
+has_pid = 4
+has_name = 8
+has_rss = 16
+all_flags = has_cpu | has_mem_free | has_pid | has_name | has_rss
+
+
+# ограничение на распакованное тело
+class framesettings:
+    def __init__(self) -> None:
+        self.max_decoded_bytes = max(1, int(os.getenv("INGEST_MAX_DECODED_BYTES", str(16 * 1024 * 1024))))
+
+
+class unsupportedformat(ValueError):
+    pass
+
+
+class bodytoolarge(ValueError):
+    pass
+
+
+def invalid_body(message: str) -> RequestValidationError:
+    return RequestValidationError([{"type": "value_error", "loc": ("body",), "msg": message, "input": None}])
+
+
+class framereader:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt: str) -> tuple[Any, ...]:
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def raw(self, size: int) -> bytes:
+        end = self.offset + size
+        if end > len(self.data):
+            raise struct.error("frame truncated")
+        chunk = self.data[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def text(self) -> str:
+        (size,) = self.unpack("<H")
+        return self.raw(size).decode("utf-8")
+
+
+def column(reader: framereader, code: str, count: int) -> Iterator[Any]:
+    return iter(reader.unpack(f"<{count}{code}") if count else ())
+
+
+def decode_frame(data: bytes) -> list[tuple[Any, ...]]:
+    try:
+        return read_frame(framereader(data))
+    except (struct.error, UnicodeDecodeError, IndexError, ValueError):
+        raise invalid_body("malformed telemetry frame")
+
+
+def read_frame(reader: framereader) -> list[tuple[Any, ...]]:
+    if reader.raw(4) != frame_magic:
+        raise ValueError("bad magic")
+    agent_id = reader.text()
+    ts = reader.text()
+    platform = reader.text().lower()
+    if not agent_id or not platform or not iso_datetime.fullmatch(ts):
+        raise ValueError("bad header")
+    ts_value = datetime.fromisoformat(ts).isoformat()
+    (type_count,) = reader.unpack("<B")
+    types = [reader.text().lower() for _ in range(type_count)]
+    if not all(types):
+        raise ValueError("empty type")
+    (count,) = reader.unpack("<I")
+    if not count:
+        raise ValueError("events must not be empty")
+    type_index = reader.raw(count)
+    flags = reader.raw(count)
+    totals = {flag: 0 for flag in (has_cpu, has_mem_free, has_pid, has_name, has_rss)}
+    for value in flags:
+        if value & ~all_flags:
+            raise ValueError("unknown field flag")
+        for flag in totals:
+            if value & flag:
+                totals[flag] += 1
+    cpu_values = list(column(reader, "d", totals[has_cpu]))
+    if not all(map(math.isfinite, cpu_values)):
+        raise ValueError("non-finite cpu")
+    cpu = iter(cpu_values)
+    mem_free = column(reader, "q", totals[has_mem_free])
+    pid = column(reader, "q", totals[has_pid])
+    rss = column(reader, "q", totals[has_rss])
+    names = iter([reader.text() for _ in range(totals[has_name])])
+    if reader.offset != len(reader.data):
+        raise ValueError("trailing bytes")
+    return [
+        (
+            agent_id,
+            ts_value,
+            platform,
+            types[index],
+            next(cpu) if value & has_cpu else None,
+            next(mem_free) if value & has_mem_free else None,
+            next(pid) if value & has_pid else None,
+            next(names) if value & has_name else None,
+            next(rss) if value & has_rss else None,
+        )
+        for index, value in zip(type_index, flags)
+    ]
+
+
+def pack_text(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return struct.pack("<H", len(encoded)) + encoded
+
+# payload в формате /api/ingest -> кадр (эмиттер, тесты, агенты)
+def encode_frame(payload: dict) -> bytes:
+    events = payload["events"]
+    types: dict[str, int] = {}
+    type_index = bytearray()
+    flags = bytearray()
+    cpu: list[float] = []
+    mem_free: list[int] = []
+    pid: list[int] = []
+    rss: list[int] = []
+    names: list[bytes] = []
+    for event in events:
+        type_index.append(types.setdefault(event["type"], len(types)))
+        value = 0
+        if event.get("cpu") is not None:
+            value |= has_cpu
+            cpu.append(event["cpu"])
+        if event.get("mem_free") is not None:
+            value |= has_mem_free
+            mem_free.append(event["mem_free"])
+        if event.get("pid") is not None:
+            value |= has_pid
+            pid.append(event["pid"])
+        if event.get("name") is not None:
+            value |= has_name
+            names.append(pack_text(event["name"]))
+        if event.get("rss") is not None:
+            value |= has_rss
+            rss.append(event["rss"])
+        flags.append(value)
+    parts = [
+        frame_magic,
+        pack_text(payload["agent_id"]),
+        pack_text(payload["ts"]),
+        pack_text(payload["platform"]),
+        struct.pack("<B", len(types)),
+        *(pack_text(name) for name in types),
+        struct.pack("<I", len(events)),
+        bytes(type_index),
+        bytes(flags),
+        struct.pack(f"<{len(cpu)}d", *cpu),
+        struct.pack(f"<{len(mem_free)}q", *mem_free),
+        struct.pack(f"<{len(pid)}q", *pid),
+        struct.pack(f"<{len(rss)}q", *rss),
+        *names,
+    ]
+    return b"".join(parts)
+
+
+def decode_msgpack(data: bytes) -> list[tuple[Any, ...]]:
+    try:
+        payload = msgpack.unpackb(data, raw=False)
+    except Exception:
+        raise invalid_body("malformed msgpack body")
+    try:
+        return fast_rows(payload)
+    except slowpath:
+        pass
+    try:
+        batch = ingestbatch.model_validate(payload)
+    except ValidationError as exc:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in exc.errors()]
+        )
+    return model_rows(batch)
+
+
+def decompress(data: bytes, encoding: str, limit: int) -> bytes:
+    if encoding == "gzip":
+        inflater = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        try:
+            result = inflater.decompress(data, limit + 1)
+        except zlib.error:
+            raise invalid_body("malformed gzip body")
+    elif encoding == "zstd" and zstandard is not None:
+        reader = zstandard.ZstdDecompressor().stream_reader(data)
+        chunks = []
+        size = 0
+        try:
+            while size <= limit:
+                chunk = reader.read(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+        except zstandard.ZstdError:
+            raise invalid_body("malformed zstd body")
+        result = b"".join(chunks)
+    else:
+        raise unsupportedformat(f"unsupported content encoding: {encoding}")
+    if len(result) > limit:
+        raise bodytoolarge("decoded body too large")
+    return result
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise unsupportedformat(f"unsupported content encoding: {encoding}")
+
+
+# подпись проверяется по телу как оно пришло (до распаковки), затем разбор по content-type
+def decode_body(
+    body: bytes,
+    content_type: Optional[str],
+    content_encoding: Optional[str],
+    settings: framesettings,
+) -> list[tuple[Any, ...]]:
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding != "identity":
+        body = decompress(body, encoding, settings.max_decoded_bytes)
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in json_types:
+        return decode_rows(body)
+    if media_type == frame_type:
+        return decode_frame(body)
+    if media_type in msgpack_types and msgpack is not None:
+        return decode_msgpack(body)
+    raise unsupportedformat(f"unsupported content type: {media_type}")
+
+
+# backlog принимает только json (опционально сжатый): элементы — сохраненные агентом тела как есть
+def decode_backlog_body(
+    body: bytes,
+    content_type: Optional[str],
+    content_encoding: Optional[str],
+    settings: framesettings,
+) -> list[tuple[Optional[str], list[tuple[Any, ...]] | str]]:
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding != "identity":
+        body = decompress(body, encoding, settings.max_decoded_bytes)
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type not in json_types:
+        raise unsupportedformat(f"unsupported content type: {media_type}")
+    return decode_backlog(body)
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from .admission import overloaded
+
+# batch id задает агент (X-Batch-Id или поле batch_id в backlog); уникален в пределах агента
+batch_id_pattern = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+
+batchkey = tuple[str, str]
+
+
+# настройки индекса идемпотентности
+class idempotencysettings:
+    def __init__(self) -> None:
+        self.ttl = max(1, int(os.getenv("INGEST_IDEMPOTENCY_TTL", "21600")))
+        self.max_entries = max(1, int(os.getenv("INGEST_IDEMPOTENCY_MAX", "250000")))
+        self.backlog_max_batches = max(1, int(os.getenv("INGEST_BACKLOG_MAX_BATCHES", "500")))
+        # сколько повтор ждет первую попытку, тот же предел, что и ожидание слота записи
+        self.wait_ms = max(0, int(os.getenv("INGEST_ADMISSION_WAIT_MS", "1000")))
+
+
+def valid_batch_id(value: Any) -> bool:
+    return type(value) is str and batch_id_pattern.fullmatch(value) is not None
+
+
+def batch_key(agent_id: str, batch_id: Optional[str]) -> Optional[batchkey]:
+    return (agent_id, batch_id) if batch_id else None
+
+
+# (агент, batch id) -> ответ первой записи; ограничен по размеру и времени, старые записи вытесняются.
+# вытеснение здесь безопасно: оно лишь ослабляет дедупликацию, от повторов подписей защищает replay store
+class idempotencyindex:
+    def __init__(self, settings: idempotencysettings | None = None) -> None:
+        self.settings = settings or idempotencysettings()
+        self.entries: OrderedDict[batchkey, tuple[float, dict]] = OrderedDict()
+        # пачки, которые сейчас пишутся: повтор ждет результата первой попытки, а не пишет второй раз
+        self.inflight: dict[batchkey, asyncio.Future] = {}
+        self.duplicates = 0
+        self.evicted = 0
+        self.timed_out = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def expire(self, now: float) -> None:
+        while self.entries:
+            key, (stored_at, _) = next(iter(self.entries.items()))
+            if now - stored_at <= self.settings.ttl:
+                break
+            del self.entries[key]
+
+    def lookup(self, key: batchkey) -> Optional[dict]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[0] > self.settings.ttl:
+            del self.entries[key]
+            return None
+        return entry[1]
+
+    def remember(self, key: batchkey, result: dict) -> None:
+        now = time.time()
+        self.expire(now)
+        self.entries[key] = (now, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.settings.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    # None — пачка новая и закреплена за вызывающим (он обязан вызвать settle), иначе ответ первой записи.
+    # первая попытка может стоять в очереди писателя долго: повтор ждет ее не дольше wait_ms, потом overloaded (503)
+    async def claim(self, key: batchkey) -> Optional[dict]:
+        deadline = time.monotonic() + self.settings.wait_ms / 1000
+        while True:
+            result = self.lookup(key)
+            if result is not None:
+                self.duplicates += 1
+                return result
+            pending = self.inflight.get(key)
+            if pending is None:
+                self.inflight[key] = asyncio.get_running_loop().create_future()
+                return None
+            try:
+                await asyncio.wait_for(asyncio.shield(pending), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise overloaded("batch is still being written by an earlier attempt")
+
+    # result=None — запись не удалась, ожидающие повторы попробуют сами
+    def settle(self, key: batchkey, result: Optional[dict]) -> None:
+        if result is not None:
+            self.remember(key, result)
+        pending = self.inflight.pop(key, None)
+        if pending is not None and not pending.done():
+            pending.set_result(result)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def snapshot(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.settings.max_entries,
+            "ttl": self.settings.ttl,
+            "inflight": len(self.inflight),
+            "duplicates": self.duplicates,
+            "evicted": self.evicted,
+            "timed_out": self.timed_out,
+        }
+
+
+# пачки backlog, прошедшие разбор, и ошибки по позициям остальных
+def split_backlog(
+    decoded: list[tuple[Optional[str], list[tuple] | str]],
+) -> tuple[list[tuple[Optional[batchkey], list[tuple]]], dict[int, dict]]:
+    batches: list[tuple[Optional[batchkey], list[tuple]]] = []
+    errors: dict[int, dict] = {}
+    for position, (batch_id, rows) in enumerate(decoded):
+        if isinstance(rows, str):
+            errors[position] = {"error": rows}
+        elif batch_id is not None and not valid_batch_id(batch_id):
+            errors[position] = {"error": "invalid batch_id"}
+        else:
+            batches.append((batch_key(rows[0][0], batch_id), rows))
+    return batches, errors
+
+
+def merge_backlog(errors: dict[int, dict], results: list[dict]) -> list[dict]:
+    accepted = iter(results)
+    return [errors[position] if position in errors else next(accepted) for position in range(len(errors) + len(results))]
+
+
+# ответ /api/ingest/backlog: результат на каждую пачку в исходном порядке плюс итоги
+def backlog_response(batch_ids: list[Optional[str]], results: list[dict]) -> dict:
+    stored = 0
+    duplicates = 0
+    rejected = 0
+    items = []
+    for batch_id, result in zip(batch_ids, results):
+        if "error" in result:
+            rejected += 1
+        elif result.get("duplicate"):
+            duplicates += 1
+        else:
+            stored += result.get("stored", result.get("queued", 0))
+        items.append({"batch_id": batch_id, **result})
+    return {"results": items, "events": stored, "duplicates": duplicates, "rejected": rejected}
@@ -0,0 +1,177 @@
+import functools
+import os
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Optional, ParamSpec, TypeVar
+
+# границы корзин задержек, секунды
+latency_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+collector = Callable[[], Awaitable[list[tuple[dict[str, str], float]]]]
+params = ParamSpec("params")
+result = TypeVar("result")
+
+
+# включение метрик
+class metricssettings:
+    def __init__(self) -> None:
+        self.enabled = os.getenv("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+# при выключенных метриках таймер ничего не делает и не аллоцирует
+class nulltimer:
+    __slots__ = ()
+
+    def __enter__(self) -> "nulltimer":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        return None
+
+
+null_timer = nulltimer()
+
+
+class stagetimer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "histogram", labels: tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self) -> "stagetimer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+# гистограмма с фиксированными корзинами; счетчики по корзинам, кумулятивно — только при выдаче
+class histogram:
+    def __init__(
+        self,
+        registry: "metricsregistry",
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = latency_buckets,
+    ) -> None:
+        self.registry = registry
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.series: dict[tuple[str, ...], list[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        if not self.registry.enabled:
+            return
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels: str) -> stagetimer | nulltimer:
+        if not self.registry.enabled:
+            return null_timer
+        return stagetimer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = format_labels(self.labels, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            suffix = format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{suffix} {format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+# реестр: гистограммы горячего пути плюс gauge/counter, которые считаются только при опросе /metrics
+class metricsregistry:
+    def __init__(self, settings: metricssettings | None = None) -> None:
+        self.settings = settings or metricssettings()
+        # обычный атрибут, а не property: проверяется на каждом замере
+        self.enabled = self.settings.enabled
+        self.histograms: list[histogram] = []
+        self.collectors: list[tuple[str, str, str, collector]] = []
+
+    def histogram(self, name: str, description: str, labels: tuple[str, ...] = ()) -> histogram:
+        created = histogram(self, name, description, labels)
+        self.histograms.append(created)
+        return created
+
+    def collect(self, name: str, kind: str, description: str, source: collector) -> None:
+        self.collectors = [item for item in self.collectors if item[0] != name]
+        self.collectors.append((name, kind, description, source))
+
+    def value(self, name: str, kind: str, description: str, source: Callable[[], float]) -> None:
+        async def single() -> list[tuple[dict[str, str], float]]:
+            return [({}, source())]
+
+        self.collect(name, kind, description, single)
+
+    async def render(self) -> str:
+        lines: list[str] = []
+        for item in self.histograms:
+            lines.extend(item.render())
+        for name, kind, description, source in self.collectors:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, sample in await source():
+                names = tuple(labels)
+                lines.append(f"{name}{format_labels(names, tuple(labels[key] for key in names))} {format_value(sample)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = metricsregistry()
+
+ingest_request_seconds = metrics.histogram("telemetry_ingest_request_seconds", "POST /api/ingest handler time")
+ingest_stage_seconds = metrics.histogram(
+    "telemetry_ingest_stage_seconds", "time per ingest stage (signature, decode, write, broadcast)", ("stage",)
+)
+db_query_seconds = metrics.histogram("telemetry_db_query_seconds", "database call time by function", ("function",))
+
+
+# замер async-функции базы; при выключенных метриках функция возвращается как есть, без обертки
+def timed(
+    target: Optional[histogram] = None,
+) -> Callable[[Callable[params, Awaitable[result]]], Callable[params, Awaitable[result]]]:
+    chosen = target or db_query_seconds
+
+    def decorate(fn: Callable[params, Awaitable[result]]) -> Callable[params, Awaitable[result]]:
+        if not chosen.registry.enabled:
+            return fn
+        label = fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args: params.args, **kwargs: params.kwargs) -> result:
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                chosen.observe(time.perf_counter() - started, label)
+
+        return wrapper
+
+    return decorate
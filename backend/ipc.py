@@ -0,0 +1,216 @@
+import asyncio
+import hmac
+import ipaddress
+import logging
+import os
+import struct
+from hashlib import sha256
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# кадр: 4 байта длины orjson (big endian) + hmac-sha256 от orjson + orjson
+header = struct.Struct(">I")
+mac_size = sha256().digest_size
+
+# пачки одного запроса: (ключ идемпотентности (agent_id, batch_id) или None, строки)
+batchlist = list[tuple[Optional[tuple[str, str]], list[tuple[Any, ...]]]]
+
+# обработчик в процессе-писателе: (пачки, ts подписи, подпись) -> (http-статус, тело, заголовки)
+ingesthandler = Callable[[batchlist, int, bytes], Awaitable[tuple[int, dict, dict]]]
+
+
+# адрес канала между воркерами и писателем: путь unix-сокета или tcp://host:port (windows)
+class ipcsettings:
+    def __init__(self) -> None:
+        self.address = os.getenv("INGEST_SOCKET", "")
+        self.connections = max(1, int(os.getenv("INGEST_IPC_CONNECTIONS", "4")))
+        self.timeout = float(os.getenv("INGEST_IPC_TIMEOUT", "10"))
+        self.max_frame = int(os.getenv("INGEST_IPC_MAX_FRAME", str(64 * 1024 * 1024)))
+        # ключ кадров; по умолчанию выводится из HMAC_SECRET, который и так есть у воркеров и писателя
+        secret = os.getenv("INGEST_IPC_SECRET") or os.getenv("HMAC_SECRET", "telemetry-hmac-secret")
+        self.key = hmac.new(secret.encode(), b"telemetry-ipc-frame", sha256).digest()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.address)
+
+
+class writerunavailable(Exception):
+    pass
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+# канал только локальный: tcp принимается лишь на loopback
+def parse_address(address: str) -> tuple[Optional[str], Optional[tuple[str, int]]]:
+    if address.startswith("tcp://"):
+        host, _, port = address[len("tcp://") :].rpartition(":")
+        host = host.strip("[]") or "127.0.0.1"
+        if host != "localhost" and not is_loopback(host):
+            raise ValueError(f"INGEST_SOCKET tcp host must be loopback, got {host}")
+        return None, (host, int(port))
+    return address, None
+
+
+def frame_mac(key: bytes, payload: bytes) -> bytes:
+    return hmac.new(key, payload, sha256).digest()
+
+
+# кадр без верного hmac — ошибка соединения: записать строки в обход подписи агента может только тот, у кого есть ключ
+async def read_frame(reader: asyncio.StreamReader, max_frame: int, key: bytes) -> Optional[Any]:
+    try:
+        prefix = await reader.readexactly(header.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (size,) = header.unpack(prefix)
+    if size > max_frame:
+        raise ValueError(f"ipc frame of {size} bytes exceeds {max_frame}")
+    mac = await reader.readexactly(mac_size)
+    payload = await reader.readexactly(size)
+    if not hmac.compare_digest(mac, frame_mac(key, payload)):
+        raise ValueError("ipc frame authentication failed")
+    return orjson.loads(payload)
+
+
+def write_frame(writer: asyncio.StreamWriter, message: Any, key: bytes) -> None:
+    payload = orjson.dumps(message)
+    writer.write(header.pack(len(payload)) + frame_mac(key, payload) + payload)
+
+
+# сторона писателя: принимает пачки от воркеров и отдает их тому же пути записи, что и /api/ingest
+class ingestserver:
+    def __init__(self, handler: ingesthandler, settings: ipcsettings | None = None) -> None:
+        self.settings = settings or ipcsettings()
+        self.handler = handler
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.batches = 0
+        self.workers = 0
+
+    @property
+    def running(self) -> bool:
+        return self.server is not None
+
+    async def start(self) -> None:
+        if self.server is not None or not self.settings.enabled:
+            return
+        path, tcp = parse_address(self.settings.address)
+        if tcp is not None:
+            self.server = await asyncio.start_server(self.serve, tcp[0], tcp[1])
+            return
+        assert path is not None
+        Path(path).unlink(missing_ok=True)
+        # сокет сразу создается с правами 0600, без окна до chmod
+        umask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(self.serve, path)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+
+    async def stop(self) -> None:
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+        path, tcp = parse_address(self.settings.address)
+        if tcp is None and path:
+            Path(path).unlink(missing_ok=True)
+
+    # запросы одного соединения обрабатываются по очереди; параллелизм — за счет пула соединений воркера
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.workers += 1
+        try:
+            while True:
+                message = await read_frame(reader, self.settings.max_frame, self.settings.key)
+                if message is None:
+                    break
+                batches: batchlist = [
+                    (tuple(key) if key else None, [tuple(row) for row in rows]) for key, rows in message["batches"]
+                ]
+                try:
+                    status, body, headers = await self.handler(batches, message["ts"], bytes.fromhex(message["sig"]))
+                except Exception:
+                    logger.exception("ipc ingest of %d batches failed", len(batches))
+                    status, body, headers = 500, {"detail": "writer error"}, {}
+                self.batches += 1
+                write_frame(writer, {"status": status, "body": body, "headers": headers}, self.settings.key)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, KeyError, TypeError) as exc:
+            logger.warning("ipc connection dropped: %s", exc)
+        finally:
+            self.workers -= 1
+            writer.close()
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.settings.enabled,
+            "running": self.running,
+            "connections": self.workers,
+            "batches": self.batches,
+        }
+
+
+# сторона воркера: пул постоянных соединений к писателю, переподключение при обрыве
+class ingestclient:
+    def __init__(self, settings: ipcsettings | None = None) -> None:
+        self.settings = settings or ipcsettings()
+        self.idle: Optional[asyncio.Queue[Optional[tuple[asyncio.StreamReader, asyncio.StreamWriter]]]] = None
+
+    def pool(self) -> asyncio.Queue:
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for _ in range(self.settings.connections):
+                self.idle.put_nowait(None)
+        return self.idle
+
+    async def connect(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        path, tcp = parse_address(self.settings.address)
+        if tcp is not None:
+            return await asyncio.open_connection(tcp[0], tcp[1])
+        return await asyncio.open_unix_connection(path)
+
+    async def send(self, batches: batchlist, ts_value: int, signature: bytes) -> tuple[int, dict, dict]:
+        idle = self.pool()
+        connection = await idle.get()
+        try:
+            if connection is None:
+                connection = await self.connect()
+            reader, writer = connection
+            write_frame(writer, {"batches": batches, "ts": ts_value, "sig": signature.hex()}, self.settings.key)
+            await writer.drain()
+            reply = await asyncio.wait_for(
+                read_frame(reader, self.settings.max_frame, self.settings.key), self.settings.timeout
+            )
+            if reply is None:
+                raise ConnectionError("writer closed the connection")
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as exc:
+            if connection is not None:
+                connection[1].close()
+            idle.put_nowait(None)
+            raise writerunavailable(str(exc) or type(exc).__name__) from exc
+        except BaseException:
+            # отмена посреди обмена: ответ в сокете уже не сопоставить с запросом
+            if connection is not None:
+                connection[1].close()
+            idle.put_nowait(None)
+            raise
+        idle.put_nowait(connection)
+        return reply["status"], reply["body"], reply["headers"]
+
+    async def close(self) -> None:
+        if self.idle is None:
+            return
+        while not self.idle.empty():
+            connection = self.idle.get_nowait()
+            if connection is not None:
+                connection[1].close()
+        self.idle = None
@@ -0,0 +1,89 @@
+from typing import Iterable, Optional
+import aiosqlite
+
+# словари строк events: таблица (id, name); в events лежат только целые ключи
+tables = ("agents", "platforms", "event_types", "proc_names")
+
+# держимся ниже лимита параметров sqlite (999)
+lookup_chunk = 500
+
+
+def lookup_schema() -> list[str]:
+    return [
+        f"create table if not exists {table} (id integer primary key, name text not null unique)"
+        for table in tables
+    ]
+
+
+# кэш интернирования в процессе: имя <-> id; запись ходит в базу только за новыми именами, чтение — за чужими id
+class interncache:
+    def __init__(self) -> None:
+        self.ids: dict[str, dict[str, int]] = {table: {} for table in tables}
+        self.names: dict[str, dict[int, str]] = {table: {} for table in tables}
+        self.loaded = False
+
+    def remember(self, table: str, rows: Iterable[tuple[int, str]]) -> None:
+        ids = self.ids[table]
+        names = self.names[table]
+        for key, name in rows:
+            ids[name] = key
+            names[key] = name
+
+    async def load(self, conn: aiosqlite.Connection) -> None:
+        for table in tables:
+            self.remember(table, await conn.execute_fetchall(f"select id, name from {table}"))
+        self.loaded = True
+
+    # откат транзакции мог унести только что выданные id: забываем все и перечитываем при следующем обращении
+    def reset(self) -> None:
+        self.ids = {table: {} for table in tables}
+        self.names = {table: {} for table in tables}
+        self.loaded = False
+
+    # вызывается под блокировкой писателя, в той же транзакции, что и insert событий
+    async def intern(self, conn: aiosqlite.Connection, table: str, values: Iterable[Optional[str]]) -> dict[str, int]:
+        if not self.loaded:
+            await self.load(conn)
+        ids = self.ids[table]
+        # порядок первого появления: ключи не зависят от порядка обхода множества
+        missing = list(dict.fromkeys(value for value in values if value is not None and value not in ids))
+        for offset in range(0, len(missing), lookup_chunk):
+            chunk = missing[offset : offset + lookup_chunk]
+            await conn.executemany(f"insert or ignore into {table} (name) values (?)", [(name,) for name in chunk])
+            self.remember(
+                table,
+                await conn.execute_fetchall(
+                    f"select id, name from {table} where name in ({', '.join('?' for _ in chunk)})", chunk
+                ),
+            )
+        return ids
+
+    async def key(self, conn: aiosqlite.Connection, table: str, name: str) -> Optional[int]:
+        key = self.ids[table].get(name)
+        if key is None:
+            rows = await conn.execute_fetchall(f"select id, name from {table} where name = ?", (name,))
+            self.remember(table, rows)
+            key = rows[0][0] if rows else None
+        return key
+
+    async def keys(self, conn: aiosqlite.Connection, table: str, names: Iterable[str]) -> list[int]:
+        result = []
+        for name in names:
+            key = await self.key(conn, table, name)
+            if key is not None:
+                result.append(key)
+        return result
+
+    # имена для id, которых нет в кэше (их мог записать другой процесс)
+    async def resolve(self, conn: aiosqlite.Connection, table: str, keys: Iterable[Optional[int]]) -> dict[int, str]:
+        names = self.names[table]
+        missing = list({key for key in keys if key is not None and key not in names})
+        for offset in range(0, len(missing), lookup_chunk):
+            chunk = missing[offset : offset + lookup_chunk]
+            self.remember(
+                table,
+                await conn.execute_fetchall(
+                    f"select id, name from {table} where id in ({', '.join('?' for _ in chunk)})", chunk
+                ),
+            )
+        return names
@@ -1,11 +1,54 @@
 import asyncio
+import csv
+import io
 import os
-from typing import Optional
-from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+import time
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from .database import fetch_events, init_db, insert_events, remove_events
-from .models import ingestbatch, eventrecord, clearequest
-from .security import signaturevalidator
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import orjson
+from .admission import agentbuckets, concurrencygate, overloaded, ratelimited
+from .agents import agentindex
+from .archive import archiveengine, arrow_stream, render_archived
+from .archive import available as archive_available
+from .broadcast import connectionmanager, encode, streamoptions
+from .cache import responsecache
+from .database import (
+    close_pool,
+    fetch_events,
+    fetch_latest_states,
+    fetch_metric_series,
+    fetch_top_procs,
+    insert_events,
+    iter_events,
+    latest_event_id,
+    select_columns,
+    open_pool,
+    prepare_db,
+    remove_events,
+    schema,
+)
+from .database import writer as database_writer
+from .fastpath import render_event
+from .frames import bodytoolarge, decode_backlog_body, decode_body, framesettings, unsupportedformat
+from .idempotency import (
+    backlog_response,
+    batch_key,
+    batchkey,
+    idempotencyindex,
+    merge_backlog,
+    split_backlog,
+    valid_batch_id,
+)
+from .instrumentation import ingest_request_seconds, ingest_stage_seconds, metrics
+from .ipc import ingestserver
+from .models import clearequest
+from .retention import parse_duration, retentionengine
+from .security import replaystorefull, signaturevalidator
+from .stats import latencywindow, ratemeter
+from .writer import groupcommitwriter, queuefull
 
 # конфигурация
 api_token = os.getenv("API_TOKEN", "telemetry-secret-token")
@@ -21,39 +64,38 @@ app.add_middleware(
 )
 
 
-# менеджер подключений
-class connectionmanager:
-    def __init__(self) -> None:
-        self.connections: list[tuple[WebSocket, Optional[str]]] = []
-        self.lock = asyncio.Lock()
-
-    async def connect(self, websocket: WebSocket, agent_id: Optional[str]) -> None:
-        await websocket.accept()
-        async with self.lock:
-            self.connections.append((websocket, agent_id))
-
-    async def disconnect(self, websocket: WebSocket) -> None:
-        async with self.lock:
-            self.connections = [
-                (candidate, agent)
-                for candidate, agent in self.connections
-                if candidate is not websocket
-            ]
-
-    async def broadcast(self, payload: dict) -> None:
-        async with self.lock:
-            targets = list(self.connections)
-        for websocket, agent in targets:
-            if agent and payload.get("agent_id") != agent:
-                continue
-            try:
-                await websocket.send_json(payload)
-            except Exception:
-                await self.disconnect(websocket)
+# догонка /ws?since_id=N из базы: (since_id, upto] одним чтением по индексу
+async def replay_history(
+    agent_id: Optional[str], event_type: Optional[str], since_id: int, upto: Optional[int], limit: int
+) -> list[dict]:
+    rows = await fetch_events(agent_id, limit, upto + 1 if upto is not None else None, since_id, event_type)
+    return [render_event(row) for row in sorted(rows, key=lambda row: row["id"])]
 
 
-manager = connectionmanager()
+manager = connectionmanager(history=replay_history)
 validator = signaturevalidator()
+events_cache = responsecache()
+agent_index = agentindex()
+idempotency = idempotencyindex()
+agent_limits = agentbuckets()
+write_gate = concurrencygate()
+
+
+# рассылка после записи в базу (прямой путь и group commit)
+async def publish(inserted: list[dict]) -> None:
+    events_cache.invalidate({row["agent_id"] for row in inserted})
+    agent_index.apply(inserted)
+    with ingest_stage_seconds.time("broadcast"):
+        for row in inserted:
+            await manager.broadcast(render_event(row))
+
+
+writer = groupcommitwriter(insert_events, publish)
+retention = retentionengine()
+archiver = archiveengine()
+ingest_latency = latencywindow()
+ingest_rate = ratemeter()
+frame_settings = framesettings()
 
 
 async def require_token(x_api_token: str = Header(...)) -> None:
@@ -61,60 +103,429 @@ async def require_token(x_api_token: str = Header(...)) -> None:
         raise HTTPException(status_code=401, detail="invalid token")
 
 
-# проверка подписи
+# проверка hmac до разбора тела; повтор подписи проверяется позже, в accept_batches
 async def require_signature(
     request: Request,
     x_signature_ts: str = Header(..., alias="X-Signature-Ts"),
     x_signature: str = Header(..., alias="X-Signature"),
-) -> None:
+) -> tuple[int, bytes]:
     body = await request.body()
     try:
-        await validator.validate(x_signature_ts, x_signature, body)
+        with ingest_stage_seconds.time("signature"):
+            return validator.verify(x_signature_ts, x_signature, body)
     except ValueError as exc:
         raise HTTPException(status_code=401, detail=str(exc))
 
 
+def request_batch_id(x_batch_id: Optional[str] = Header(default=None, alias="X-Batch-Id")) -> Optional[str]:
+    if x_batch_id is not None and not valid_batch_id(x_batch_id):
+        raise HTTPException(status_code=422, detail="invalid X-Batch-Id")
+    return x_batch_id
+
+
 @app.on_event("startup")
 async def startup() -> None:
-    await init_db()
+    await open_pool()
+    # быстрые шаги схемы сейчас; построение индексов и сборка индекса агентов — фоном после старта
+    await prepare_db()
+    manager.resume_from(await latest_event_id())
+    if writer.settings.enabled:
+        await writer.start()
+    await retention.start()
+    await archiver.start()
+    await ingest_server.start()
+    schema.start(database_writer, load_agents)
+
 
+async def load_agents() -> None:
+    agent_index.merge(await fetch_latest_states())
 
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await schema.stop()
+    await ingest_server.stop()
+    await retention.stop()
+    await archiver.stop()
+    await writer.stop()
+    await manager.close_all()
+    await validator.replays.close()
+    await close_pool()
+
+
+# тело уже прочитано для hmac: разбираем его один раз, без второго прохода через модели.
+# кроме json принимаются колоночный кадр и msgpack, опционально gzip/zstd
 @app.post("/api/ingest")
 async def ingest(
-    batch: ingestbatch,
+    request: Request,
     _: None = Depends(require_token),
-    __: None = Depends(require_signature),
+    signature: tuple[int, bytes] = Depends(require_signature),
+    batch_id: Optional[str] = Depends(request_batch_id),
 ) -> dict:
-    ts_value = batch.ts.isoformat()
-    rows = []
-    for event in batch.events:
-        rows.append(
-            (
-                batch.agent_id,
-                ts_value,
-                batch.platform,
-                event.type,
-                event.cpu,
-                event.mem_free,
-                event.pid,
-                event.name,
-                event.rss,
+    started = time.perf_counter()
+    try:
+        with ingest_stage_seconds.time("decode"):
+            rows = decode_body(
+                await request.body(),
+                request.headers.get("content-type"),
+                request.headers.get("content-encoding"),
+                frame_settings,
             )
+    except unsupportedformat as exc:
+        raise HTTPException(status_code=415, detail=str(exc))
+    except bodytoolarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    (result,) = await accept_or_raise([(batch_key(rows[0][0], batch_id), rows)], *signature)
+    elapsed = time.perf_counter() - started
+    ingest_latency.observe(elapsed)
+    ingest_request_seconds.observe(elapsed)
+    return result
+
+
+# очередь агента одним подписанным запросом; каждая пачка дедуплицируется по своему batch_id
+@app.post("/api/ingest/backlog")
+async def ingest_backlog(
+    request: Request,
+    _: None = Depends(require_token),
+    signature: tuple[int, bytes] = Depends(require_signature),
+) -> dict:
+    try:
+        with ingest_stage_seconds.time("decode"):
+            decoded = decode_backlog_body(
+                await request.body(),
+                request.headers.get("content-type"),
+                request.headers.get("content-encoding"),
+                frame_settings,
+            )
+    except unsupportedformat as exc:
+        raise HTTPException(status_code=415, detail=str(exc))
+    except bodytoolarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    if len(decoded) > idempotency.settings.backlog_max_batches:
+        raise HTTPException(
+            status_code=413, detail=f"at most {idempotency.settings.backlog_max_batches} batches per backlog request"
         )
-    inserted = await insert_events(rows)
-    payloads = [eventrecord.from_row(row).model_dump(mode="json") for row in inserted]
-    for payload in payloads:
-        await manager.broadcast(payload)
-    return {"stored": len(payloads)}
+    batches, errors = split_backlog(decoded)
+    results = await accept_or_raise(batches, *signature) if batches else []
+    return backlog_response([batch_id for batch_id, _ in decoded], merge_backlog(errors, results))
+
+
+# общий путь записи для /api/ingest, backlog и пачек от воркеров (INGEST_SOCKET).
+# при group commit вместе с "queued" возвращается future коммита
+async def store_rows(rows: list[tuple]) -> tuple[str, Optional[asyncio.Future]]:
+    if writer.running:
+        try:
+            with ingest_stage_seconds.time("write"):
+                committed = writer.submit(rows)
+        except queuefull as exc:
+            raise HTTPException(
+                status_code=503,
+                detail=str(exc),
+                headers={"Retry-After": str(writer.settings.retry_after)},
+            )
+        return "queued", committed
+    with ingest_stage_seconds.time("write"):
+        inserted = await insert_events(rows)
+    await publish(inserted)
+    return "stored", None
+
+
+# ключи пачек из очереди group commit закрепляются только после коммита: если строки потеряны,
+# ключ освобождается, и ретрай агента пишет пачку заново, а не получает "duplicate"
+def settle_after_commit(committed: asyncio.Future, settled: list[tuple[batchkey, dict]]) -> None:
+    def done(future: asyncio.Future) -> None:
+        failed = future.cancelled() or future.exception() is not None
+        for key, result in settled:
+            idempotency.settle(key, None if failed else result)
+
+    committed.add_done_callback(done)
+
+
+# пачки одного подписанного запроса. уже записанные (по batch id) подтверждаются без insert_events и без
+# проверки повтора подписи: ретрай агента с той же подписью получает прежний ответ вместо 401.
+# новые пачки идут одним store_rows после проверки повтора
+async def accept_batches(
+    batches: list[tuple[Optional[batchkey], list[tuple]]],
+    ts_value: int,
+    signature: bytes,
+) -> list[dict]:
+    results: list[Optional[dict]] = [None] * len(batches)
+    first: dict[batchkey, int] = {}
+    claimed: list[batchkey] = []
+    try:
+        for position, (key, _) in enumerate(batches):
+            if key is None:
+                continue
+            if key in first:
+                continue
+            first[key] = position
+            previous = await idempotency.claim(key)
+            if previous is None:
+                claimed.append(key)
+            else:
+                results[position] = {**previous, "duplicate": True}
+        fresh = [
+            position
+            for position, (key, _) in enumerate(batches)
+            if results[position] is None and (key is None or first[key] == position)
+        ]
+        if fresh:
+            # повторы и дубликаты выше ничего не стоят писателю, лимиты считаются только по новым пачкам
+            agent_limits.take(dict.fromkeys(batches[position][1][0][0] for position in fresh))
+            rows = [row for position in fresh for row in batches[position][1]]
+            async with write_gate.slot():
+                await validator.record(ts_value, signature)
+                verb, committed = await store_rows(rows)
+            ingest_rate.add(len(rows))
+            queued: list[tuple[batchkey, dict]] = []
+            for position in fresh:
+                results[position] = {verb: len(batches[position][1])}
+                key = batches[position][0]
+                if key is None:
+                    continue
+                if committed is None:
+                    idempotency.settle(key, results[position])
+                else:
+                    queued.append((key, results[position]))
+                    claimed.remove(key)
+            if committed is not None and queued:
+                settle_after_commit(committed, queued)
+        for position, (key, _) in enumerate(batches):
+            if results[position] is None and key is not None:
+                results[position] = {**results[first[key]], "duplicate": True}
+    finally:
+        # запись не удалась: освобождаем ключи, чтобы ожидающие ретраи не зависли
+        for key in claimed:
+            idempotency.settle(key, None)
+    return [result for result in results if result is not None]
+
+
+async def accept_or_raise(
+    batches: list[tuple[Optional[batchkey], list[tuple]]],
+    ts_value: int,
+    signature: bytes,
+) -> list[dict]:
+    try:
+        return await accept_batches(batches, ts_value, signature)
+    except ratelimited as exc:
+        raise HTTPException(status_code=429, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
+    except overloaded as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": str(exc.retry_after)})
+    except replaystorefull as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
+    except ValueError as exc:
+        raise HTTPException(status_code=401, detail=str(exc))
 
 
+# пачки от воркера: hmac агента проверил воркер, кадр подписан ключом ipc (его проверяет ingestserver), здесь дедупликация, повторы (одно хранилище на все воркеры) и запись
+async def ipc_ingest(
+    batches: list[tuple[Optional[batchkey], list[tuple]]],
+    ts_value: int,
+    signature: bytes,
+) -> tuple[int, dict, dict]:
+    try:
+        results = await accept_or_raise(batches, ts_value, signature)
+    except HTTPException as exc:
+        return exc.status_code, {"detail": exc.detail}, dict(exc.headers or {})
+    return 200, {"results": results}, {}
+
+
+ingest_server = ingestserver(ipc_ingest)
+
+
+# gauge/counter считаются только при опросе /metrics
+async def replay_store_size() -> list[tuple[dict[str, str], float]]:
+    return [({}, await validator.replays.size())]
+
+
+metrics.value("telemetry_ingest_events_total", "counter", "events accepted by /api/ingest", lambda: ingest_rate.total)
+metrics.value("telemetry_ingest_events_per_second", "gauge", "ingest rate over the last 60s", ingest_rate.rate)
+metrics.value(
+    "telemetry_ingest_duplicates_total", "counter", "batches acknowledged from the idempotency index", lambda: idempotency.duplicates
+)
+metrics.value("telemetry_ingest_rate_limited_total", "counter", "requests rejected with 429", lambda: agent_limits.limited)
+metrics.value("telemetry_ingest_shed_total", "counter", "requests shed with 503 by the write gate", lambda: write_gate.shed)
+metrics.value("telemetry_ingest_inflight", "gauge", "requests holding a write slot", lambda: write_gate.active)
+metrics.value("telemetry_ingest_rate_buckets", "gauge", "agents with a live token bucket", lambda: len(agent_limits))
+metrics.value("telemetry_writer_queue_depth", "gauge", "batches waiting for group commit", lambda: writer.snapshot()["queue_depth"])
+metrics.value("telemetry_writer_commits_total", "counter", "group commits", lambda: writer.commits)
+metrics.value("telemetry_writer_rejected_total", "counter", "batches rejected with 503", lambda: writer.rejected)
+metrics.value("telemetry_ws_connections", "gauge", "connected websocket clients", lambda: manager.connections)
+metrics.value(
+    "telemetry_ws_queued_frames",
+    "gauge",
+    "frames waiting in per-connection send queues",
+    lambda: manager.snapshot()["queued_frames"],
+)
+metrics.value("telemetry_ws_dropped_frames_total", "counter", "frames dropped for slow clients", lambda: manager.dropped)
+metrics.value("telemetry_ws_slow_disconnects_total", "counter", "slow clients disconnected", lambda: manager.slow_disconnects)
+metrics.value("telemetry_ws_resumes_total", "counter", "/ws?since_id reconnects", lambda: manager.resumes)
+metrics.value("telemetry_ws_resyncs_total", "counter", "reconnects too far behind to resume", lambda: manager.resyncs)
+metrics.collect("telemetry_replay_store_size", "gauge", "signatures held by the replay store", replay_store_size)
+metrics.value("telemetry_agents", "gauge", "agents in the latest-state index", lambda: len(agent_index))
+metrics.value("telemetry_events_cache_hits_total", "counter", "GET /api/events cache hits", lambda: events_cache.hits)
+metrics.value("telemetry_events_cache_misses_total", "counter", "GET /api/events cache misses", lambda: events_cache.misses)
+metrics.value("telemetry_retention_rows_pruned_total", "counter", "events removed by retention", lambda: retention.rows_pruned)
+
+
+# prometheus text format; METRICS_ENABLED=1
+@app.get("/metrics")
+async def prometheus_metrics() -> PlainTextResponse:
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="metrics are disabled")
+    return PlainTextResponse(await metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# счетчики ingest для замеров
+@app.get("/api/stats")
+async def stats() -> dict:
+    return {
+        "ingest": {
+            "mode": "group_commit" if writer.running else "direct",
+            "latency": ingest_latency.snapshot(),
+            "events_per_second": round(ingest_rate.rate(), 2),
+            "events_total": ingest_rate.total,
+            "agents": len(agent_index),
+            "writer": writer.snapshot(),
+            "ipc": ingest_server.snapshot(),
+            "idempotency": idempotency.snapshot(),
+            "rate_limit": agent_limits.snapshot(),
+            "admission": write_gate.snapshot(),
+        },
+        "schema": schema.snapshot(),
+        "retention": retention.snapshot(),
+        "archive": archiver.snapshot(),
+        "websocket": manager.snapshot(),
+        "events_cache": events_cache.snapshot(),
+    }
+
+
+# строки базы сразу в json; одинаковые опросы дашбордов отдаются из кэша до записи по агенту
 @app.get("/api/events")
 async def events(
     agent_id: Optional[str] = Query(default=None),
     limit: int = Query(default=50, ge=1, le=500),
-) -> list[dict]:
-    rows = await fetch_events(agent_id, limit)
-    return [eventrecord.from_row(row).model_dump(mode="json") for row in rows]
+    before_id: Optional[int] = Query(default=None, ge=1),
+    after_id: Optional[int] = Query(default=None, ge=0),
+) -> Response:
+    key = (agent_id or None, limit, before_id, after_id)
+    body = events_cache.get(key)
+    if body is None:
+        version = events_cache.version(agent_id)
+        rows = await fetch_events(agent_id, limit, before_id, after_id)
+        body = orjson.dumps([render_event(row) for row in rows])
+        events_cache.put(key, version, body)
+    return Response(content=body, media_type="application/json")
+
+
+def utc_text(value: Optional[datetime]) -> Optional[str]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+
+async def ndjson_chunks(batches: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield b"".join(orjson.dumps(render_event(row)) + b"\n" for row in batch)
+
+
+async def csv_chunks(batches: AsyncIterator[list[dict]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    output = csv.writer(buffer, lineterminator="\n")
+    output.writerow(select_columns)
+    async for batch in batches:
+        output.writerows([render_event(row)[column] for column in select_columns] for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+# выгрузка без limit: порции по возрастанию id, память не растет с объемом
+@app.get("/api/events/stream")
+async def stream_events(
+    agent_id: Optional[str] = Query(default=None),
+    start: Optional[datetime] = Query(default=None, alias="from"),
+    end: Optional[datetime] = Query(default=None, alias="to"),
+    after_id: int = Query(default=0, ge=0),
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+) -> StreamingResponse:
+    batches = iter_events(agent_id, utc_text(start), utc_text(end), after_id)
+    if format == "csv":
+        return StreamingResponse(csv_chunks(batches), media_type="text/csv")
+    return StreamingResponse(ndjson_chunks(batches), media_type="application/x-ndjson")
+
+
+# тренды cpu/mem_free из сверток 1m/10m/1h
+@app.get("/api/metrics/series")
+async def metric_series(
+    agent_id: str = Query(min_length=1),
+    start: Optional[datetime] = Query(default=None, alias="from"),
+    end: Optional[datetime] = Query(default=None, alias="to"),
+    step: Optional[int] = Query(default=None, ge=1),
+) -> dict:
+    end_value = end or datetime.now(timezone.utc)
+    start_value = start or end_value - timedelta(hours=1)
+    if end_value.tzinfo is None:
+        end_value = end_value.replace(tzinfo=timezone.utc)
+    if start_value.tzinfo is None:
+        start_value = start_value.replace(tzinfo=timezone.utc)
+    if start_value >= end_value:
+        raise HTTPException(status_code=422, detail="from must be before to")
+    return await fetch_metric_series(agent_id, start_value.timestamp(), end_value.timestamp(), step)
+
+
+# последнее состояние агентов из памяти, без запроса к базе
+@app.get("/api/agents")
+async def agents(agent_id: Optional[str] = Query(default=None)) -> Response:
+    return Response(content=orjson.dumps(agent_index.snapshot(agent_id)), media_type="application/json")
+
+
+# самые тяжелые процессы агента за окно, из сверток proc_rollup_*
+@app.get("/api/procs/top")
+async def top_procs(
+    agent_id: str = Query(min_length=1),
+    window: str = Query(default="1h"),
+    by: str = Query(default="cpu", pattern="^(cpu|rss)$"),
+    n: int = Query(default=10, ge=1, le=100),
+) -> dict:
+    try:
+        seconds = parse_duration(window)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="invalid window")
+    if not 60 <= seconds <= 30 * 86400:
+        raise HTTPException(status_code=422, detail="window must be between 1m and 30d")
+    return await fetch_top_procs(agent_id, time.time() - seconds, seconds, by, n)
+
+
+# выборка из parquet-архива; format=arrow отдает arrow ipc stream для векторных клиентов
+@app.get("/api/archive/events")
+async def archived_events(
+    agent_id: Optional[str] = Query(default=None),
+    start: Optional[datetime] = Query(default=None, alias="from"),
+    end: Optional[datetime] = Query(default=None, alias="to"),
+    limit: int = Query(default=1000, ge=1),
+    format: str = Query(default="json", pattern="^(json|arrow)$"),
+) -> Response:
+    if not archive_available():
+        raise HTTPException(status_code=501, detail="archive requires pyarrow")
+    end_value = end or datetime.now(timezone.utc)
+    start_value = start or end_value - timedelta(days=1)
+    if end_value.tzinfo is None:
+        end_value = end_value.replace(tzinfo=timezone.utc)
+    if start_value.tzinfo is None:
+        start_value = start_value.replace(tzinfo=timezone.utc)
+    if start_value >= end_value:
+        raise HTTPException(status_code=422, detail="from must be before to")
+    table = await asyncio.to_thread(
+        archiver.scan, agent_id, start_value, end_value, min(limit, archiver.settings.max_rows)
+    )
+    if format == "arrow":
+        return Response(content=arrow_stream(table), media_type="application/vnd.apache.arrow.stream")
+    return Response(content=orjson.dumps(render_archived(table)), media_type="application/json")
 
 
 # очистка базы
@@ -124,6 +535,12 @@ async def clear_events(
     _: None = Depends(require_token),
 ) -> dict:
     removed = await remove_events(body.agent_id)
+    agent_index.remove(body.agent_id)
+    manager.forget(body.agent_id)
+    if body.agent_id:
+        events_cache.invalidate({body.agent_id})
+    else:
+        events_cache.clear()
     await manager.broadcast(
         {
             "type": "clear",
@@ -133,10 +550,40 @@ async def clear_events(
     return {"cleared": removed}
 
 
+def snapshot_frame(agent_id: Optional[str]) -> str:
+    return encode({"type": "snapshot", "agents": agent_index.snapshot(agent_id)})
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket) -> None:
     agent_id = websocket.query_params.get("agent_id")
-    await manager.connect(websocket, agent_id)
+    try:
+        options = streamoptions.from_query(websocket.query_params)
+        since = websocket.query_params.get("since_id")
+        since_id = int(since) if since else None
+        if since_id is not None and since_id < 0:
+            raise ValueError("since_id must be non-negative")
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    if since_id is None:
+        client = await manager.connect(websocket, agent_id, options)
+        # первым кадром — снимок состояния агентов, дальше события поверх него
+        manager.enqueue(client, (None, snapshot_frame(agent_id)))
+    else:
+        # переподключение: пропущенные события по порядку, затем отметка и живой поток без пропусков и повторов.
+        # если пропущено слишком много — resync и снимок, историю клиент дочитывает через /api/events
+        client = await manager.connect(websocket, agent_id, options, hold=True)
+        try:
+            resumed = await manager.resume(client, since_id)
+        except Exception:
+            await manager.disconnect(websocket)
+            return
+        if resumed:
+            frames = [encode({"type": "resumed", "since_id": since_id, "events": len(client.replayed)})]
+        else:
+            frames = [encode({"type": "resync", "since_id": since_id}), snapshot_frame(agent_id)]
+        manager.start(client, frames)
     try:
         while True:
             await websocket.receive_text()
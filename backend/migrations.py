@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from typing import AsyncContextManager, Awaitable, Callable, Optional, Sequence
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+step = Callable[[aiosqlite.Connection], Awaitable[None]]
+connectionfactory = Callable[[], AsyncContextManager[aiosqlite.Connection]]
+
+
+# шаг схемы; version — значение pragma user_version после него. background — долгий шаг (построение индекса),
+# который выполняется после старта приложения; finish — работа после commit (vacuum, сброс кэшей)
+class migration:
+    def __init__(self, version: int, name: str, apply: step, background: bool = False, finish: Optional[step] = None):
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.background = background
+        self.finish = finish
+
+
+async def schema_version(conn: aiosqlite.Connection) -> int:
+    return (await conn.execute_fetchall("pragma user_version"))[0][0]
+
+
+# шаг и новый user_version коммитятся вместе; упавший шаг откатывается целиком и будет повторен при следующем старте
+async def apply_migration(conn: aiosqlite.Connection, item: migration) -> None:
+    started = time.perf_counter()
+    await conn.execute("begin immediate")
+    try:
+        await item.apply(conn)
+        await conn.execute(f"pragma user_version = {item.version}")
+        await conn.commit()
+    except BaseException:
+        await conn.rollback()
+        raise
+    if item.finish is not None:
+        await item.finish(conn)
+    logger.info("schema migration %d (%s) done in %.2fs", item.version, item.name, time.perf_counter() - started)
+
+
+# версии схемы: при старте применяются быстрые шаги, фоновые и все после них — отдельной задачей,
+# каждый под блокировкой писателя, так что ingest ждет только текущий шаг, а чтение и /ws работают
+class migrationrunner:
+    def __init__(self, migrations: Sequence[migration]) -> None:
+        self.migrations = sorted(migrations, key=lambda item: item.version)
+        self.version: Optional[int] = None
+        self.pending: list[migration] = []
+        self.running: Optional[str] = None
+        self.failed: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.conn: Optional[aiosqlite.Connection] = None
+
+    @property
+    def latest(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    @property
+    def ready(self) -> bool:
+        return not self.pending
+
+    # background=False — все шаги сразу (тесты, утилиты); True — фоновые остаются в pending для start()
+    async def upgrade(self, writer: connectionfactory, background: bool = False) -> None:
+        async with writer() as conn:
+            self.version = await schema_version(conn)
+            if self.version > self.latest:
+                raise RuntimeError(f"database schema version {self.version} is newer than this build ({self.latest})")
+            pending = [item for item in self.migrations if item.version > self.version]
+            while pending and not (background and pending[0].background):
+                item = pending.pop(0)
+                self.running = item.name
+                await apply_migration(conn, item)
+                self.version = item.version
+            self.running = None
+        self.pending = pending
+
+    def start(self, writer: connectionfactory, on_ready: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+        if self.task is not None and not self.task.done():
+            return
+        self.task = asyncio.create_task(self.run(writer, on_ready))
+
+    async def run(self, writer: connectionfactory, on_ready: Optional[Callable[[], Awaitable[None]]]) -> None:
+        try:
+            while self.pending:
+                item = self.pending[0]
+                self.running = item.name
+                async with writer() as conn:
+                    self.conn = conn
+                    try:
+                        await apply_migration(conn, item)
+                    finally:
+                        self.conn = None
+                self.version = item.version
+                self.pending.pop(0)
+            self.running = None
+            if on_ready is not None:
+                await on_ready()
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            self.failed = f"{self.running}: {exc}"
+            logger.exception("background schema migration %s failed", self.running)
+
+    # shutdown посреди построения индекса: прерываем запрос, шаг откатится и повторится при следующем старте
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.task.cancel()
+        if self.conn is not None:
+            await self.conn.interrupt()
+        try:
+            await self.task
+        except BaseException:
+            pass
+        self.task = None
+
+    def snapshot(self) -> dict:
+        return {
+            "version": self.version,
+            "latest": self.latest,
+            "pending": [item.name for item in self.pending],
+            "running": self.running,
+            "failed": self.failed,
+        }
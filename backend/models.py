@@ -7,7 +7,8 @@ class telemetricevent(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
     type: str = Field(min_length=1)
-    cpu: Optional[float] = None
+    # NaN/inf не попадают в базу: свертки и top процессов складывают cpu
+    cpu: Optional[float] = Field(default=None, allow_inf_nan=False)
     mem_free: Optional[int] = None
     pid: Optional[int] = None
     name: Optional[str] = None
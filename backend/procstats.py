@@ -0,0 +1,184 @@
+import math
+from typing import Any, Iterable
+import aiosqlite
+from .rollups import parse_epoch
+
+# свертки proc-событий по (агент, корзина, имя процесса): секунды -> таблица
+resolutions = {
+    300: "proc_rollup_5m",
+    3600: "proc_rollup_1h",
+}
+
+# сколько корзин окна допускаем читать, прежде чем перейти на более грубую свертку
+max_buckets = 72
+
+fields = ("cpu", "rss")
+
+rank_columns = {"cpu": "cpu_avg", "rss": "rss_avg"}
+
+
+def procstats_schema() -> list[str]:
+    return [
+        f"""
+        create table if not exists {table} (
+            agent_id text not null,
+            bucket integer not null,
+            proc_name text not null,
+            samples integer not null,
+            cpu_sum real not null default 0,
+            cpu_count integer not null default 0,
+            cpu_max real,
+            rss_sum integer not null default 0,
+            rss_count integer not null default 0,
+            rss_max integer,
+            last_ts real not null,
+            primary key (agent_id, bucket, proc_name)
+        ) without rowid
+        """
+        for table in resolutions.values()
+    ]
+
+
+upsert_columns = (
+    "agent_id",
+    "bucket",
+    "proc_name",
+    "samples",
+    *(f"{field}_{part}" for field in fields for part in ("sum", "count", "max")),
+    "last_ts",
+)
+
+
+def upsert_sql(table: str) -> str:
+    updates = ["samples = samples + excluded.samples"]
+    for field in fields:
+        updates.extend(
+            [
+                f"{field}_sum = {field}_sum + excluded.{field}_sum",
+                f"{field}_count = {field}_count + excluded.{field}_count",
+                f"{field}_max = max(coalesce({field}_max, excluded.{field}_max), coalesce(excluded.{field}_max, {field}_max))",
+            ]
+        )
+    updates.append("last_ts = max(last_ts, excluded.last_ts)")
+    return (
+        f"insert into {table} ({', '.join(upsert_columns)}) "
+        f"values ({', '.join('?' for _ in upsert_columns)}) "
+        f"on conflict (agent_id, bucket, proc_name) do update set {', '.join(updates)}"
+    )
+
+# агрегаты пачки: одна upsert-строка на (разрешение, агент, корзина, процесс); события без имени пропускаем
+def aggregate(records: Iterable[dict[str, Any]]) -> dict[int, dict[tuple[str, int, str], dict[str, Any]]]:
+    grouped: dict[int, dict[tuple[str, int, str], dict[str, Any]]] = {res: {} for res in resolutions}
+    parsed: dict[str, float] = {}
+    for record in records:
+        if record["event_type"] != "proc" or not record["proc_name"]:
+            continue
+        ts = record["ts"]
+        epoch = parsed.get(ts)
+        if epoch is None:
+            epoch = parsed[ts] = parse_epoch(ts)
+        for resolution, buckets in grouped.items():
+            key = (record["agent_id"], int(epoch // resolution) * resolution, record["proc_name"])
+            partial = buckets.get(key)
+            if partial is None:
+                partial = buckets[key] = {"samples": 0, "last_ts": epoch}
+                for field in fields:
+                    partial.update({f"{field}_sum": 0, f"{field}_count": 0, f"{field}_max": None})
+            partial["samples"] += 1
+            partial["last_ts"] = max(partial["last_ts"], epoch)
+            for field in fields:
+                value = record[field]
+                # как в rollups.merge_value: NaN/inf сделал бы cpu_sum NULL и уронил бы insert_events
+                if value is None or (type(value) is float and not math.isfinite(value)):
+                    continue
+                high = partial[f"{field}_max"]
+                partial[f"{field}_max"] = value if high is None else max(high, value)
+                partial[f"{field}_sum"] += value
+                partial[f"{field}_count"] += 1
+    return grouped
+
+
+# в той же транзакции, что и insert событий
+async def apply(conn: aiosqlite.Connection, records: Iterable[dict[str, Any]]) -> None:
+    for resolution, buckets in aggregate(records).items():
+        if not buckets:
+            continue
+        params = [
+            (*key, *(partial[column] for column in upsert_columns[3:]))
+            for key, partial in buckets.items()
+        ]
+        await conn.executemany(upsert_sql(resolutions[resolution]), params)
+
+
+async def remove(conn: aiosqlite.Connection, agent_id: str | None) -> None:
+    for table in resolutions.values():
+        if agent_id:
+            await conn.execute(f"delete from {table} where agent_id = ?", (agent_id,))
+        else:
+            await conn.execute(f"delete from {table}")
+
+# порция корзин старше cutoff (ретеншн)
+async def prune(conn: aiosqlite.Connection, resolution: int, cutoff: float, limit: int) -> int:
+    table = resolutions[resolution]
+    cursor = await conn.execute(
+        f"""
+        delete from {table}
+        where (agent_id, bucket, proc_name) in (
+            select agent_id, bucket, proc_name from {table} where bucket < ? limit ?
+        )
+        """,
+        (cutoff, limit),
+    )
+    return cursor.rowcount or 0
+
+
+def pick_resolution(window: int) -> int:
+    ordered = sorted(resolutions)
+    for res in ordered:
+        if window / res <= max_buckets:
+            return res
+    return ordered[-1]
+
+# top-N процессов агента за окно: читаем только корзины свертки, не events
+async def fetch_top(
+    conn: aiosqlite.Connection,
+    agent_id: str,
+    start: float,
+    window: int,
+    by: str,
+    limit: int,
+) -> dict[str, Any]:
+    resolution = pick_resolution(window)
+    rows = await conn.execute_fetchall(
+        f"""
+        select
+            proc_name,
+            sum(samples) as samples,
+            sum(cpu_sum) / nullif(sum(cpu_count), 0) as cpu_avg,
+            max(cpu_max) as cpu_max,
+            1.0 * sum(rss_sum) / nullif(sum(rss_count), 0) as rss_avg,
+            max(rss_max) as rss_max,
+            max(last_ts) as last_ts
+        from {resolutions[resolution]}
+        where agent_id = ? and bucket >= ?
+        group by proc_name
+        order by {rank_columns[by]} desc nulls last, proc_name
+        limit ?
+        """,
+        (agent_id, int(start // resolution) * resolution, limit),
+    )
+    return {
+        "agent_id": agent_id,
+        "window": window,
+        "by": by,
+        "resolution": resolution,
+        "procs": [
+            {
+                "proc_name": row["proc_name"],
+                "samples": row["samples"],
+                "cpu": {"avg": row["cpu_avg"], "max": row["cpu_max"]},
+                "rss": {"avg": row["rss_avg"], "max": row["rss_max"]},
+            }
+            for row in rows
+        ],
+    }
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Awaitable, Callable, Optional
+from . import database
+
+logger = logging.getLogger(__name__)
+
+units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value: str) -> int:
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        number = float(value[:-1]) * units[value[-1]]
+        # inf/nan дошли бы до int() как OverflowError, а вызывающие ждут ValueError
+        if not math.isfinite(number):
+            raise ValueError(f"invalid duration: {value!r}")
+        return int(number)
+    return int(value)
+
+# "metric=7d,proc=1d,*=30d" -> {"metric": 604800, "proc": 86400, "*": 2592000}
+def parse_max_age(value: str) -> dict[str, int]:
+    policies: dict[str, int] = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        event_type, _, duration = item.partition("=")
+        if not duration:
+            raise ValueError(f"invalid retention policy: {item!r}")
+        policies[event_type.strip().lower()] = parse_duration(duration)
+    return policies
+
+# настройки ретеншна
+class retentionsettings:
+    def __init__(self) -> None:
+        self.max_age = parse_max_age(os.getenv("RETENTION_MAX_AGE", ""))
+        self.max_rows_per_agent = int(os.getenv("RETENTION_MAX_ROWS_PER_AGENT", "0"))
+        self.interval = float(os.getenv("RETENTION_INTERVAL", "60"))
+        self.chunk_rows = max(1, int(os.getenv("RETENTION_CHUNK_ROWS", "1000")))
+        self.pause_ms = int(os.getenv("RETENTION_PAUSE_MS", "10"))
+        self.vacuum_pages = int(os.getenv("RETENTION_VACUUM_PAGES", "256"))
+        self.compact_every = max(1, int(os.getenv("RETENTION_COMPACT_EVERY", "20")))
+        # сколько хранить корзины сверток процессов по разрешению, 0 — бессрочно
+        self.proc_rollups = {
+            300: parse_duration(os.getenv("RETENTION_PROC_5M", "2d")),
+            3600: parse_duration(os.getenv("RETENTION_PROC_1H", "30d")),
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_age) or self.max_rows_per_agent > 0 or any(self.proc_rollups.values())
+
+# фоновая очистка мелкими порциями
+class retentionengine:
+    def __init__(self, settings: retentionsettings | None = None) -> None:
+        self.settings = settings or retentionsettings()
+        self.task: Optional[asyncio.Task] = None
+        self.rows_pruned = 0
+        self.rows_pruned_by_age = 0
+        self.rows_pruned_by_count = 0
+        self.proc_buckets_pruned = 0
+        self.passes = 0
+        self.seconds_spent = 0.0
+        self.last_pass_at: Optional[str] = None
+        self.chunks_since_compact = 0
+
+    async def start(self) -> None:
+        if self.task is None and self.settings.enabled:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("retention pass failed")
+            await asyncio.sleep(self.settings.interval)
+
+    async def run_once(self) -> int:
+        started = time.perf_counter()
+        pruned = await self.prune_by_age() + await self.prune_by_count()
+        await self.prune_proc_rollups()
+        if self.chunks_since_compact:
+            await database.compact(self.settings.vacuum_pages)
+            self.chunks_since_compact = 0
+        self.passes += 1
+        self.seconds_spent += time.perf_counter() - started
+        self.last_pass_at = datetime.now(timezone.utc).isoformat()
+        return pruned
+
+    async def prune_by_age(self) -> int:
+        policies = dict(self.settings.max_age)
+        fallback = policies.pop("*", None)
+        now = datetime.now(timezone.utc)
+        pruned = 0
+        for event_type, age in policies.items():
+            pruned += await self.drain(
+                partial(database.delete_expired, self.cutoff(now, age), [event_type], [])
+            )
+        if fallback is not None:
+            pruned += await self.drain(
+                partial(database.delete_expired, self.cutoff(now, fallback), None, list(policies))
+            )
+        self.rows_pruned_by_age += pruned
+        self.rows_pruned += pruned
+        return pruned
+
+    async def prune_by_count(self) -> int:
+        keep = self.settings.max_rows_per_agent
+        if keep <= 0:
+            return 0
+        pruned = 0
+        for agent_id, _ in await database.agents_over_limit(keep):
+            pruned += await self.drain(partial(database.trim_agent, agent_id, keep))
+        self.rows_pruned_by_count += pruned
+        self.rows_pruned += pruned
+        return pruned
+
+    async def prune_proc_rollups(self) -> int:
+        now = time.time()
+        pruned = 0
+        for resolution, keep in self.settings.proc_rollups.items():
+            if keep > 0:
+                pruned += await self.drain(partial(database.prune_proc_rollups, resolution, now - keep))
+        self.proc_buckets_pruned += pruned
+        return pruned
+
+    # порции до исчерпания; между ними отдаем писателя ingest'у
+    async def drain(self, delete_chunk: Callable[[int], Awaitable[int]]) -> int:
+        total = 0
+        while True:
+            deleted = await delete_chunk(self.settings.chunk_rows)
+            total += deleted
+            if deleted:
+                self.chunks_since_compact += 1
+            if self.chunks_since_compact >= self.settings.compact_every:
+                await database.compact(self.settings.vacuum_pages)
+                self.chunks_since_compact = 0
+            if deleted < self.settings.chunk_rows:
+                return total
+            await asyncio.sleep(self.settings.pause_ms / 1000)
+
+    @staticmethod
+    def cutoff(now: datetime, age: int) -> str:
+        return (now - timedelta(seconds=age)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def snapshot(self) -> dict:
+        return {
+            "enabled": self.settings.enabled,
+            "running": self.task is not None and not self.task.done(),
+            "passes": self.passes,
+            "rows_pruned": self.rows_pruned,
+            "rows_pruned_by_age": self.rows_pruned_by_age,
+            "rows_pruned_by_count": self.rows_pruned_by_count,
+            "proc_buckets_pruned": self.proc_buckets_pruned,
+            "seconds_spent": round(self.seconds_spent, 3),
+            "last_pass_at": self.last_pass_at,
+        }
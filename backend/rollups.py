@@ -0,0 +1,225 @@
+import math
+from datetime import datetime, timezone
+from typing import Any, Iterable, Optional
+import aiosqlite
+
+# разрешения свертки метрик: секунды -> таблица
+resolutions = {
+    60: "metric_rollup_1m",
+    600: "metric_rollup_10m",
+    3600: "metric_rollup_1h",
+}
+
+# сколько точек отдаем на график без явного step
+max_points = 1000
+
+fields = ("cpu", "mem_free")
+
+
+def rollup_schema() -> list[str]:
+    statements = []
+    for table in resolutions.values():
+        statements.append(
+            f"""
+            create table if not exists {table} (
+                agent_id text not null,
+                bucket integer not null,
+                samples integer not null,
+                cpu_min real,
+                cpu_max real,
+                cpu_sum real not null default 0,
+                cpu_count integer not null default 0,
+                cpu_last real,
+                mem_free_min integer,
+                mem_free_max integer,
+                mem_free_sum integer not null default 0,
+                mem_free_count integer not null default 0,
+                mem_free_last integer,
+                last_ts real not null,
+                primary key (agent_id, bucket)
+            ) without rowid
+            """
+        )
+    return statements
+
+
+def parse_epoch(value: str) -> float:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def new_partial(epoch: float) -> dict[str, Any]:
+    partial: dict[str, Any] = {"samples": 0, "last_ts": epoch}
+    for field in fields:
+        partial[f"{field}_min"] = None
+        partial[f"{field}_max"] = None
+        partial[f"{field}_sum"] = 0
+        partial[f"{field}_count"] = 0
+        partial[f"{field}_last"] = None
+    return partial
+
+
+# NaN/inf отсекаются при разборе тела; здесь — на случай строк из других путей:
+# одно такое значение сделало бы cpu_sum NULL и уронило бы всю транзакцию insert_events
+def merge_value(partial: dict[str, Any], field: str, value: Any, epoch: float) -> None:
+    if value is None or (type(value) is float and not math.isfinite(value)):
+        return
+    low = partial[f"{field}_min"]
+    high = partial[f"{field}_max"]
+    partial[f"{field}_min"] = value if low is None else min(low, value)
+    partial[f"{field}_max"] = value if high is None else max(high, value)
+    partial[f"{field}_sum"] += value
+    partial[f"{field}_count"] += 1
+    if epoch >= partial["last_ts"]:
+        partial[f"{field}_last"] = value
+
+# агрегаты пачки в памяти: одна upsert-строка на (разрешение, агент, корзина)
+def aggregate(records: Iterable[dict[str, Any]]) -> dict[int, dict[tuple[str, int], dict[str, Any]]]:
+    grouped: dict[int, dict[tuple[str, int], dict[str, Any]]] = {res: {} for res in resolutions}
+    parsed: dict[str, float] = {}
+    for record in records:
+        if record["event_type"] != "metric":
+            continue
+        ts = record["ts"]
+        epoch = parsed.get(ts)
+        if epoch is None:
+            epoch = parsed[ts] = parse_epoch(ts)
+        for resolution, buckets in grouped.items():
+            key = (record["agent_id"], int(epoch // resolution) * resolution)
+            partial = buckets.get(key)
+            if partial is None:
+                partial = buckets[key] = new_partial(epoch)
+            partial["samples"] += 1
+            for field in fields:
+                merge_value(partial, field, record[field], epoch)
+            partial["last_ts"] = max(partial["last_ts"], epoch)
+    return grouped
+
+
+upsert_columns = (
+    "agent_id",
+    "bucket",
+    "samples",
+    *(f"{field}_{part}" for field in fields for part in ("min", "max", "sum", "count", "last")),
+    "last_ts",
+)
+
+
+def upsert_sql(table: str) -> str:
+    updates = ["samples = samples + excluded.samples"]
+    for field in fields:
+        updates.extend(
+            [
+                f"{field}_min = min(coalesce({field}_min, excluded.{field}_min), coalesce(excluded.{field}_min, {field}_min))",
+                f"{field}_max = max(coalesce({field}_max, excluded.{field}_max), coalesce(excluded.{field}_max, {field}_max))",
+                f"{field}_sum = {field}_sum + excluded.{field}_sum",
+                f"{field}_count = {field}_count + excluded.{field}_count",
+                f"{field}_last = case when excluded.last_ts >= last_ts "
+                f"then coalesce(excluded.{field}_last, {field}_last) else {field}_last end",
+            ]
+        )
+    updates.append("last_ts = max(last_ts, excluded.last_ts)")
+    return (
+        f"insert into {table} ({', '.join(upsert_columns)}) "
+        f"values ({', '.join('?' for _ in upsert_columns)}) "
+        f"on conflict (agent_id, bucket) do update set {', '.join(updates)}"
+    )
+
+
+# инкрементальное обновление сверток в той же транзакции, что и insert
+async def apply(conn: aiosqlite.Connection, records: Iterable[dict[str, Any]]) -> None:
+    grouped = aggregate(records)
+    for resolution, buckets in grouped.items():
+        if not buckets:
+            continue
+        params = [
+            (agent_id, bucket, *(partial[column] for column in upsert_columns[2:]))
+            for (agent_id, bucket), partial in buckets.items()
+        ]
+        await conn.executemany(upsert_sql(resolutions[resolution]), params)
+
+
+async def remove(conn: aiosqlite.Connection, agent_id: Optional[str]) -> None:
+    for table in resolutions.values():
+        if agent_id:
+            await conn.execute(f"delete from {table} where agent_id = ?", (agent_id,))
+        else:
+            await conn.execute(f"delete from {table}")
+
+# самая грубая свертка, которая укладывается в step или в max_points точек
+def pick_resolution(start: float, end: float, step: Optional[int]) -> int:
+    ordered = sorted(resolutions)
+    if step:
+        fitting = [res for res in ordered if res <= step]
+        return fitting[-1] if fitting else ordered[0]
+    span = max(0.0, end - start)
+    for res in ordered:
+        if span / res <= max_points:
+            return res
+    return ordered[-1]
+
+
+async def fetch_series(
+    conn: aiosqlite.Connection,
+    agent_id: str,
+    start: float,
+    end: float,
+    step: Optional[int],
+) -> dict[str, Any]:
+    resolution = pick_resolution(start, end, step)
+    effective_step = max(resolution, step or resolution)
+    effective_step -= effective_step % resolution
+    cursor = await conn.execute(
+        f"""
+        select {', '.join(upsert_columns)}
+        from {resolutions[resolution]}
+        where agent_id = ? and bucket >= ? and bucket < ?
+        order by bucket
+        """,
+        (agent_id, int(start // resolution) * resolution, end),
+    )
+    rows = await cursor.fetchall()
+    points: list[dict[str, Any]] = []
+    current: Optional[dict[str, Any]] = None
+    for row in rows:
+        bucket = int(row["bucket"] // effective_step) * effective_step
+        if current is None or current["bucket"] != bucket:
+            current = {"bucket": bucket, **new_partial(row["last_ts"])}
+            points.append(current)
+        current["samples"] += row["samples"]
+        for field in fields:
+            for part, combine in (("min", min), ("max", max)):
+                value = row[f"{field}_{part}"]
+                existing = current[f"{field}_{part}"]
+                if value is not None:
+                    current[f"{field}_{part}"] = value if existing is None else combine(existing, value)
+            current[f"{field}_sum"] += row[f"{field}_sum"]
+            current[f"{field}_count"] += row[f"{field}_count"]
+            if row[f"{field}_last"] is not None and row["last_ts"] >= current["last_ts"]:
+                current[f"{field}_last"] = row[f"{field}_last"]
+        current["last_ts"] = max(current["last_ts"], row["last_ts"])
+    return {
+        "agent_id": agent_id,
+        "resolution": resolution,
+        "step": effective_step,
+        "points": [render_point(point) for point in points],
+    }
+
+
+def render_point(point: dict[str, Any]) -> dict[str, Any]:
+    rendered: dict[str, Any] = {
+        "t": datetime.fromtimestamp(point["bucket"], tz=timezone.utc).isoformat(),
+        "count": point["samples"],
+    }
+    for field in fields:
+        count = point[f"{field}_count"]
+        rendered[field] = {
+            "min": point[f"{field}_min"],
+            "max": point[f"{field}_max"],
+            "avg": point[f"{field}_sum"] / count if count else None,
+            "last": point[f"{field}_last"],
+            "count": count,
+        }
+    return rendered
@@ -4,7 +4,10 @@ import os
 import time
 from collections import deque
 from hashlib import sha256
-from typing import Deque, Tuple
+from pathlib import Path
+from typing import Deque, Optional, Protocol, Tuple
+import aiosqlite
+from .database import get_db_path
 
 # настройки подписи
 class signaturesettings:
@@ -12,30 +15,146 @@ class signaturesettings:
         self.secret = os.getenv("HMAC_SECRET", "telemetry-hmac-secret").encode()
         self.drift_seconds = int(os.getenv("HMAC_DRIFT", "30"))
         self.store_seconds = int(os.getenv("HMAC_REPLAY_TTL", "120"))
+        self.store_max = int(os.getenv("HMAC_REPLAY_MAX", "1000000"))
+        self.store_backend = os.getenv("HMAC_REPLAY_BACKEND", "memory").lower()
+        self.store_path = os.getenv("HMAC_REPLAY_DB")
 
-# защита от повторов
+
+class replaystorefull(ValueError):
+    pass
+
+# интерфейс хранилища подписей
+class replaybackend(Protocol):
+    async def record(self, timestamp: int, signature: bytes) -> bool: ...
+
+    async def size(self) -> int: ...
+
+    async def close(self) -> None: ...
+
+
+# защита от повторов: множество подписей + очередь по времени записи, все операции O(1)
 class replaystore:
-    def __init__(self, retention: int) -> None:
+    def __init__(self, retention: int, max_entries: int = 0) -> None:
+        self.retention = retention
+        self.max_entries = max_entries
+        self.seen: set[bytes] = set()
+        self.entries: Deque[Tuple[float, bytes]] = deque()
+
+    def __len__(self) -> int:
+        return len(self.seen)
+
+    def expire(self, now: float) -> None:
+        while self.entries and now - self.entries[0][0] > self.retention:
+            _, signature = self.entries.popleft()
+            self.seen.discard(signature)
+
+    # подпись уже прошла hmac.compare_digest, здесь достаточно поиска по хешу
+    async def record(self, timestamp: int, signature: bytes) -> bool:
+        now = time.time()
+        self.expire(now)
+        if signature in self.seen:
+            return False
+        # при переполнении отказываем, а не вытесняем: вытеснение открыло бы окно для повтора
+        if self.max_entries and len(self.seen) >= self.max_entries:
+            raise replaystorefull("replay store full")
+        self.seen.add(signature)
+        self.entries.append((now, signature))
+        return True
+
+    async def size(self) -> int:
+        return len(self.seen)
+
+    async def close(self) -> None:
+        pass
+
+# общее для нескольких процессов хранилище: таблица sqlite с ttl, без внешних сервисов
+class sqlitereplaystore:
+    def __init__(self, path: Path, retention: int, max_entries: int = 0, cleanup_every: float = 5.0) -> None:
+        self.path = path
         self.retention = retention
-        self.entries: Deque[Tuple[int, bytes]] = deque()
+        self.max_entries = max_entries
+        self.cleanup_every = cleanup_every
+        self.conn: Optional[aiosqlite.Connection] = None
         self.lock = asyncio.Lock()
+        self.next_cleanup = 0.0
+        self.full = False
+
+    async def connect(self) -> aiosqlite.Connection:
+        if self.conn is None:
+            conn = await aiosqlite.connect(self.path, isolation_level=None)
+            try:
+                await conn.execute_fetchall("pragma busy_timeout=5000")
+                await conn.execute_fetchall("pragma journal_mode=wal")
+                await conn.execute_fetchall("pragma synchronous=normal")
+                await conn.execute(
+                    """
+                    create table if not exists replays (
+                        signature blob primary key,
+                        expires real not null
+                    ) without rowid
+                    """
+                )
+                await conn.execute("create index if not exists replays_expires on replays (expires)")
+            except BaseException:
+                await conn.close()
+                raise
+            self.conn = conn
+        return self.conn
 
+    # один upsert: вставка новой подписи или перезапись только истекшей; changes() == 0 — повтор
     async def record(self, timestamp: int, signature: bytes) -> bool:
         async with self.lock:
-            now = int(time.time())
-            while self.entries and now - self.entries[0][0] > self.retention:
-                self.entries.popleft()
-            for _, existing in self.entries:
-                if hmac.compare_digest(existing, signature):
-                    return False
-            self.entries.append((timestamp, signature))
-            return True
+            conn = await self.connect()
+            now = time.time()
+            if now >= self.next_cleanup:
+                await self.cleanup(conn, now)
+            if self.full:
+                raise replaystorefull("replay store full")
+            cursor = await conn.execute(
+                """
+                insert into replays (signature, expires) values (?, ?)
+                on conflict (signature) do update set expires = excluded.expires
+                where replays.expires < ?
+                """,
+                (signature, now + self.retention, now),
+            )
+            return cursor.rowcount == 1
+
+    async def cleanup(self, conn: aiosqlite.Connection, now: float) -> None:
+        await conn.execute("delete from replays where expires < ?", (now,))
+        self.next_cleanup = now + self.cleanup_every
+        if self.max_entries:
+            rows = await conn.execute_fetchall("select count(*) from replays")
+            self.full = rows[0][0] >= self.max_entries
+
+    async def size(self) -> int:
+        async with self.lock:
+            conn = await self.connect()
+            rows = await conn.execute_fetchall("select count(*) from replays where expires >= ?", (time.time(),))
+            return rows[0][0]
+
+    async def close(self) -> None:
+        async with self.lock:
+            if self.conn is not None:
+                await self.conn.close()
+                self.conn = None
+
+
+def build_replaystore(settings: signaturesettings) -> replaybackend:
+    # подпись валидна до ts + drift, а ts может опережать часы на drift
+    retention = max(settings.store_seconds, 2 * settings.drift_seconds)
+    if settings.store_backend == "memory":
+        return replaystore(retention, settings.store_max)
+    if settings.store_backend == "sqlite":
+        path = Path(settings.store_path) if settings.store_path else get_db_path().with_suffix(".replays.db")
+        return sqlitereplaystore(path, retention, settings.store_max)
+    raise ValueError(f"unknown HMAC_REPLAY_BACKEND: {settings.store_backend}")
 
 # основной валидатор
 class signaturevalidator:
     def __init__(self, settings: signaturesettings | None = None) -> None:
         self.settings = settings or signaturesettings()
-        self.replays = replaystore(self.settings.store_seconds)
+        self.replays: replaybackend = build_replaystore(self.settings)
 
     def build_signature(self, timestamp: str, body: bytes) -> bytes:
         message = timestamp.encode() + b"." + body
@@ -51,7 +170,8 @@ class signaturevalidator:
             raise ValueError("timestamp drift too large")
         return ts_value
 
-    async def validate(self, timestamp: str, signature_hex: str, body: bytes) -> None:
+    # только hmac и время: в режиме шардов это делают воркеры, а повторы проверяет писатель
+    def verify(self, timestamp: str, signature_hex: str, body: bytes) -> tuple[int, bytes]:
         ts_value = self.validate_timestamp(timestamp)
         try:
             provided = bytes.fromhex(signature_hex)
@@ -60,7 +180,14 @@ class signaturevalidator:
         expected = self.build_signature(timestamp, body)
         if not hmac.compare_digest(expected, provided):
             raise ValueError("signature mismatch")
-        replay_ok = await self.replays.record(ts_value, provided)
+        return ts_value, provided
+
+    async def record(self, ts_value: int, signature: bytes) -> None:
+        replay_ok = await self.replays.record(ts_value, signature)
         if not replay_ok:
             raise ValueError("replayed signature")
 
+    async def validate(self, timestamp: str, signature_hex: str, body: bytes) -> None:
+        ts_value, provided = self.verify(timestamp, signature_hex, body)
+        await self.record(ts_value, provided)
+
@@ -0,0 +1,112 @@
+import os
+from typing import Optional
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from .frames import bodytoolarge, decode_backlog_body, decode_body, framesettings, unsupportedformat
+from .idempotency import (
+    backlog_response,
+    batch_key,
+    batchkey,
+    idempotencysettings,
+    merge_backlog,
+    split_backlog,
+    valid_batch_id,
+)
+from .ipc import ingestclient, writerunavailable
+from .security import signaturevalidator
+
+# воркер ingest: hmac и разбор тела на своем ядре, запись и рассылка — в процессе-писателе (backend.main)
+api_token = os.getenv("API_TOKEN", "telemetry-secret-token")
+
+app = FastAPI()
+
+validator = signaturevalidator()
+client = ingestclient()
+frame_settings = framesettings()
+idempotency_settings = idempotencysettings()
+
+
+async def require_token(x_api_token: str = Header(...)) -> None:
+    if x_api_token != api_token:
+        raise HTTPException(status_code=401, detail="invalid token")
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await client.close()
+    await validator.replays.close()
+
+
+async def verify_signature(
+    request: Request,
+    x_signature_ts: str = Header(..., alias="X-Signature-Ts"),
+    x_signature: str = Header(..., alias="X-Signature"),
+) -> tuple[int, bytes]:
+    try:
+        return validator.verify(x_signature_ts, x_signature, await request.body())
+    except ValueError as exc:
+        raise HTTPException(status_code=401, detail=str(exc))
+
+
+def request_batch_id(x_batch_id: Optional[str] = Header(default=None, alias="X-Batch-Id")) -> Optional[str]:
+    if x_batch_id is not None and not valid_batch_id(x_batch_id):
+        raise HTTPException(status_code=422, detail="invalid X-Batch-Id")
+    return x_batch_id
+
+
+async def forward(batches: list[tuple[Optional[batchkey], list[tuple]]], signature: tuple[int, bytes]) -> list[dict]:
+    try:
+        status, result, headers = await client.send(batches, *signature)
+    except writerunavailable as exc:
+        raise HTTPException(status_code=503, detail=f"writer unavailable: {exc}", headers={"Retry-After": "1"})
+    if status != 200:
+        raise HTTPException(status_code=status, detail=result.get("detail"), headers=headers or None)
+    return result["results"]
+
+
+# тот же контракт, что у /api/ingest писателя: коды 401/413/415/422/503 и тело ответа совпадают
+@app.post("/api/ingest")
+async def ingest(
+    request: Request,
+    _: None = Depends(require_token),
+    signature: tuple[int, bytes] = Depends(verify_signature),
+    batch_id: Optional[str] = Depends(request_batch_id),
+) -> dict:
+    try:
+        rows = decode_body(
+            await request.body(),
+            request.headers.get("content-type"),
+            request.headers.get("content-encoding"),
+            frame_settings,
+        )
+    except unsupportedformat as exc:
+        raise HTTPException(status_code=415, detail=str(exc))
+    except bodytoolarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    (result,) = await forward([(batch_key(rows[0][0], batch_id), rows)], signature)
+    return result
+
+
+@app.post("/api/ingest/backlog")
+async def ingest_backlog(
+    request: Request,
+    _: None = Depends(require_token),
+    signature: tuple[int, bytes] = Depends(verify_signature),
+) -> dict:
+    try:
+        decoded = decode_backlog_body(
+            await request.body(),
+            request.headers.get("content-type"),
+            request.headers.get("content-encoding"),
+            frame_settings,
+        )
+    except unsupportedformat as exc:
+        raise HTTPException(status_code=415, detail=str(exc))
+    except bodytoolarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    if len(decoded) > idempotency_settings.backlog_max_batches:
+        raise HTTPException(
+            status_code=413, detail=f"at most {idempotency_settings.backlog_max_batches} batches per backlog request"
+        )
+    batches, errors = split_backlog(decoded)
+    results = await forward(batches, signature) if batches else []
+    return backlog_response([batch_id for batch_id, _ in decoded], merge_backlog(errors, results))
@@ -0,0 +1,56 @@
+import time
+from collections import deque
+from typing import Deque
+
+
+# скользящее окно задержек для перцентилей
+class latencywindow:
+    def __init__(self, size: int = 2048) -> None:
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+        }
+
+# поток событий в секунду по посекундным корзинам
+class ratemeter:
+    def __init__(self, window: int = 60) -> None:
+        self.window = window
+        self.buckets: Deque[list[int]] = deque()
+        self.total = 0
+
+    def add(self, count: int, now: float | None = None) -> None:
+        second = int(now if now is not None else time.time())
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += count
+        else:
+            self.buckets.append([second, count])
+        self.total += count
+        self.trim(second)
+
+    def trim(self, second: int) -> None:
+        while self.buckets and second - self.buckets[0][0] >= self.window:
+            self.buckets.popleft()
+
+    def rate(self, now: float | None = None) -> float:
+        second = int(now if now is not None else time.time())
+        self.trim(second)
+        if not self.buckets:
+            return 0.0
+        span = max(1, min(self.window, second - self.buckets[0][0] + 1))
+        return sum(count for _, count in self.buckets) / span
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+import pytest
+from httpx import AsyncClient
+from . import main as backend_main
+from .admission import admissionsettings, agentbuckets, concurrencygate, overloaded, ratelimited
+from .database import init_db
+from .main import app
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    monkeypatch.setenv("API_TOKEN", "token")
+    return db_path
+
+
+def make_settings(**values) -> admissionsettings:
+    settings = admissionsettings()
+    for name, value in values.items():
+        setattr(settings, name, value)
+    return settings
+
+
+def signed(agent_id: str) -> tuple[bytes, dict]:
+    payload = {
+        "agent_id": agent_id,
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "platform": "windows",
+        "events": [{"type": "metric", "cpu": 0.25, "mem_free": 1024}],
+    }
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    timestamp = str(int(time.time()))
+    return body, {
+        "X-Api-Token": "token",
+        "Content-Type": "application/json",
+        "X-Signature": backend_main.validator.build_signature(timestamp, body).hex(),
+        "X-Signature-Ts": timestamp,
+    }
+
+
+def test_bucket_refills_and_limits_each_agent_separately():
+    buckets = agentbuckets(make_settings(agent_rate=2.0, agent_burst=3.0))
+    for _ in range(3):
+        buckets.take(["noisy"], now=100.0)
+    with pytest.raises(ratelimited) as excinfo:
+        buckets.take(["noisy"], now=100.0)
+    assert excinfo.value.retry_after == 1
+    buckets.take(["quiet"], now=100.0)
+    buckets.take(["noisy"], now=100.5)
+    assert buckets.limited == 1
+
+
+def test_idle_agents_expire_and_size_is_capped():
+    buckets = agentbuckets(make_settings(agent_rate=1.0, agent_burst=2.0, max_agents=3))
+    buckets.take(["a"], now=0.0)
+    buckets.take(["b"], now=1.0)
+    # "a" простоял burst / rate секунд: ведро снова полное, запись больше не нужна
+    buckets.take(["c"], now=2.0)
+    assert list(buckets.buckets) == ["b", "c"]
+    for agent_id in ("d", "e"):
+        buckets.take([agent_id], now=2.5)
+    assert list(buckets.buckets) == ["c", "d", "e"]
+    assert buckets.evicted == 1
+
+
+@pytest.mark.asyncio
+async def test_gate_queues_then_sheds():
+    gate = concurrencygate(make_settings(max_inflight=1, max_waiting=1, wait_ms=50))
+    order = []
+    release = asyncio.Event()
+
+    async def hold(name: str) -> None:
+        async with gate.slot():
+            order.append(name)
+            await release.wait()
+
+    first = asyncio.create_task(hold("first"))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(hold("second"))
+    await asyncio.sleep(0)
+    with pytest.raises(overloaded):
+        await gate.acquire()
+    release.set()
+    await asyncio.gather(first, second)
+    assert order == ["first", "second"]
+    # ожидание дольше wait_ms тоже снимается с 503
+    release.clear()
+    first = asyncio.create_task(hold("third"))
+    await asyncio.sleep(0)
+    with pytest.raises(overloaded):
+        await gate.acquire()
+    release.set()
+    await first
+    assert gate.shed == 2
+    assert gate.snapshot()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_ingest_returns_429_for_a_flooding_agent(monkeypatch):
+    await init_db()
+    monkeypatch.setattr(backend_main.agent_limits, "settings", make_settings(agent_rate=0.5, agent_burst=2.0))
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        statuses = []
+        for _ in range(3):
+            body, headers = signed("agent-flood")
+            statuses.append(await client.post("/api/ingest", content=body, headers=headers))
+        body, headers = signed("agent-calm")
+        calm = await client.post("/api/ingest", content=body, headers=headers)
+    assert [response.status_code for response in statuses] == [200, 200, 429]
+    assert statuses[2].headers["retry-after"] == "2"
+    assert calm.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_ingest_sheds_with_503_when_writes_are_saturated(monkeypatch):
+    await init_db()
+    monkeypatch.setattr(backend_main, "write_gate", concurrencygate(make_settings(max_inflight=1, max_waiting=0)))
+    await backend_main.write_gate.acquire()
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            body, headers = signed("agent-shed")
+            response = await client.post("/api/ingest", content=body, headers=headers)
+            # слот не был получен: подпись не записана, ретрай той же пачки пройдет
+            backend_main.write_gate.release()
+            retry = await client.post("/api/ingest", content=body, headers=headers)
+    finally:
+        backend_main.write_gate.active = 0
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert retry.status_code == 200
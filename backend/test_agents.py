@@ -0,0 +1,97 @@
+import pytest
+from fastapi.testclient import TestClient
+from . import main as backend_main
+from .agents import agentindex, rate_tau
+from .database import fetch_latest_states, init_db, insert_events
+from .main import app
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    monkeypatch.setenv("API_TOKEN", "token")
+    return db_path
+
+
+def metric_row(agent_id: str, cpu: float, mem_free: int) -> tuple:
+    return (agent_id, "2025-11-12T12:00:00+00:00", "windows", "metric", cpu, mem_free, None, None, None)
+
+
+def proc_row(agent_id: str) -> tuple:
+    return (agent_id, "2025-11-12T12:00:05+00:00", "windows", "proc", 0.1, None, 1, "x.exe", 1)
+
+
+def record(event_id: int, agent_id: str, event_type: str, cpu: float | None) -> dict:
+    return {
+        "id": event_id,
+        "agent_id": agent_id,
+        "ts": f"2025-11-12T12:00:0{event_id}+00:00",
+        "platform": "windows",
+        "event_type": event_type,
+        "cpu": cpu,
+        "mem_free": 1,
+        "ingested_at": "2025-11-12 12:00:10",
+    }
+
+
+def test_index_keeps_last_metric_and_decays_rate():
+    index = agentindex()
+    index.apply([record(1, "a", "metric", 0.1), record(2, "a", "metric", 0.2), record(3, "a", "proc", 0.9)], now=100.0)
+    index.apply([record(4, "b", "proc", 0.5)], now=100.0)
+    (state,) = index.snapshot("a", now=100.0)
+    assert state["metric"] == {"ts": "2025-11-12T12:00:02+00:00", "cpu": 0.2, "mem_free": 1}
+    assert state["last_ts"] == "2025-11-12T12:00:03+00:00"
+    assert state["last_seen"] == "2025-11-12T12:00:10"
+    assert state["events_per_second"] == pytest.approx(3 / rate_tau, abs=1e-3)
+    assert index.snapshot("a", now=100.0 + rate_tau * 10)[0]["events_per_second"] == 0
+    assert [item["agent_id"] for item in index.snapshot()] == ["a", "b"]
+    assert index.snapshot("b")[0]["metric"] is None
+    index.remove("a")
+    assert index.snapshot("a") == []
+
+
+@pytest.mark.asyncio
+async def test_merge_from_database_matches_live_index():
+    await init_db()
+    live = agentindex()
+    for rows in ([metric_row("a", 0.1, 10), proc_row("b")], [metric_row("a", 0.3, 30), proc_row("a")], [metric_row("c", 0.5, 50)]):
+        live.apply(await insert_events(rows), now=0.0)
+    rebuilt = agentindex()
+    rebuilt.merge(await fetch_latest_states())
+    assert rebuilt.snapshot(now=0.0) == [{**state, "events_per_second": 0.0} for state in live.snapshot(now=1e9)]
+
+
+@pytest.mark.asyncio
+async def test_merge_keeps_live_state():
+    await init_db()
+    await insert_events([metric_row("a", 0.1, 10), metric_row("b", 0.2, 20)])
+    index = agentindex()
+    # после старта a прислал только proc, b — свежую метрику; база догружается позже
+    index.apply([{**record(7, "a", "proc", 0.9), "ts": "2025-11-12T12:01:00+00:00"}], now=0.0)
+    index.apply([{**record(8, "b", "metric", 0.7), "ts": "2025-11-12T12:01:00+00:00"}], now=0.0)
+    index.merge(await fetch_latest_states())
+    index.merge(await fetch_latest_states())
+    a, b = index.snapshot(now=0.0)
+    assert a["last_ts"] == "2025-11-12T12:01:00+00:00" and a["metric"]["cpu"] == 0.1
+    assert b["metric"]["cpu"] == 0.7
+    await insert_events([metric_row("c", 0.3, 30)])
+    index.merge(await fetch_latest_states())
+    assert index.snapshot("c", now=0.0)[0]["metric"]["cpu"] == 0.3
+
+
+def test_agents_endpoint_and_websocket_snapshot():
+    with TestClient(app) as client:
+        backend_main.agent_index.apply(
+            [record(1, "agent-a", "metric", 0.25), record(2, "agent-b", "metric", 0.5)]
+        )
+        assert [item["agent_id"] for item in client.get("/api/agents").json()] == ["agent-a", "agent-b"]
+        assert client.get("/api/agents", params={"agent_id": "agent-b"}).json()[0]["metric"]["cpu"] == 0.5
+        with client.websocket_connect("/ws?agent_id=agent-a") as websocket:
+            snapshot = websocket.receive_json()
+        assert snapshot["type"] == "snapshot"
+        assert [item["agent_id"] for item in snapshot["agents"]] == ["agent-a"]
+        with client.websocket_connect("/ws?batch_ms=10") as websocket:
+            frame = websocket.receive_json()
+        assert frame[0]["type"] == "snapshot"
+        assert len(frame[0]["agents"]) == 2
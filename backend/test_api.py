@@ -1,11 +1,13 @@
 from datetime import datetime, timezone
+import csv
+import io
 import json
 import os
 import time
 import pytest
 from httpx import AsyncClient
 from . import main as backend_main
-from .database import fetch_events, init_db
+from .database import fetch_events, init_db, insert_events, select_columns
 from .main import app
 from .security import signaturevalidator
 
@@ -129,3 +131,97 @@ async def test_clear_events(monkeypatch):
     records = await fetch_events("agent-test", 10)
     assert records == []
 
+
+
+def test_websocket_receives_ingested_events(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    secret = "unit-secret"
+    backend_main.validator.settings.secret = secret.encode()
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws?agent_id=agent-ws") as websocket:
+            assert websocket.receive_json() == {"type": "snapshot", "agents": []}
+            payload = {
+                "agent_id": "agent-ws",
+                "ts": datetime.now(timezone.utc).isoformat(),
+                "platform": "windows",
+                "events": [
+                    {"type": "metric", "cpu": 0.5, "mem_free": 1024},
+                    {"type": "proc", "pid": 7, "name": "demo", "cpu": 0.1, "rss": 64},
+                ],
+            }
+            body = json.dumps(payload, separators=(",", ":"))
+            timestamp = str(int(time.time()))
+            signature = backend_main.validator.build_signature(timestamp, body.encode()).hex()
+            response = client.post(
+                "/api/ingest",
+                content=body,
+                headers={
+                    "X-Api-Token": "token",
+                    "Content-Type": "application/json",
+                    "X-Signature": signature,
+                    "X-Signature-Ts": timestamp,
+                },
+            )
+            assert response.status_code == 200
+            first = websocket.receive_json()
+            second = websocket.receive_json()
+    assert [first["event_type"], second["event_type"]] == ["metric", "proc"]
+    assert second["proc_name"] == "demo"
+
+
+def test_websocket_resumes_from_since_id(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    backend_main.validator.settings.secret = b"unit-secret"
+    with TestClient(app) as client:
+        payload = {
+            "agent_id": "agent-resume",
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "platform": "windows",
+            "events": [{"type": "metric", "cpu": 0.5, "mem_free": 1024}, {"type": "metric", "cpu": 0.6, "mem_free": 1024}],
+        }
+        body = json.dumps(payload, separators=(",", ":"))
+        timestamp = str(int(time.time()))
+        signature = backend_main.validator.build_signature(timestamp, body.encode()).hex()
+        headers = {
+            "X-Api-Token": "token",
+            "Content-Type": "application/json",
+            "X-Signature": signature,
+            "X-Signature-Ts": timestamp,
+        }
+        assert client.post("/api/ingest", content=body, headers=headers).status_code == 200
+        # кольцо пусто после рестарта: первые события берутся из базы, следующие — из кольца
+        backend_main.manager.recent.clear()
+        backend_main.manager.covered_from = 2
+        with client.websocket_connect("/ws?since_id=0") as websocket:
+            replayed = [websocket.receive_json(), websocket.receive_json()]
+            assert websocket.receive_json() == {"type": "resumed", "since_id": 0, "events": 2}
+        with client.websocket_connect("/ws?since_id=999999") as websocket:
+            assert websocket.receive_json()["type"] == "resumed"
+        monkeypatch.setattr(backend_main.manager.settings, "replay_max", 1)
+        with client.websocket_connect("/ws?since_id=0") as websocket:
+            assert websocket.receive_json() == {"type": "resync", "since_id": 0}
+            assert websocket.receive_json()["type"] == "snapshot"
+    assert [event["id"] for event in replayed] == [1, 2]
+    assert [event["cpu"] for event in replayed] == [0.5, 0.6]
+
+
+@pytest.mark.asyncio
+async def test_stream_events_ndjson_and_csv():
+    await init_db()
+    inserted = await insert_events(
+        [("agent-x", "2025-11-12T12:00:00+00:00", "windows", "proc", 0.5, None, index, "a,b", 1) for index in range(3)]
+    )
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/api/events/stream", params={"agent_id": "agent-x", "after_id": inserted[0]["id"]})
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["pid"] for line in lines] == [1, 2]
+        assert lines[0]["ts"] == "2025-11-12T12:00:00Z"
+
+        response = await client.get("/api/events/stream", params={"format": "csv", "from": "2025-11-12T13:00:00Z"})
+        assert response.text.splitlines() == [",".join(select_columns)]
+        response = await client.get("/api/events/stream", params={"format": "csv"})
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [row["proc_name"] for row in rows] == ["a,b"] * 3
@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+import pytest
+from httpx import AsyncClient
+from . import main as backend_main
+from .archive import archiveengine, archivesettings
+from .database import epoch_ms, fetch_events, init_db, insert_events, writer
+from .fastpath import render_event
+from .main import app
+
+pa = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    monkeypatch.setenv("API_TOKEN", "token")
+    return db_path
+
+
+def make_row(agent_id: str, ts: str, cpu: float) -> tuple:
+    return (agent_id, ts, "windows", "proc", cpu, None, 42, "app.exe", 2048)
+
+
+async def seed() -> list[dict]:
+    await init_db()
+    inserted = await insert_events(
+        [
+            make_row("host/01", "2025-11-11T23:30:00+00:00", 0.1),
+            make_row("host/01", "2025-11-12T01:30:00+02:00", 0.2),
+            make_row("host-02", "2025-11-12T08:00:00+00:00", 0.3),
+            make_row("host-02", "2025-11-12T09:00:00+00:00", 0.4),
+        ]
+    )
+    async with writer() as conn:
+        await conn.execute("update events set ingested_at = ?", (epoch_ms("2025-11-13 00:00:00"),))
+        await conn.commit()
+    return inserted
+
+
+def make_engine(tmp_path) -> archiveengine:
+    settings = archivesettings()
+    settings.after = 86400
+    settings.root = str(tmp_path / "archive")
+    settings.chunk_rows = 3
+    return archiveengine(settings)
+
+
+@pytest.mark.asyncio
+async def test_run_once_moves_old_rows_to_partitions(tmp_path):
+    await seed()
+    fresh = await insert_events([make_row("host-02", "2025-11-12T10:00:00+00:00", 0.5)])
+    engine = make_engine(tmp_path)
+    assert await engine.run_once() == 4
+    assert [row["id"] for row in await fetch_events(None, 10)] == [fresh[0]["id"]]
+    days = sorted(path.name for path in (tmp_path / "archive").iterdir())
+    assert days == ["day=2025-11-11", "day=2025-11-12"]
+    assert (tmp_path / "archive" / "day=2025-11-11" / "agent_id=host%2F01").is_dir()
+    assert await engine.run_once() == 0
+    assert engine.snapshot()["rows_archived"] == 4
+
+
+@pytest.mark.asyncio
+async def test_scan_filters_agent_and_time(tmp_path):
+    await seed()
+    engine = make_engine(tmp_path)
+    await engine.run_once()
+    start = datetime(2025, 11, 11, tzinfo=timezone.utc)
+    end = datetime(2025, 11, 13, tzinfo=timezone.utc)
+    table = engine.scan("host/01", start, end, 100)
+    assert table.column("cpu").to_pylist() == [0.1, 0.2]
+    narrow = engine.scan(None, datetime(2025, 11, 12, 8, 30, tzinfo=timezone.utc), end, 100)
+    assert narrow.column("agent_id").to_pylist() == ["host-02"]
+    assert engine.scan(None, start, end, 2).num_rows == 2
+
+
+class recordingdataset:
+    def __init__(self, inner) -> None:
+        self.inner = inner
+        self.filters: list[str] = []
+
+    def to_batches(self, **kwargs):
+        self.filters.append(str(kwargs["filter"]))
+        return self.inner.to_batches(**kwargs)
+
+
+@pytest.mark.asyncio
+async def test_scan_stops_after_limit(tmp_path, monkeypatch):
+    await seed()
+    engine = make_engine(tmp_path)
+    await engine.run_once()
+    dataset = recordingdataset(engine.dataset())
+    monkeypatch.setattr(engine, "dataset", lambda: dataset)
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    end = datetime(2025, 11, 13, tzinfo=timezone.utc)
+    table = engine.scan(None, start, end, 2)
+    assert table.column("cpu").to_pylist() == [0.1, 0.2]
+    # вторая партиция (2025-11-12) не читалась
+    assert len(dataset.filters) == 1 and "2025-11-11" in dataset.filters[0]
+    assert engine.scan(None, start, end, 3).column("cpu").to_pylist() == [0.1, 0.2, 0.3]
+
+
+@pytest.mark.asyncio
+async def test_archive_endpoint(tmp_path, monkeypatch):
+    inserted = await seed()
+    engine = make_engine(tmp_path)
+    monkeypatch.setattr(backend_main, "archiver", engine)
+    await engine.run_once()
+    params = {"agent_id": "host-02", "from": "2025-11-12T00:00:00Z", "to": "2025-11-13T00:00:00Z"}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/api/archive/events", params=params)
+        assert response.status_code == 200
+        expected = [{**row, "ingested_at": "2025-11-13 00:00:00"} for row in inserted[2:]]
+        assert response.json() == [render_event(row) for row in expected]
+        response = await client.get("/api/archive/events", params={**params, "format": "arrow"})
+        table = pa.ipc.open_stream(response.content).read_all()
+        assert table.column("id").to_pylist() == [row["id"] for row in inserted[2:]]
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import pytest
+from .broadcast import broadcastsettings, connectionmanager, streamoptions
+
+
+class fakesocket:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.sent: list[str] = []
+        self.closed = False
+        self.release = asyncio.Event()
+
+    async def accept(self) -> None:
+        pass
+
+    async def send_text(self, text: str) -> None:
+        if self.delay:
+            await self.release.wait()
+        self.sent.append(text)
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def make_manager(queue_size: int = 4, policy: str = "drop_oldest") -> connectionmanager:
+    settings = broadcastsettings()
+    settings.queue_size = queue_size
+    settings.slow_policy = policy
+    return connectionmanager(settings)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_routes_by_agent_index():
+    manager = make_manager()
+    everything, only_a, only_b = fakesocket(), fakesocket(), fakesocket()
+    await manager.connect(everything, None)
+    await manager.connect(only_a, "a")
+    await manager.connect(only_b, "b")
+
+    await manager.broadcast({"id": 1, "agent_id": "a"})
+    await manager.broadcast({"id": 2, "agent_id": "b"})
+    await manager.broadcast({"type": "clear", "agent_id": None})
+    await asyncio.sleep(0.01)
+
+    assert [json.loads(text)["id"] for text in only_a.sent] == [1]
+    assert [json.loads(text)["id"] for text in only_b.sent] == [2]
+    assert len(everything.sent) == 3
+
+    await manager.disconnect(only_a)
+    assert manager.snapshot()["connections"] == 2
+    assert "a" not in manager.by_agent
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_does_not_stall_others_and_drops_oldest():
+    manager = make_manager(queue_size=2)
+    slow, fast = fakesocket(delay=1), fakesocket()
+    await manager.connect(slow, None)
+    await manager.connect(fast, None)
+    for index in range(6):
+        await manager.broadcast({"id": index, "agent_id": "a"})
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+    assert [json.loads(text)["id"] for text in fast.sent] == list(range(6))
+
+    slow.release.set()
+    await asyncio.sleep(0.01)
+    received = [json.loads(text)["id"] for text in slow.sent]
+    assert received[-2:] == [4, 5]
+    assert len(received) < 6
+    assert manager.snapshot()["dropped_frames"] == 6 - len(received)
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_disconnect_policy():
+    manager = make_manager(queue_size=1, policy="disconnect")
+    slow = fakesocket(delay=1)
+    await manager.connect(slow, "a")
+    for index in range(4):
+        await manager.broadcast({"id": index, "agent_id": "a"})
+    await asyncio.sleep(0.01)
+    assert slow.closed
+    assert manager.snapshot()["connections"] == 0
+    assert manager.slow_disconnects == 1
+
+
+@pytest.mark.asyncio
+async def test_batched_frames_coalesce_events():
+    manager = make_manager(queue_size=64)
+    batched = fakesocket()
+    await manager.connect(batched, None, streamoptions(batch_ms=20))
+    for index in range(5):
+        await manager.broadcast({"id": index, "agent_id": "a", "event_type": "metric"})
+    await asyncio.sleep(0.05)
+    assert len(batched.sent) == 1
+    assert [event["id"] for event in json.loads(batched.sent[0])] == list(range(5))
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_latest_mode_keeps_last_metric_per_agent():
+    manager = make_manager(queue_size=64)
+    overview = fakesocket()
+    await manager.connect(overview, None, streamoptions(batch_ms=20, latest=True))
+    await manager.broadcast({"id": 1, "agent_id": "a", "event_type": "metric"})
+    await manager.broadcast({"id": 2, "agent_id": "b", "event_type": "metric"})
+    await manager.broadcast({"id": 3, "agent_id": "a", "event_type": "proc"})
+    await manager.broadcast({"id": 4, "agent_id": "a", "event_type": "metric"})
+    await asyncio.sleep(0.05)
+    frame = json.loads(overview.sent[0])
+    assert sorted(event["id"] for event in frame) == [2, 4]
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_max_rate_spaces_frames():
+    manager = make_manager(queue_size=64)
+    limited = fakesocket()
+    await manager.connect(limited, None, streamoptions(max_rate=20))
+    await manager.broadcast({"id": 1, "agent_id": "a"})
+    await asyncio.sleep(0.01)
+    for index in range(2, 6):
+        await manager.broadcast({"id": index, "agent_id": "a"})
+    await asyncio.sleep(0.02)
+    assert len(limited.sent) == 1
+    await asyncio.sleep(0.06)
+    assert [len(json.loads(frame)) for frame in limited.sent] == [1, 4]
+    await manager.close_all()
+
+
+def event_ids(socket: fakesocket) -> list:
+    ids = []
+    for text in socket.sent:
+        frame = json.loads(text)
+        for item in frame if isinstance(frame, list) else [frame]:
+            ids.append(item.get("id", item.get("type")))
+    return ids
+
+
+@pytest.mark.asyncio
+async def test_resume_replays_ring_then_switches_to_live():
+    manager = make_manager(queue_size=64)
+    manager.resume_from(0)
+    for index in range(1, 6):
+        await manager.broadcast({"id": index, "agent_id": "a" if index % 2 else "b"})
+    everything, only_a = fakesocket(), fakesocket()
+    client = await manager.connect(everything, None, hold=True)
+    assert await manager.resume(client, 2)
+    await manager.broadcast({"id": 6, "agent_id": "b"})
+    manager.start(client, [json.dumps({"type": "resumed"})])
+    client = await manager.connect(only_a, "a", streamoptions(batch_ms=1), hold=True)
+    assert await manager.resume(client, 0)
+    manager.start(client, [])
+    await manager.broadcast({"id": 7, "agent_id": "a"})
+    await asyncio.sleep(0.02)
+    assert event_ids(everything) == [3, 4, 5, "resumed", 6, 7]
+    assert event_ids(only_a) == [1, 3, 5, 7]
+    assert manager.history_reads == 0
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_resume_reads_database_below_ring_without_duplicates():
+    settings = broadcastsettings()
+    settings.queue_size = 64
+    settings.replay_buffer = 2
+    stored = [{"id": index, "agent_id": "a"} for index in range(1, 7)]
+    calls = []
+
+    async def history(agent_id, event_type, since_id, upto, limit):
+        calls.append((since_id, upto))
+        # пока идет чтение, писатель успевает опубликовать следующее событие
+        await manager.broadcast({"id": 5, "agent_id": "a"})
+        return [row for row in stored if since_id < row["id"] <= (upto if upto is not None else 10**9)][:limit]
+
+    manager = connectionmanager(settings, history)
+    manager.resume_from(0)
+    for index in range(1, 5):
+        await manager.broadcast({"id": index, "agent_id": "a"})
+    assert manager.covered_from == 2
+    socket = fakesocket()
+    client = await manager.connect(socket, None, hold=True)
+    assert await manager.resume(client, 0)
+    manager.start(client, [])
+    await asyncio.sleep(0.01)
+    assert calls == [(0, 2)]
+    assert event_ids(socket) == [1, 2, 3, 4, 5]
+
+    # граница неизвестна: все из базы, включая событие 6, которое еще не разослано
+    manager.covered_from = None
+    late = fakesocket()
+    client = await manager.connect(late, None, hold=True)
+    assert await manager.resume(client, 3)
+    manager.start(client, [])
+    await manager.broadcast({"id": 6, "agent_id": "a"})
+    await manager.broadcast({"id": 7, "agent_id": "a"})
+    await asyncio.sleep(0.01)
+    assert event_ids(late) == [4, 5, 6, 7]
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_resume_too_far_behind_asks_for_resync():
+    settings = broadcastsettings()
+    settings.replay_max = 2
+
+    async def history(agent_id, event_type, since_id, upto, limit):
+        return [{"id": index, "agent_id": "a"} for index in range(since_id + 1, since_id + 1 + limit)]
+
+    manager = connectionmanager(settings, history)
+    manager.resume_from(100)
+    client = await manager.connect(fakesocket(), None, hold=True)
+    assert not await manager.resume(client, 10)
+    assert manager.snapshot()["resyncs"] == 1
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_latest_resume_counts_only_metrics():
+    settings = broadcastsettings()
+    settings.replay_max = 2
+    stored = [{"id": index, "agent_id": "a", "event_type": "metric" if index in (4, 9) else "proc"} for index in range(1, 11)]
+    calls = []
+
+    async def history(agent_id, event_type, since_id, upto, limit):
+        calls.append(event_type)
+        rows = [row for row in stored if since_id < row["id"] <= upto and event_type in (None, row["event_type"])]
+        return rows[:limit]
+
+    manager = connectionmanager(settings, history)
+    manager.resume_from(10)
+    socket = fakesocket()
+    client = await manager.connect(socket, None, streamoptions(latest=True), hold=True)
+    assert await manager.resume(client, 0)
+    plain = await manager.connect(fakesocket(), None, hold=True)
+    assert not await manager.resume(plain, 0)
+    assert calls == ["metric", None]
+    assert event_ids(socket) == [4, 9]
+    await manager.close_all()
+
+
+@pytest.mark.asyncio
+async def test_events_without_subscribers_are_encoded_on_resume_only():
+    manager = make_manager(queue_size=64)
+    manager.resume_from(0)
+    await manager.broadcast({"id": 1, "agent_id": "a"})
+    assert isinstance(manager.recent[0][3], dict)
+    socket = fakesocket()
+    client = await manager.connect(socket, None, hold=True)
+    await manager.broadcast({"id": 2, "agent_id": "a"})
+    assert isinstance(manager.recent[1][3], str)
+    assert await manager.resume(client, 0)
+    manager.start(client, [])
+    await asyncio.sleep(0.01)
+    assert event_ids(socket) == [1, 2]
+    await manager.close_all()
+
+
+def test_stream_options_from_query():
+    options = streamoptions.from_query({"batch_ms": "250", "max_rate": "4", "latest": "1"})
+    assert (options.batch_ms, options.max_rate, options.latest) == (250, 4.0, True)
+    assert not streamoptions.from_query({}).batched
+    with pytest.raises(ValueError):
+        streamoptions.from_query({"batch_ms": "-1"})
@@ -0,0 +1,83 @@
+import time
+import pytest
+from httpx import AsyncClient
+from . import main as backend_main
+from .cache import responsecache, responsecachesettings
+from .database import init_db, insert_events
+from .main import app
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    monkeypatch.setenv("API_TOKEN", "token")
+    return db_path
+
+
+def make_cache(ttl: float = 60, size: int = 16) -> responsecache:
+    settings = responsecachesettings()
+    settings.ttl = ttl
+    settings.max_entries = size
+    return responsecache(settings)
+
+
+def test_invalidation_is_per_agent():
+    cache = make_cache()
+    for key in (("a", 50, None, None), ("b", 50, None, None), (None, 50, None, None)):
+        cache.put(key, cache.version(key[0]), b"[]")
+    cache.invalidate({"a"})
+    assert cache.get(("a", 50, None, None)) is None
+    assert cache.get((None, 50, None, None)) is None
+    assert cache.get(("b", 50, None, None)) == b"[]"
+
+
+def test_stale_result_is_not_stored():
+    cache = make_cache()
+    version = cache.version("a")
+    cache.invalidate({"a"})
+    cache.put(("a", 50, None, None), version, b"[1]")
+    assert cache.get(("a", 50, None, None)) is None
+    version = cache.version("b")
+    cache.clear()
+    cache.put(("b", 50, None, None), version, b"[1]")
+    assert cache.get(("b", 50, None, None)) is None
+
+
+def test_lru_and_ttl():
+    cache = make_cache(size=2)
+    for agent in ("a", "b"):
+        cache.put((agent,), cache.version(agent), agent.encode())
+    cache.get(("a",))
+    cache.put(("c",), cache.version("c"), b"c")
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == b"a"
+    expiring = make_cache(ttl=0.01)
+    expiring.put(("a",), expiring.version("a"), b"a")
+    time.sleep(0.02)
+    assert expiring.get(("a",)) is None
+    assert expiring.entries == {}
+
+
+@pytest.mark.asyncio
+async def test_events_endpoint_uses_cache_until_ingest(monkeypatch):
+    monkeypatch.setattr(backend_main.events_cache.settings, "ttl", 60)
+    await init_db()
+    row = ("agent-a", "2025-11-12T12:00:00+00:00", "windows", "metric", 0.5, 1, None, None, None)
+    await backend_main.publish(await insert_events([row]))
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        first = await client.get("/api/events", params={"agent_id": "agent-a"})
+        hits = backend_main.events_cache.hits
+        second = await client.get("/api/events", params={"agent_id": "agent-a"})
+        assert backend_main.events_cache.hits == hits + 1
+        assert first.content == second.content
+        assert [item["cpu"] for item in first.json()] == [0.5]
+        assert first.json()[0]["ts"] == "2025-11-12T12:00:00Z"
+
+        await backend_main.publish(await insert_events([row]))
+        third = await client.get("/api/events", params={"agent_id": "agent-a"})
+        assert len(third.json()) == 2
+
+        response = await client.post("/api/events/clear", json={}, headers={"X-Api-Token": "token"})
+        assert response.status_code == 200
+        assert (await client.get("/api/events", params={"agent_id": "agent-a"})).json() == []
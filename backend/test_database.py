@@ -0,0 +1,189 @@
+import pytest
+import asyncio
+import sqlite3
+from . import database
+from .database import fetch_events, init_db, insert_events, iter_events, reader
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    return db_path
+
+
+def make_rows(agent_id: str, count: int) -> list[tuple]:
+    return [
+        (agent_id, "2025-11-12T12:00:00+00:00", "windows", "proc", 0.1, None, 1000 + index, f"proc-{index}", 2048)
+        for index in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_insert_events_bulk_matches_stored_rows():
+    await init_db()
+    rows = make_rows("agent-bulk", 250)
+    inserted = await insert_events(rows)
+    assert len(inserted) == 250
+    assert [record["pid"] for record in inserted] == [row[6] for row in rows]
+    ids = [record["id"] for record in inserted]
+    assert ids == sorted(ids)
+
+    stored = {record["id"]: record for record in await fetch_events("agent-bulk", 500)}
+    for record in inserted:
+        assert stored[record["id"]] == record
+
+
+@pytest.mark.asyncio
+async def test_insert_events_empty():
+    await init_db()
+    assert await insert_events([]) == []
+
+
+@pytest.mark.asyncio
+async def test_open_reader_does_not_block_writer():
+    await init_db()
+    await insert_events(make_rows("agent-wal", 50))
+    async with reader() as conn:
+        mode = await conn.execute_fetchall("pragma journal_mode")
+        assert mode[0][0] == "wal"
+        cursor = await conn.execute("select id from events")
+        assert await cursor.fetchone() is not None
+        inserted = await asyncio.wait_for(insert_events(make_rows("agent-wal", 5)), timeout=2)
+        assert len(inserted) == 5
+        await cursor.close()
+    assert len(await fetch_events("agent-wal", 500)) == 55
+
+
+@pytest.mark.asyncio
+async def test_fetch_events_keyset_pages():
+    await init_db()
+    await insert_events(make_rows("agent-a", 30))
+    await insert_events(make_rows("agent-b", 10))
+    await insert_events(make_rows("agent-a", 30))
+
+    seen: list[int] = []
+    page = await fetch_events("agent-a", 25)
+    while page:
+        ids = [record["id"] for record in page]
+        assert ids == sorted(ids, reverse=True)
+        seen.extend(ids)
+        page = await fetch_events("agent-a", 25, before_id=ids[-1])
+    assert len(seen) == 60
+    assert len(set(seen)) == 60
+
+    newer = await fetch_events("agent-a", 5, after_id=seen[10])
+    assert [record["id"] for record in newer] == seen[5:10]
+
+    metric = await insert_events([("agent-a", "2025-11-12T12:00:00+00:00", "windows", "metric", 0.5, 1, None, None, None)])
+    assert [record["id"] for record in await fetch_events("agent-a", 5, after_id=seen[10], event_type="metric")] == [
+        metric[0]["id"]
+    ]
+    assert await fetch_events(None, 5, event_type="unknown") == []
+
+
+@pytest.mark.asyncio
+async def test_agent_filter_uses_composite_index():
+    await init_db()
+    async with reader() as conn:
+        plan = await conn.execute_fetchall(
+            "explain query plan select id from events where agent = ? and id < ? order by id desc limit 50",
+            (1, 100),
+        )
+    details = " ".join(row[3] for row in plan)
+    assert "events_agent_id" in details
+    assert "TEMP B-TREE" not in details
+
+
+@pytest.mark.asyncio
+async def test_iter_events_pages_in_id_order(monkeypatch):
+    monkeypatch.setattr(database, "stream_page_rows", 7)
+    monkeypatch.setattr(database, "stream_fetch_rows", 3)
+    await init_db()
+    await insert_events(make_rows("agent-a", 20))
+    await insert_events(make_rows("agent-b", 5))
+    await insert_events(make_rows("agent-a", 8))
+
+    batches = [batch async for batch in iter_events("agent-a")]
+    ids = [record["id"] for batch in batches for record in batch]
+    assert ids == sorted(ids)
+    assert len(ids) == 28
+    assert max(len(batch) for batch in batches) == 3
+    resumed = [record["id"] async for batch in iter_events("agent-a", after_id=ids[9]) for record in batch]
+    assert resumed == ids[10:]
+
+
+@pytest.mark.asyncio
+async def test_iter_events_time_range_handles_offsets():
+    await init_db()
+    await insert_events(
+        [
+            ("agent-a", ts, "windows", "metric", 0.1, 1, None, None, None)
+            for ts in ("2025-11-12T11:59:59+00:00", "2025-11-12T15:00:00+03:00", "2025-11-12T12:30:00", "2025-11-12T13:00:00Z")
+        ]
+    )
+    batches = [batch async for batch in iter_events(None, "2025-11-12T12:00:00+00:00", "2025-11-12T13:00:00+00:00")]
+    # время хранится в мс utc и отдается в utc
+    assert [record["ts"] for batch in batches for record in batch] == ["2025-11-12T12:00:00Z", "2025-11-12T12:30:00Z"]
+
+
+@pytest.mark.asyncio
+async def test_rows_are_dictionary_encoded():
+    await init_db()
+    inserted = await insert_events(make_rows("agent-a", 3) + make_rows("agent-b", 2))
+    async with reader() as conn:
+        agents = await conn.execute_fetchall("select name from agents order by id")
+        procs = await conn.execute_fetchall("select count(*) from proc_names")
+        stored = await conn.execute_fetchall("select agent, ts, type, proc from events order by id limit 1")
+    assert [row[0] for row in agents] == ["agent-a", "agent-b"]
+    assert procs[0][0] == 3
+    assert tuple(stored[0])[1] == 1762948800000
+    assert all(type(value) is int for value in tuple(stored[0]))
+    assert inserted[0]["ts"] == "2025-11-12T12:00:00Z"
+    # новый пул читает ключи из базы, а не из кэша писателя
+    await database.close_pool()
+    assert [record["proc_name"] for record in await fetch_events("agent-a", 10)] == ["proc-2", "proc-1", "proc-0"]
+
+
+@pytest.mark.asyncio
+async def test_text_events_table_is_migrated(override_db):
+    connection = sqlite3.connect(override_db)
+    connection.executescript(
+        """
+        create table events (
+            id integer primary key autoincrement,
+            agent_id text not null,
+            ts text not null,
+            platform text not null,
+            event_type text not null,
+            cpu real,
+            mem_free integer,
+            pid integer,
+            proc_name text,
+            rss integer,
+            ingested_at text not null default (datetime('now'))
+        );
+        create index events_agent_id_id on events (agent_id, id);
+        insert into events (agent_id, ts, platform, event_type, cpu, mem_free, pid, proc_name, rss, ingested_at) values
+            ('agent-a', '2025-11-12T15:00:00.250+03:00', 'windows', 'metric', 0.5, 10, null, null, null, '2025-11-12 12:00:01'),
+            ('agent-a', '2025-11-12T12:00:05+00:00', 'windows', 'proc', 0.1, null, 7, 'app.exe', 64, '2025-11-12 12:00:06'),
+            ('agent-b', '2025-11-12T12:00:05', 'linux', 'proc', 0.2, null, 8, null, 32, '2025-11-12 12:00:06');
+        delete from events where id = 3;
+        insert into events (agent_id, ts, platform, event_type, ingested_at) values
+            ('agent-b', '2025-11-12T12:00:09Z', 'linux', 'metric', '2025-11-12 12:00:10');
+        """
+    )
+    connection.close()
+    await init_db()
+    records = await fetch_events(None, 10)
+    assert [(record["id"], record["agent_id"], record["ts"], record["ingested_at"]) for record in records] == [
+        (4, "agent-b", "2025-11-12T12:00:09Z", "2025-11-12 12:00:10"),
+        (2, "agent-a", "2025-11-12T12:00:05Z", "2025-11-12 12:00:06"),
+        (1, "agent-a", "2025-11-12T12:00:00.250Z", "2025-11-12 12:00:01"),
+    ]
+    assert records[1]["proc_name"] == "app.exe"
+    # autoincrement продолжается с прежнего значения, удаленный id не переиспользуется
+    inserted = await insert_events(make_rows("agent-c", 1))
+    assert inserted[0]["id"] == 5
+    await init_db()
+    assert len(await fetch_events(None, 10)) == 4
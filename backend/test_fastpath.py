@@ -0,0 +1,88 @@
+import json
+import pytest
+from fastapi.exceptions import RequestValidationError
+from .fastpath import decode_rows, model_rows, render_event
+from .models import eventrecord, ingestbatch
+
+
+def encode(payload: dict) -> bytes:
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def make_payload(**overrides) -> dict:
+    payload = {
+        "agent_id": "host-01",
+        "ts": "2025-11-12T12:00:00+00:00",
+        "platform": "Windows",
+        "events": [
+            {"type": "METRIC", "cpu": 0.32, "mem_free": 134217728},
+            {"type": "proc", "pid": 1234, "name": "example.exe", "cpu": 1, "rss": 67108864},
+        ],
+    }
+    payload.update(overrides)
+    return payload
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        {},
+        {"ts": "2025-11-12T12:00:00Z"},
+        {"ts": "2025-11-12T12:00:00.123456789+03:00"},
+        {"ts": "2025-11-12 12:00:00"},
+        {"ts": 1731415200},
+        {"ts": "2025-11-12t12:00:00z"},
+        {"events": [{"type": "metric", "cpu": "0.5", "mem_free": 1.0}]},
+        {"events": [{"type": "proc", "pid": True}]},
+    ],
+)
+def test_fast_path_matches_models(overrides):
+    body = encode(make_payload(**overrides))
+    assert decode_rows(body) == model_rows(ingestbatch.model_validate_json(body))
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    [
+        {"events": []},
+        {"agent_id": ""},
+        {"extra": 1},
+        {"events": [{"type": "metric", "bogus": 1}]},
+        {"events": [{"type": ""}]},
+        {"ts": "not a date"},
+        {"ts": "2025-W46-3T12:00:00"},
+        {"events": [{"type": "metric", "cpu": float("nan")}]},
+        {"events": [{"type": "metric", "cpu": float("inf")}]},
+        {"events": [{"type": "proc", "cpu": float("-inf"), "pid": 1}]},
+    ],
+)
+def test_invalid_bodies_raise_validation_errors(overrides):
+    with pytest.raises(RequestValidationError) as info:
+        decode_rows(encode(make_payload(**overrides)))
+    assert all(error["loc"][0] == "body" for error in info.value.errors())
+
+
+def test_invalid_json_raises_validation_error():
+    with pytest.raises(RequestValidationError):
+        decode_rows(b"{not json")
+
+
+@pytest.mark.parametrize(
+    "ts",
+    ["2025-11-12T12:00:00+00:00", "2025-11-12T12:00:00.120000+00:00", "2025-11-12T12:00:00+03:00", "2025-11-12T12:00:00"],
+)
+def test_render_event_matches_eventrecord(ts):
+    row = {
+        "id": 7,
+        "agent_id": "host-01",
+        "ts": ts,
+        "platform": "windows",
+        "event_type": "proc",
+        "cpu": 0.5,
+        "mem_free": None,
+        "pid": 10,
+        "proc_name": "x.exe",
+        "rss": 2048,
+        "ingested_at": "2025-11-12 12:00:01",
+    }
+    assert render_event(row) == eventrecord.from_row(row).model_dump(mode="json")
@@ -0,0 +1,129 @@
+import gzip
+import json
+import time
+import pytest
+from fastapi.exceptions import RequestValidationError
+from httpx import AsyncClient
+from . import main as backend_main
+from .database import fetch_events, init_db
+from .fastpath import decode_rows
+from .frames import bodytoolarge, decode_body, decode_frame, encode_frame, frame_type, framesettings, unsupportedformat
+from .main import app
+from .security import signaturevalidator
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    monkeypatch.setenv("API_TOKEN", "token")
+    return db_path
+
+
+def make_payload() -> dict:
+    return {
+        "agent_id": "host-01",
+        "ts": "2025-11-12T12:00:00+00:00",
+        "platform": "Windows",
+        "events": [
+            {"type": "metric", "cpu": 0.32, "mem_free": 134217728},
+            {"type": "PROC", "pid": 1234, "name": "пример.exe", "cpu": 0.08, "rss": 67108864},
+            {"type": "proc", "pid": 99, "name": "idle"},
+        ],
+    }
+
+
+def test_frame_decodes_to_same_rows_as_json():
+    payload = make_payload()
+    frame = encode_frame(payload)
+    assert decode_frame(frame) == decode_rows(json.dumps(payload).encode())
+    assert len(frame) < len(json.dumps(payload, separators=(",", ":")))
+
+
+@pytest.mark.parametrize("cut", [3, 10, 40, -1])
+def test_truncated_frame_is_rejected(cut):
+    frame = encode_frame(make_payload())
+    with pytest.raises(RequestValidationError):
+        decode_frame(frame[:cut])
+    with pytest.raises(RequestValidationError):
+        decode_frame(frame + b"\x00")
+
+
+@pytest.mark.parametrize("cpu", [float("nan"), float("inf")])
+def test_non_finite_cpu_is_rejected(cpu):
+    payload = make_payload()
+    payload["events"][0]["cpu"] = cpu
+    with pytest.raises(RequestValidationError):
+        decode_frame(encode_frame(payload))
+
+
+def test_non_finite_cpu_in_msgpack_is_rejected():
+    msgpack = pytest.importorskip("msgpack")
+    payload = make_payload()
+    payload["events"][0]["cpu"] = float("nan")
+    with pytest.raises(RequestValidationError):
+        decode_body(msgpack.packb(payload), "application/msgpack", None, framesettings())
+
+
+def test_gzip_and_content_type_dispatch():
+    payload = make_payload()
+    expected = decode_rows(json.dumps(payload).encode())
+    settings = framesettings()
+    frame = gzip.compress(encode_frame(payload))
+    assert decode_body(frame, frame_type, "gzip", settings) == expected
+    body = gzip.compress(json.dumps(payload).encode())
+    assert decode_body(body, "application/json; charset=utf-8", "gzip", settings) == expected
+    with pytest.raises(unsupportedformat):
+        decode_body(b"x", "text/csv", None, settings)
+    with pytest.raises(unsupportedformat):
+        decode_body(b"x", "application/json", "br", settings)
+
+
+def test_decompressed_size_is_capped(monkeypatch):
+    monkeypatch.setenv("INGEST_MAX_DECODED_BYTES", "1024")
+    body = gzip.compress(b" " * 4096)
+    with pytest.raises(bodytoolarge):
+        decode_body(body, "application/json", "gzip", framesettings())
+
+
+def test_msgpack_body():
+    msgpack = pytest.importorskip("msgpack")
+    payload = make_payload()
+    body = msgpack.packb(payload)
+    assert decode_body(body, "application/msgpack", None, framesettings()) == decode_rows(json.dumps(payload).encode())
+
+
+def test_zstd_body():
+    zstandard = pytest.importorskip("zstandard")
+    payload = make_payload()
+    body = zstandard.ZstdCompressor().compress(encode_frame(payload))
+    assert decode_body(body, frame_type, "zstd", framesettings()) == decode_rows(json.dumps(payload).encode())
+
+
+@pytest.mark.asyncio
+async def test_ingest_signed_compressed_frame(monkeypatch):
+    secret = "unit-secret"
+    monkeypatch.setattr(backend_main.validator.settings, "secret", secret.encode())
+    await init_db()
+    body = gzip.compress(encode_frame(make_payload()))
+    timestamp = str(int(time.time()))
+    validator = signaturevalidator()
+    validator.settings.secret = secret.encode()
+    headers = {
+        "X-Api-Token": "token",
+        "Content-Type": frame_type,
+        "Content-Encoding": "gzip",
+        "X-Signature": validator.build_signature(timestamp, body).hex(),
+        "X-Signature-Ts": timestamp,
+    }
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post("/api/ingest", content=body, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["stored"] == 3
+        headers["Content-Type"] = "text/csv"
+        headers["X-Signature"] = validator.build_signature(timestamp, body + b" ").hex()
+        response = await client.post("/api/ingest", content=body + b" ", headers=headers)
+        assert response.status_code == 415
+
+    records = await fetch_events("host-01", 10)
+    assert sorted(record["proc_name"] or "" for record in records) == ["", "idle", "пример.exe"]
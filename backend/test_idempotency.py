@@ -0,0 +1,227 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+import pytest
+from httpx import AsyncClient
+from . import main as backend_main
+from .database import fetch_events, init_db
+from .admission import overloaded
+from .idempotency import idempotencyindex, idempotencysettings
+from .main import app
+from .writer import groupcommitwriter, writersettings
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    monkeypatch.setenv("API_TOKEN", "token")
+    return db_path
+
+
+def batch(agent_id: str, cpu: float = 0.25) -> dict:
+    return {
+        "agent_id": agent_id,
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "platform": "windows",
+        "events": [{"type": "metric", "cpu": cpu, "mem_free": 1024}],
+    }
+
+
+def signed(payload: dict) -> tuple[bytes, dict]:
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    timestamp = str(int(time.time()))
+    signature = backend_main.validator.build_signature(timestamp, body).hex()
+    return body, {
+        "X-Api-Token": "token",
+        "Content-Type": "application/json",
+        "X-Signature": signature,
+        "X-Signature-Ts": timestamp,
+    }
+
+
+@pytest.mark.asyncio
+async def test_retry_with_batch_id_is_acknowledged_without_insert(monkeypatch):
+    await init_db()
+    inserts = []
+    original = backend_main.insert_events
+
+    async def counting_insert(rows):
+        inserts.append(len(rows))
+        return await original(rows)
+
+    monkeypatch.setattr(backend_main, "insert_events", counting_insert)
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        body, headers = signed(batch("agent-retry"))
+        headers["X-Batch-Id"] = "20241017-0001"
+        first = await client.post("/api/ingest", content=body, headers=headers)
+        # ретрай после потерянного ответа: та же подпись, тот же batch id
+        retry = await client.post("/api/ingest", content=body, headers=headers)
+        # новая подпись, тот же batch id (агент переподписал пачку из очереди)
+        body, headers = signed(batch("agent-retry"))
+        headers["X-Batch-Id"] = "20241017-0001"
+        resigned = await client.post("/api/ingest", content=body, headers=headers)
+        headers["X-Batch-Id"] = "bad id"
+        invalid = await client.post("/api/ingest", content=body, headers=headers)
+    assert first.json() == {"stored": 1}
+    assert retry.status_code == 200
+    assert retry.json() == {"stored": 1, "duplicate": True}
+    assert resigned.json() == {"stored": 1, "duplicate": True}
+    assert invalid.status_code == 422
+    assert inserts == [1]
+    assert len(await fetch_events("agent-retry", 10)) == 1
+    assert backend_main.idempotency.snapshot()["duplicates"] == 2
+
+
+@pytest.mark.asyncio
+async def test_backlog_mixes_new_duplicate_and_invalid_batches():
+    await init_db()
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        body, headers = signed(batch("agent-backlog"))
+        headers["X-Batch-Id"] = "q-1"
+        assert (await client.post("/api/ingest", content=body, headers=headers)).status_code == 200
+        backlog = {
+            "batches": [
+                {"batch_id": "q-1", "batch": batch("agent-backlog")},
+                {"batch_id": "q-2", "batch": batch("agent-backlog", 0.5)},
+                {"batch_id": "q-2", "batch": batch("agent-backlog", 0.5)},
+                {"batch_id": "q-3", "batch": {"agent_id": "agent-backlog"}},
+                {"batch_id": "bad id", "batch": batch("agent-backlog")},
+                {"batch": batch("agent-backlog", 0.75)},
+            ]
+        }
+        body, headers = signed(backlog)
+        response = await client.post("/api/ingest/backlog", content=body, headers=headers)
+    assert response.status_code == 200
+    result = response.json()
+    assert [item["batch_id"] for item in result["results"]] == ["q-1", "q-2", "q-2", "q-3", "bad id", None]
+    assert result["results"][0] == {"batch_id": "q-1", "stored": 1, "duplicate": True}
+    assert result["results"][1] == {"batch_id": "q-2", "stored": 1}
+    assert result["results"][2] == {"batch_id": "q-2", "stored": 1, "duplicate": True}
+    assert "error" in result["results"][3]
+    assert result["results"][4]["error"] == "invalid batch_id"
+    assert result["results"][5] == {"batch_id": None, "stored": 1}
+    assert (result["events"], result["duplicates"], result["rejected"]) == (2, 2, 2)
+    assert len(await fetch_events("agent-backlog", 10)) == 3
+
+
+@pytest.mark.asyncio
+async def test_backlog_limits(monkeypatch):
+    await init_db()
+    monkeypatch.setattr(backend_main.idempotency.settings, "backlog_max_batches", 2)
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        body, headers = signed({"batches": [{"batch": batch("agent-limit")} for _ in range(3)]})
+        too_many = await client.post("/api/ingest/backlog", content=body, headers=headers)
+        body, headers = signed({"batches": "nope"})
+        malformed = await client.post("/api/ingest/backlog", content=body, headers=headers)
+        body, headers = signed({"batches": [{"batch": batch("agent-limit")}]})
+        headers["Content-Type"] = "application/msgpack"
+        unsupported = await client.post("/api/ingest/backlog", content=body, headers=headers)
+    assert too_many.status_code == 413
+    assert malformed.status_code == 422
+    assert unsupported.status_code == 415
+
+
+@pytest.mark.asyncio
+async def test_concurrent_claims_wait_for_first_write():
+    index = idempotencyindex()
+    key = ("agent", "batch-1")
+    assert await index.claim(key) is None
+    waiter = asyncio.create_task(index.claim(key))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    index.settle(key, {"stored": 3})
+    assert await waiter == {"stored": 3}
+    # неудачная запись освобождает ключ: следующий ретрай пишет сам
+    other = ("agent", "batch-2")
+    assert await index.claim(other) is None
+    waiter = asyncio.create_task(index.claim(other))
+    await asyncio.sleep(0)
+    index.settle(other, None)
+    assert await waiter is None
+    assert index.snapshot()["inflight"] == 1
+
+
+@pytest.mark.asyncio
+async def test_claim_wait_is_bounded():
+    settings = idempotencysettings()
+    settings.wait_ms = 20
+    index = idempotencyindex(settings)
+    key = ("agent", "batch-1")
+    assert await index.claim(key) is None
+    with pytest.raises(overloaded):
+        await index.claim(key)
+    assert index.snapshot()["timed_out"] == 1
+    # первая попытка не отменена ожиданием повтора и по-прежнему держит ключ
+    index.settle(key, {"stored": 3})
+    assert await index.claim(key) == {"stored": 3}
+
+
+@pytest.mark.asyncio
+async def test_retry_of_stuck_batch_gets_503(monkeypatch):
+    await init_db()
+    monkeypatch.setattr(backend_main.idempotency.settings, "wait_ms", 20)
+    key = ("agent-stuck", "20241017-0001")
+    # первая попытка держит ключ и не завершается
+    assert await backend_main.idempotency.claim(key) is None
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as client:
+            body, headers = signed(batch("agent-stuck"))
+            headers["X-Batch-Id"] = key[1]
+            retry = await client.post("/api/ingest", content=body, headers=headers)
+    finally:
+        backend_main.idempotency.settle(key, None)
+    assert retry.status_code == 503
+    assert retry.headers["Retry-After"] == "1"
+    assert await fetch_events("agent-stuck", 10) == []
+
+
+def test_index_is_bounded_and_expires(monkeypatch):
+    settings = idempotencysettings()
+    settings.max_entries = 2
+    settings.ttl = 60
+    index = idempotencyindex(settings)
+    clock = [1000.0]
+    monkeypatch.setattr("backend.idempotency.time.time", lambda: clock[0])
+    for position in range(3):
+        index.remember(("agent", str(position)), {"stored": position})
+    assert index.lookup(("agent", "0")) is None
+    assert index.lookup(("agent", "2")) == {"stored": 2}
+    assert index.evicted == 1
+    clock[0] += 61
+    assert index.lookup(("agent", "2")) is None
+
+
+@pytest.mark.asyncio
+async def test_queued_batch_is_settled_only_after_commit(monkeypatch):
+    await init_db()
+
+    async def broken_insert(rows):
+        raise RuntimeError("disk I/O error")
+
+    settings = writersettings()
+    settings.retry_ms = 1
+    settings.shutdown_attempts = 1
+    failing = groupcommitwriter(broken_insert, backend_main.publish, settings)
+    monkeypatch.setattr(backend_main, "writer", failing)
+    await failing.start()
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        body, headers = signed(batch("agent-queued"))
+        headers["X-Batch-Id"] = "b-queued"
+        assert (await client.post("/api/ingest", content=body, headers=headers)).json() == {"queued": 1}
+        # база отказала пачке: ключ освобожден, ретрай пишет пачку заново
+        await failing.stop()
+        working = groupcommitwriter(backend_main.insert_events, backend_main.publish, writersettings())
+        monkeypatch.setattr(backend_main, "writer", working)
+        await working.start()
+        body, headers = signed(batch("agent-queued"))
+        headers["X-Batch-Id"] = "b-queued"
+        assert (await client.post("/api/ingest", content=body, headers=headers)).json() == {"queued": 1}
+        # после коммита тот же id — дубликат
+        body, headers = signed(batch("agent-queued"))
+        headers["X-Batch-Id"] = "b-queued"
+        retry = await client.post("/api/ingest", content=body, headers=headers)
+        await working.stop()
+    assert retry.json() == {"queued": 1, "duplicate": True}
+    assert len(await fetch_events("agent-queued", 10)) == 1
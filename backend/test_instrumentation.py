@@ -0,0 +1,101 @@
+import json
+import time
+import pytest
+from httpx import AsyncClient
+from . import main as backend_main
+from .database import init_db
+from .instrumentation import ingest_stage_seconds, metrics, metricsregistry, metricssettings, null_timer, timed
+from .main import app
+from .security import signaturevalidator
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    monkeypatch.setenv("API_TOKEN", "token")
+    return db_path
+
+
+def make_registry(enabled: bool) -> metricsregistry:
+    settings = metricssettings()
+    settings.enabled = enabled
+    return metricsregistry(settings)
+
+
+@pytest.mark.asyncio
+async def test_histogram_renders_cumulative_buckets():
+    registry = make_registry(True)
+    latency = registry.histogram("demo_seconds", "demo", ("stage",))
+    for value in (0.0002, 0.003, 0.003, 7.0):
+        latency.observe(value, "decode")
+    registry.value("demo_total", "counter", "demo counter", lambda: 5)
+    text = await registry.render()
+    assert 'demo_seconds_bucket{stage="decode",le="0.00025"} 1' in text
+    assert 'demo_seconds_bucket{stage="decode",le="0.005"} 3' in text
+    assert 'demo_seconds_bucket{stage="decode",le="5.0"} 3' in text
+    assert 'demo_seconds_bucket{stage="decode",le="+Inf"} 4' in text
+    assert 'demo_seconds_count{stage="decode"} 4' in text
+    assert "# TYPE demo_total counter\ndemo_total 5\n" in text
+
+
+@pytest.mark.asyncio
+async def test_disabled_registry_records_nothing():
+    registry = make_registry(False)
+    latency = registry.histogram("demo_seconds", "demo")
+    assert latency.time() is null_timer
+    latency.observe(0.1)
+    assert latency.series == {}
+
+    async def query() -> int:
+        return 1
+
+    assert timed(latency)(query) is query
+
+
+@pytest.mark.asyncio
+async def test_timed_wraps_when_enabled():
+    registry = make_registry(True)
+    latency = registry.histogram("demo_seconds", "demo", ("function",))
+
+    @timed(latency)
+    async def fetch_something() -> int:
+        return 7
+
+    assert await fetch_something() == 7
+    assert latency.series[("fetch_something",)][2] == 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(monkeypatch):
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        assert (await client.get("/metrics")).status_code == 404
+        monkeypatch.setattr(metrics, "enabled", True)
+        monkeypatch.setattr(ingest_stage_seconds, "series", {})
+        await init_db()
+        secret = b"unit-secret"
+        monkeypatch.setattr(backend_main.validator.settings, "secret", secret)
+        body = json.dumps(
+            {"agent_id": "agent-m", "ts": "2025-11-12T12:00:00+00:00", "platform": "windows", "events": [{"type": "metric", "cpu": 0.1}]}
+        ).encode()
+        timestamp = str(int(time.time()))
+        validator = signaturevalidator()
+        validator.settings.secret = secret
+        response = await client.post(
+            "/api/ingest",
+            content=body,
+            headers={
+                "X-Api-Token": "token",
+                "X-Signature": validator.build_signature(timestamp, body).hex(),
+                "X-Signature-Ts": timestamp,
+            },
+        )
+        assert response.status_code == 200
+        response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for stage in ("signature", "decode", "write", "broadcast"):
+        assert f'telemetry_ingest_stage_seconds_count{{stage="{stage}"}} 1' in response.text
+    assert f"telemetry_replay_store_size {await backend_main.validator.replays.size()}" in response.text
+    assert "telemetry_agents 1" in response.text
+    assert "telemetry_ws_connections 0" in response.text
@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+from .database import init_db, insert_events, reader, schema_migrations, writer
+from .migrations import migration, migrationrunner, schema_version
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    return db_path
+
+
+async def table_names() -> set[str]:
+    async with reader() as conn:
+        rows = await conn.execute_fetchall("select name from sqlite_master where type in ('table', 'index')")
+    return {row[0] for row in rows}
+
+
+async def create_probe(conn):
+    await conn.execute("create table probe (id integer primary key)")
+
+
+@pytest.mark.asyncio
+async def test_init_db_applies_each_step_once():
+    await init_db()
+    async with reader() as conn:
+        assert await schema_version(conn) == schema_migrations[-1].version
+    calls = []
+
+    async def counted(conn):
+        calls.append(conn)
+
+    runner = migrationrunner([migration(item.version, item.name, counted) for item in schema_migrations])
+    await runner.upgrade(writer)
+    assert calls == [] and runner.ready
+
+
+@pytest.mark.asyncio
+async def test_failed_step_rolls_back_with_version():
+    async def broken(conn):
+        await conn.execute("create table fixed (id integer)")
+        raise ValueError("boom")
+
+    runner = migrationrunner([migration(1, "probe", create_probe), migration(2, "broken", broken)])
+    with pytest.raises(ValueError):
+        await runner.upgrade(writer)
+    assert runner.version == 1
+    async with reader() as conn:
+        assert await schema_version(conn) == 1
+    # таблица из первого шага осталась, второй шаг откатился целиком
+    assert "probe" in await table_names() and "fixed" not in await table_names()
+
+    async def fixed(conn):
+        await conn.execute("create table fixed (id integer)")
+
+    await migrationrunner([migration(1, "probe", create_probe), migration(2, "fixed", fixed)]).upgrade(writer)
+    assert {"probe", "fixed"} <= await table_names()
+
+
+@pytest.mark.asyncio
+async def test_background_index_is_built_after_start():
+    runner = migrationrunner(schema_migrations)
+    await runner.upgrade(writer, background=True)
+    assert runner.snapshot()["pending"] == ["events (agent, id) index", "events (type, ingested_at) index"]
+    assert "events_agent_id" not in await table_names()
+    # запись не ждет индекса
+    assert len(await insert_events([("agent-a", "2025-11-12T12:00:00Z", "linux", "metric", 0.1, 1, None, None, None)])) == 1
+    loaded = asyncio.Event()
+
+    async def on_ready():
+        loaded.set()
+
+    runner.start(writer, on_ready)
+    await asyncio.wait_for(runner.task, 5)
+    assert loaded.is_set() and runner.ready and runner.failed is None
+    assert "events_agent_id" in await table_names()
+    async with reader() as conn:
+        assert await schema_version(conn) == runner.latest
+
+
+@pytest.mark.asyncio
+async def test_stopped_background_step_is_retried():
+    started = asyncio.Event()
+
+    async def slow(conn):
+        await create_probe(conn)
+        started.set()
+        await asyncio.sleep(30)
+
+    runner = migrationrunner([migration(1, "slow", slow, background=True)])
+    await runner.upgrade(writer, background=True)
+    runner.start(writer)
+    await asyncio.wait_for(started.wait(), 5)
+    await runner.stop()
+    assert runner.version == 0 and runner.pending
+    assert "probe" not in await table_names()
+    await migrationrunner([migration(1, "probe", create_probe)]).upgrade(writer)
+    assert "probe" in await table_names()
+
+
+@pytest.mark.asyncio
+async def test_newer_database_is_refused():
+    await init_db()
+    with pytest.raises(RuntimeError):
+        await migrationrunner(schema_migrations[:1]).upgrade(writer)
@@ -0,0 +1,113 @@
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+from httpx import AsyncClient
+from .database import fetch_top_procs, init_db, insert_events, reader, remove_events
+from .main import app
+from .procstats import pick_resolution
+from .retention import retentionengine, retentionsettings
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    return db_path
+
+
+def proc_row(agent_id: str, minutes_ago: float, name: str, cpu: float, rss: int) -> tuple:
+    ts = (datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)).isoformat()
+    return (agent_id, ts, "windows", "proc", cpu, None, 100, name, rss)
+
+
+def test_pick_resolution():
+    assert pick_resolution(3600) == 300
+    assert pick_resolution(6 * 3600) == 300
+    assert pick_resolution(24 * 3600) == 3600
+    assert pick_resolution(30 * 86400) == 3600
+
+
+@pytest.mark.asyncio
+async def test_top_procs_ranks_by_cpu_and_rss():
+    await init_db()
+    await insert_events(
+        [
+            proc_row("agent-p", 1, "chrome.exe", 0.5, 900),
+            proc_row("agent-p", 2, "chrome.exe", 0.3, 1100),
+            proc_row("agent-p", 1, "code.exe", 0.7, 300),
+            proc_row("agent-p", 1, "idle", None, 10),
+            proc_row("agent-p", 600, "old.exe", 9.0, 10**9),
+            proc_row("agent-q", 1, "other.exe", 5.0, 10**9),
+            ("agent-p", datetime.now(timezone.utc).isoformat(), "windows", "metric", 9.0, 1, None, None, None),
+        ]
+    )
+    await insert_events([proc_row("agent-p", 0, "chrome.exe", 0.4, 1000)])
+    by_cpu = await fetch_top_procs("agent-p", time.time() - 3600, 3600, "cpu", 10)
+    assert [proc["proc_name"] for proc in by_cpu["procs"]] == ["code.exe", "chrome.exe", "idle"]
+    chrome = by_cpu["procs"][1]
+    assert chrome["samples"] == 3
+    assert chrome["cpu"]["avg"] == pytest.approx(0.4)
+    assert chrome["cpu"]["max"] == pytest.approx(0.5)
+    assert chrome["rss"] == {"avg": 1000.0, "max": 1100}
+
+    by_rss = await fetch_top_procs("agent-p", time.time() - 3600, 3600, "rss", 1)
+    assert [proc["proc_name"] for proc in by_rss["procs"]] == ["chrome.exe"]
+
+    await remove_events("agent-p")
+    assert (await fetch_top_procs("agent-p", time.time() - 3600, 3600, "cpu", 10))["procs"] == []
+
+
+@pytest.mark.asyncio
+async def test_non_finite_cpu_does_not_break_insert():
+    await init_db()
+    rows = [proc_row("agent-n", 1, "a.exe", float("nan"), 10), proc_row("agent-n", 1, "a.exe", float("inf"), 10), proc_row("agent-n", 1, "a.exe", 0.5, 10)]
+    assert len(await insert_events(rows)) == 3
+    top = await fetch_top_procs("agent-n", time.time() - 3600, 3600, "cpu", 10)
+    assert top["procs"][0]["samples"] == 3
+    assert top["procs"][0]["cpu"] == {"avg": 0.5, "max": 0.5}
+
+
+@pytest.mark.asyncio
+async def test_top_query_reads_rollup_index_only():
+    await init_db()
+    async with reader() as conn:
+        plan = await conn.execute_fetchall(
+            "explain query plan select proc_name, sum(cpu_sum) from proc_rollup_5m "
+            "where agent_id = ? and bucket >= ? group by proc_name",
+            ("agent-p", 0),
+        )
+    details = " ".join(row[3] for row in plan)
+    assert "proc_rollup_5m" in details
+    assert "events" not in details
+
+
+@pytest.mark.asyncio
+async def test_retention_prunes_old_proc_buckets():
+    await init_db()
+    await insert_events([proc_row("agent-p", 3 * 24 * 60, "old.exe", 1.0, 1), proc_row("agent-p", 1, "new.exe", 1.0, 1)])
+    settings = retentionsettings()
+    settings.max_age = {}
+    settings.max_rows_per_agent = 0
+    settings.proc_rollups = {300: 2 * 86400, 3600: 0}
+    engine = retentionengine(settings)
+    await engine.run_once()
+    assert engine.proc_buckets_pruned == 1
+    async with reader() as conn:
+        names = [row[0] for row in await conn.execute_fetchall("select proc_name from proc_rollup_5m")]
+        hourly = await conn.execute_fetchall("select count(*) from proc_rollup_1h")
+    assert names == ["new.exe"]
+    assert hourly[0][0] == 2
+
+
+@pytest.mark.asyncio
+async def test_top_procs_endpoint_validates_window():
+    await init_db()
+    await insert_events([proc_row("agent-p", 1, "a.exe", 1.0, 1)])
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/api/procs/top", params={"agent_id": "agent-p", "window": "30m", "by": "rss"})
+        assert response.status_code == 200
+        assert response.json()["procs"][0]["proc_name"] == "a.exe"
+        assert (await client.get("/api/procs/top", params={"agent_id": "agent-p", "window": "10s"})).status_code == 422
+        assert (await client.get("/api/procs/top", params={"agent_id": "agent-p", "window": "abc"})).status_code == 422
+        assert (await client.get("/api/procs/top", params={"agent_id": "agent-p", "window": "infh"})).status_code == 422
+        assert (await client.get("/api/procs/top", params={"agent_id": "agent-p", "by": "pid"})).status_code == 422
@@ -0,0 +1,101 @@
+import pytest
+from . import database
+from .database import epoch_ms, fetch_events, init_db, insert_events, reader, writer
+from .retention import parse_duration, parse_max_age, retentionengine, retentionsettings
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    return db_path
+
+
+def make_rows(agent_id: str, event_type: str, count: int) -> list[tuple]:
+    return [
+        (agent_id, "2025-11-12T12:00:00+00:00", "windows", event_type, 0.1, 1, None, None, None)
+        for _ in range(count)
+    ]
+
+
+async def age_rows(agent_id: str, ingested_at: str) -> None:
+    async with writer() as conn:
+        await conn.execute(
+            "update events set ingested_at = ? where agent = (select id from agents where name = ?)",
+            (epoch_ms(ingested_at), agent_id),
+        )
+        await conn.commit()
+
+
+def make_settings(max_age: str = "", max_rows: int = 0) -> retentionsettings:
+    settings = retentionsettings()
+    settings.max_age = parse_max_age(max_age)
+    settings.max_rows_per_agent = max_rows
+    settings.chunk_rows = 7
+    settings.pause_ms = 0
+    settings.compact_every = 2
+    return settings
+
+
+def test_parse_max_age():
+    assert parse_max_age("metric=7d, proc=90m,*=3600") == {"metric": 604800, "proc": 5400, "*": 3600}
+    with pytest.raises(ValueError):
+        parse_max_age("metric")
+    for value in ("infh", "-infd", "nanm", "1e400s"):
+        with pytest.raises(ValueError):
+            parse_duration(value)
+
+
+@pytest.mark.asyncio
+async def test_prunes_by_age_per_event_type():
+    await init_db()
+    await insert_events(make_rows("old", "metric", 20) + make_rows("old", "proc", 20) + make_rows("old", "other", 5))
+    await age_rows("old", "2000-01-01 00:00:00")
+    await insert_events(make_rows("fresh", "metric", 5))
+
+    engine = retentionengine(make_settings(max_age="proc=1d,*=30d"))
+    pruned = await engine.run_once()
+    assert pruned == 45
+    snapshot = engine.snapshot()
+    assert snapshot["rows_pruned_by_age"] == 45
+    assert snapshot["passes"] == 1
+    assert await fetch_events("old", 100) == []
+    assert len(await fetch_events("fresh", 100)) == 5
+
+
+@pytest.mark.asyncio
+async def test_age_delete_uses_index_not_table_scan(monkeypatch):
+    await init_db()
+    await insert_events(make_rows("old", "metric", 3) + make_rows("old", "proc", 3))
+    calls = []
+    original = database.delete_chunk
+
+    async def recording(where, params, limit):
+        calls.append((where, list(params)))
+        return await original(where, params, limit)
+
+    monkeypatch.setattr(database, "delete_chunk", recording)
+    await retentionengine(make_settings(max_age="proc=1d,*=30d")).run_once()
+    assert len(calls) == 2
+    async with reader() as conn:
+        for where, params in calls:
+            plan = await conn.execute_fetchall(f"explain query plan select id from events where {where} limit ?", (*params, 7))
+            details = " ".join(row[3] for row in plan)
+            assert "events_type_ingested" in details and "SCAN events" not in details
+
+
+@pytest.mark.asyncio
+async def test_prunes_oldest_rows_over_agent_limit():
+    await init_db()
+    inserted = await insert_events(make_rows("busy", "metric", 30))
+    await insert_events(make_rows("quiet", "metric", 3))
+
+    engine = retentionengine(make_settings(max_rows=10))
+    assert await engine.run_once() == 20
+    remaining = [record["id"] for record in await fetch_events("busy", 100)]
+    assert remaining == [record["id"] for record in reversed(inserted[-10:])]
+    assert len(await fetch_events("quiet", 100)) == 3
+
+    async with reader() as conn:
+        mode = await conn.execute_fetchall("pragma auto_vacuum")
+    assert mode[0][0] == 2
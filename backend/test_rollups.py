@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from .database import fetch_metric_series, init_db, insert_events, reader, remove_events
+from .rollups import pick_resolution
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    return db_path
+
+
+base = datetime(2025, 11, 12, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def metric_row(agent_id: str, offset_seconds: int, cpu: float, mem_free: int) -> tuple:
+    ts = (base + timedelta(seconds=offset_seconds)).isoformat()
+    return (agent_id, ts, "windows", "metric", cpu, mem_free, None, None, None)
+
+
+@pytest.mark.asyncio
+async def test_non_finite_cpu_does_not_break_insert():
+    await init_db()
+    inserted = await insert_events(
+        [metric_row("agent-n", 0, float("nan"), 100), metric_row("agent-n", 1, float("inf"), 100), metric_row("agent-n", 2, 0.5, 100)]
+    )
+    assert len(inserted) == 3
+    async with reader() as conn:
+        rows = await conn.execute_fetchall("select samples, cpu_sum, cpu_count from metric_rollup_1m")
+    assert [tuple(row) for row in rows] == [(3, 0.5, 1)]
+
+
+def test_pick_resolution():
+    hour = 3600
+    assert pick_resolution(0, hour, None) == 60
+    assert pick_resolution(0, 5 * 24 * hour, None) == 600
+    assert pick_resolution(0, 30 * 24 * hour, None) == 3600
+    assert pick_resolution(0, hour, 900) == 600
+    assert pick_resolution(0, hour, 10) == 60
+
+
+@pytest.mark.asyncio
+async def test_rollups_are_maintained_incrementally():
+    await init_db()
+    await insert_events([metric_row("agent-r", 0, 0.2, 100), metric_row("agent-r", 5, 0.6, 300)])
+    await insert_events(
+        [
+            metric_row("agent-r", 30, 0.4, 200),
+            ("agent-r", base.isoformat(), "windows", "proc", 0.9, None, 10, "x", 1),
+        ]
+    )
+    await insert_events([metric_row("agent-r", 65, 0.1, 50)])
+
+    async with reader() as conn:
+        rows = await conn.execute_fetchall(
+            "select bucket, samples, cpu_min, cpu_max, cpu_sum, cpu_last, mem_free_last from metric_rollup_1m order by bucket"
+        )
+    first, second = [tuple(row) for row in rows]
+    assert first[1:4] == (3, 0.2, 0.6)
+    assert first[4] == pytest.approx(1.2)
+    assert first[5:] == (0.4, 200)
+    assert second[1:] == (1, 0.1, 0.1, 0.1, 0.1, 50)
+
+    series = await fetch_metric_series(
+        "agent-r", base.timestamp(), (base + timedelta(minutes=10)).timestamp(), None
+    )
+    assert series["resolution"] == 60
+    assert [point["count"] for point in series["points"]] == [3, 1]
+    assert series["points"][0]["cpu"]["avg"] == pytest.approx(0.4)
+
+    coarse = await fetch_metric_series(
+        "agent-r", base.timestamp(), (base + timedelta(minutes=10)).timestamp(), 120
+    )
+    assert coarse["step"] == 120
+    assert len(coarse["points"]) == 1
+    assert coarse["points"][0]["cpu"]["max"] == 0.6
+    assert coarse["points"][0]["cpu"]["last"] == 0.1
+    assert coarse["points"][0]["mem_free"]["min"] == 50
+
+    await remove_events("agent-r")
+    empty = await fetch_metric_series("agent-r", base.timestamp(), (base + timedelta(hours=1)).timestamp(), None)
+    assert empty["points"] == []
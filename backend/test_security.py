@@ -0,0 +1,110 @@
+import time
+from collections import deque
+import pytest
+from .security import replaystore, replaystorefull, signaturevalidator, sqlitereplaystore
+
+
+@pytest.mark.asyncio
+async def test_replay_is_rejected_and_expires(monkeypatch):
+    store = replaystore(retention=10)
+    now = 1_000_000.0
+    monkeypatch.setattr(time, "time", lambda: now)
+    assert await store.record(int(now), b"sig-a")
+    assert not await store.record(int(now), b"sig-a")
+    assert await store.record(int(now), b"sig-b")
+    now += 11
+    assert await store.record(int(now), b"sig-a")
+    assert len(store) == 1
+
+
+@pytest.mark.asyncio
+async def test_full_store_rejects_new_signatures():
+    store = replaystore(retention=60, max_entries=2)
+    assert await store.record(0, b"a")
+    assert await store.record(0, b"b")
+    with pytest.raises(replaystorefull):
+        await store.record(0, b"c")
+    assert not await store.record(0, b"a")
+
+
+@pytest.mark.asyncio
+async def test_validator_rejects_replayed_signature():
+    validator = signaturevalidator()
+    timestamp = str(int(time.time()))
+    signature = validator.build_signature(timestamp, b"{}").hex()
+    await validator.validate(timestamp, signature, b"{}")
+    with pytest.raises(ValueError, match="replayed"):
+        await validator.validate(timestamp, signature, b"{}")
+
+
+class countingdeque(deque):
+    def __init__(self) -> None:
+        super().__init__()
+        self.reads = 0
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return super().__getitem__(index)
+
+
+# запись смотрит только на голову очереди: число чтений зависит от числа истекших записей, а не от размера окна
+@pytest.mark.asyncio
+async def test_record_touches_only_expired_entries(monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(time, "time", lambda: now)
+    for live in (1_000, 100_000):
+        store = replaystore(retention=3600)
+        store.entries = countingdeque()
+        for index in range(10):
+            await store.record(int(now), b"old-%d" % index)
+        now += 1800
+        for index in range(live):
+            await store.record(int(now), b"live-%d" % index)
+        now += 1801
+        store.entries.reads = 0
+        assert await store.record(int(now), b"new")
+        assert store.entries.reads == 11
+        assert len(store) == live + 1
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_is_shared_between_processes(tmp_path, monkeypatch):
+    path = tmp_path / "replays.db"
+    worker_a = sqlitereplaystore(path, retention=10)
+    worker_b = sqlitereplaystore(path, retention=10)
+    now = 1_000_000.0
+    monkeypatch.setattr(time, "time", lambda: now)
+    try:
+        assert await worker_a.record(int(now), b"sig-a")
+        assert not await worker_b.record(int(now), b"sig-a")
+        assert await worker_b.record(int(now), b"sig-b")
+        assert await worker_a.size() == 2
+        now += 11
+        assert await worker_b.record(int(now), b"sig-a")
+        assert await worker_a.size() == 1
+    finally:
+        await worker_a.close()
+        await worker_b.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_cap(tmp_path):
+    store = sqlitereplaystore(tmp_path / "replays.db", retention=60, max_entries=2, cleanup_every=0)
+    try:
+        assert await store.record(0, b"a")
+        assert await store.record(0, b"b")
+        with pytest.raises(replaystorefull):
+            await store.record(0, b"c")
+    finally:
+        await store.close()
+
+
+def test_backend_selection(tmp_path, monkeypatch):
+    monkeypatch.setenv("HMAC_REPLAY_BACKEND", "sqlite")
+    monkeypatch.setenv("HMAC_REPLAY_DB", str(tmp_path / "shared.db"))
+    store = signaturevalidator().replays
+    assert isinstance(store, sqlitereplaystore)
+    assert store.path == tmp_path / "shared.db"
+    monkeypatch.setenv("HMAC_REPLAY_BACKEND", "redis")
+    with pytest.raises(ValueError):
+        signaturevalidator()
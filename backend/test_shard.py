@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import stat
+import time
+from datetime import datetime, timezone
+import pytest
+from httpx import AsyncClient
+from . import main as backend_main
+from . import shard
+from .database import fetch_events, init_db
+from .ipc import header, ingestclient, ingestserver, ipcsettings, parse_address, writerunavailable
+
+
+@pytest.fixture(autouse=True)
+def override_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "telemetry.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    monkeypatch.setenv("API_TOKEN", "token")
+    return db_path
+
+
+@pytest.fixture
+def address(tmp_path, monkeypatch):
+    settings = ipcsettings()
+    settings.address = str(tmp_path / "ingest.sock")
+    settings.timeout = 2.0
+    monkeypatch.setattr(shard, "client", ingestclient(settings))
+    monkeypatch.setattr(shard.validator.settings, "secret", backend_main.validator.settings.secret)
+    return settings
+
+
+def signed(agent_id: str) -> tuple[bytes, dict]:
+    payload = {
+        "agent_id": agent_id,
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "platform": "windows",
+        "events": [
+            {"type": "metric", "cpu": 0.25, "mem_free": 1024},
+            {"type": "proc", "pid": 10, "name": "demo", "cpu": 0.1, "rss": 64},
+        ],
+    }
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    timestamp = str(int(time.time()))
+    signature = backend_main.validator.build_signature(timestamp, body).hex()
+    return body, {
+        "X-Api-Token": "token",
+        "Content-Type": "application/json",
+        "X-Signature": signature,
+        "X-Signature-Ts": timestamp,
+    }
+
+
+@pytest.mark.asyncio
+async def test_worker_forwards_rows_to_writer(address):
+    await init_db()
+    server = ingestserver(backend_main.ipc_ingest, address)
+    await server.start()
+    try:
+        async with AsyncClient(app=shard.app, base_url="http://test") as client:
+            body, headers = signed("agent-shard")
+            response = await client.post("/api/ingest", content=body, headers=headers)
+            assert response.status_code == 200
+            assert response.json() == {"stored": 2}
+            # повтор ловит писатель, даже если запрос пришел на другой воркер
+            response = await client.post("/api/ingest", content=body, headers=headers)
+            assert response.status_code == 401
+            assert response.json()["detail"] == "replayed signature"
+            headers["X-Signature"] = "00" * 32
+            response = await client.post("/api/ingest", content=body, headers=headers)
+            assert response.status_code == 401
+    finally:
+        await shard.client.close()
+        await server.stop()
+    records = await fetch_events("agent-shard", 10)
+    assert sorted(record["event_type"] for record in records) == ["metric", "proc"]
+    assert [item["agent_id"] for item in backend_main.agent_index.snapshot()] == ["agent-shard"]
+    assert server.batches == 2
+
+
+@pytest.mark.asyncio
+async def test_worker_retries_are_deduplicated_by_writer(address):
+    await init_db()
+    server = ingestserver(backend_main.ipc_ingest, address)
+    await server.start()
+    try:
+        async with AsyncClient(app=shard.app, base_url="http://test") as client:
+            body, headers = signed("agent-retry")
+            headers["X-Batch-Id"] = "b-1"
+            first = await client.post("/api/ingest", content=body, headers=headers)
+            retry = await client.post("/api/ingest", content=body, headers=headers)
+            backlog = json.dumps({"batches": [{"batch_id": "b-1", "batch": json.loads(body)}]}).encode()
+            timestamp = str(int(time.time()))
+            headers = {
+                "X-Api-Token": "token",
+                "Content-Type": "application/json",
+                "X-Signature": backend_main.validator.build_signature(timestamp, backlog).hex(),
+                "X-Signature-Ts": timestamp,
+            }
+            flushed = await client.post("/api/ingest/backlog", content=backlog, headers=headers)
+    finally:
+        await shard.client.close()
+        await server.stop()
+    assert first.json() == {"stored": 2}
+    assert retry.json() == {"stored": 2, "duplicate": True}
+    assert flushed.json()["duplicates"] == 1
+    assert len(await fetch_events("agent-retry", 10)) == 2
+
+
+@pytest.mark.asyncio
+async def test_worker_returns_503_without_writer(address):
+    async with AsyncClient(app=shard.app, base_url="http://test") as client:
+        body, headers = signed("agent-down")
+        response = await client.post("/api/ingest", content=body, headers=headers)
+    await shard.client.close()
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_writer_drops_unauthenticated_frames(address):
+    await init_db()
+    server = ingestserver(backend_main.ipc_ingest, address)
+    await server.start()
+    assert stat.S_IMODE(os.stat(address.address).st_mode) == 0o600
+    forged = ipcsettings()
+    forged.address = address.address
+    forged.key = b"\0" * 32
+    intruder = ingestclient(forged)
+    row = ["agent-forged", "2025-11-12T12:00:00+00:00", "windows", "metric", 0.5, 1, None, None, None]
+    try:
+        with pytest.raises(writerunavailable):
+            await intruder.send([(None, [row])], int(time.time()), b"\1" * 32)
+        # обрыв посреди кадра не роняет сервер
+        reader, writer = await asyncio.open_unix_connection(address.address)
+        writer.write(header.pack(100) + b"\0" * 10)
+        await writer.drain()
+        writer.close()
+        await asyncio.sleep(0.05)
+        assert server.workers == 0
+    finally:
+        await intruder.close()
+        await server.stop()
+    assert server.batches == 0
+    assert await fetch_events("agent-forged", 10) == []
+
+
+def test_tcp_address_must_be_loopback():
+    assert parse_address("tcp://127.0.0.1:9009") == (None, ("127.0.0.1", 9009))
+    assert parse_address("tcp://[::1]:9009") == (None, ("::1", 9009))
+    assert parse_address("tcp://localhost:9009") == (None, ("localhost", 9009))
+    for address in ("tcp://0.0.0.0:9009", "tcp://10.0.0.5:9009", "tcp://example.com:9009"):
+        with pytest.raises(ValueError, match="loopback"):
+            parse_address(address)
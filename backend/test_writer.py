@@ -0,0 +1,145 @@
+import asyncio
+import sqlite3
+import pytest
+from .writer import groupcommitwriter, queuefull, writersettings
+
+
+def make_settings(queue_size: int = 100, commit_rows: int = 500, commit_ms: int = 50) -> writersettings:
+    settings = writersettings()
+    settings.queue_size = queue_size
+    settings.commit_rows = commit_rows
+    settings.commit_ms = commit_ms
+    return settings
+
+
+class recordingsink:
+    def __init__(self) -> None:
+        self.calls: list[list[tuple]] = []
+        self.published: list[dict] = []
+
+    async def insert(self, rows: list[tuple]) -> list[dict]:
+        self.calls.append(list(rows))
+        return [{"id": index, "row": row} for index, row in enumerate(rows)]
+
+    async def publish(self, inserted: list[dict]) -> None:
+        self.published.extend(inserted)
+
+
+@pytest.mark.asyncio
+async def test_batches_are_grouped_into_one_commit():
+    sink = recordingsink()
+    writer = groupcommitwriter(sink.insert, sink.publish, make_settings(commit_ms=200))
+    await writer.start()
+    committed = [writer.submit([("agent", index)]) for index in range(10)]
+    assert not any(future.done() for future in committed)
+    await writer.stop()
+    assert [future.result() for future in committed] == [1] * 10
+    assert len(sink.calls) == 1
+    assert len(sink.calls[0]) == 10
+    assert len(sink.published) == 10
+
+
+@pytest.mark.asyncio
+async def test_commit_rows_caps_group_size():
+    sink = recordingsink()
+    writer = groupcommitwriter(sink.insert, sink.publish, make_settings(commit_rows=4, commit_ms=1000))
+    await writer.start()
+    for index in range(8):
+        writer.submit([("agent", index)])
+    await asyncio.sleep(0.05)
+    await writer.stop()
+    assert [len(call) for call in sink.calls] == [4, 4]
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_and_shutdown_drains():
+    sink = recordingsink()
+    writer = groupcommitwriter(sink.insert, sink.publish, make_settings(queue_size=2))
+    await writer.start()
+    writer.submit([("agent", 1)])
+    writer.submit([("agent", 2)])
+    with pytest.raises(queuefull):
+        writer.submit([("agent", 3)])
+    assert writer.snapshot()["rejected"] == 1
+    await writer.stop()
+    stored = [row for call in sink.calls for row in call]
+    assert stored == [("agent", 1), ("agent", 2)]
+
+
+class flakysink(recordingsink):
+    def __init__(self, failures: int) -> None:
+        super().__init__()
+        self.failures = failures
+        self.attempts = 0
+
+    async def insert(self, rows: list[tuple]) -> list[dict]:
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("disk I/O error")
+        return await super().insert(rows)
+
+
+@pytest.mark.asyncio
+async def test_failed_commit_is_retried_and_ingest_is_refused_meanwhile():
+    sink = flakysink(failures=3)
+    settings = make_settings(commit_ms=1)
+    settings.retry_ms = 20
+    writer = groupcommitwriter(sink.insert, sink.publish, settings)
+    await writer.start()
+    writer.submit([("agent", 1)])
+    await asyncio.sleep(0.01)
+    assert writer.snapshot()["failing"]
+    with pytest.raises(queuefull):
+        writer.submit([("agent", 2)])
+    for _ in range(100):
+        if not writer.failing:
+            break
+        await asyncio.sleep(0.02)
+    writer.submit([("agent", 3)])
+    await writer.stop()
+    assert [row for call in sink.calls for row in call] == [("agent", 1), ("agent", 3)]
+    assert writer.snapshot()["failed_flushes"] == 3 and writer.failed_rows == 0
+
+
+@pytest.mark.asyncio
+async def test_shutdown_gives_up_after_attempts():
+    sink = flakysink(failures=100)
+    settings = make_settings(commit_ms=1000)
+    settings.retry_ms = 1
+    settings.shutdown_attempts = 2
+    writer = groupcommitwriter(sink.insert, sink.publish, settings)
+    await writer.start()
+    committed = writer.submit([("agent", 1)])
+    await writer.stop()
+    assert sink.attempts == 2 and writer.failed_rows == 1
+    with pytest.raises(RuntimeError):
+        committed.result()
+
+
+class pickysink(recordingsink):
+    async def insert(self, rows: list[tuple]) -> list[dict]:
+        if ("agent", "bad") in rows:
+            raise sqlite3.IntegrityError("NOT NULL constraint failed: rollups.cpu_sum")
+        return await super().insert(rows)
+
+
+@pytest.mark.asyncio
+async def test_rejected_batch_does_not_block_the_group():
+    sink = pickysink()
+    writer = groupcommitwriter(sink.insert, sink.publish, make_settings(commit_ms=200))
+    await writer.start()
+    good = writer.submit([("agent", 1)])
+    bad = writer.submit([("agent", "bad"), ("agent", 2)])
+    later = writer.submit([("agent", 3)])
+    await writer.stop()
+    assert good.result() == 1 and later.result() == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        bad.result()
+    assert [row for call in sink.calls for row in call] == [("agent", 1), ("agent", 3)]
+    snapshot = writer.snapshot()
+    assert not snapshot["failing"] and snapshot["rejected_batches"] == 1 and snapshot["failed_rows"] == 2
+    # после отказа очередь принимает новые пачки
+    await writer.start()
+    assert writer.submit([("agent", 4)]) is not None
+    await writer.stop()
@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Awaitable, Callable, Optional
+from .stats import ratemeter
+
+logger = logging.getLogger(__name__)
+
+rowsink = Callable[[list[tuple[Any, ...]]], Awaitable[list[dict[str, Any]]]]
+commithook = Callable[[list[dict[str, Any]]], Awaitable[None]]
+# пачка в очереди и future, который завершится после ее коммита; пустая пачка — сигнал остановки
+queueditem = tuple[list[tuple[Any, ...]], Optional[asyncio.Future]]
+
+
+# настройки group commit
+class writersettings:
+    def __init__(self) -> None:
+        self.enabled = os.getenv("INGEST_GROUP_COMMIT", "0").lower() in ("1", "true", "yes")
+        self.queue_size = max(1, int(os.getenv("INGEST_QUEUE_SIZE", "1000")))
+        self.commit_rows = max(1, int(os.getenv("INGEST_COMMIT_ROWS", "500")))
+        self.commit_ms = max(1, int(os.getenv("INGEST_COMMIT_MS", "50")))
+        self.retry_after = max(1, int(os.getenv("INGEST_RETRY_AFTER", "1")))
+        # повтор упавшего коммита: пауза растет от retry_ms до retry_max_ms
+        self.retry_ms = max(1, int(os.getenv("INGEST_FLUSH_RETRY_MS", "100")))
+        self.retry_max_ms = max(self.retry_ms, int(os.getenv("INGEST_FLUSH_RETRY_MAX_MS", "5000")))
+        # попыток на остановке, после них строки теряются (с записью в лог)
+        self.shutdown_attempts = max(1, int(os.getenv("INGEST_FLUSH_SHUTDOWN_ATTEMPTS", "5")))
+
+
+# временные ошибки базы (блокировка, i/o, место) проходят сами, их имеет смысл повторять;
+# остальные (constraint, неверные данные) повторятся так же и будут держать очередь вечно
+transient_errors = ("locked", "busy", "disk i/o", "database or disk is full", "unable to open")
+
+
+def is_transient(exc: BaseException) -> bool:
+    return isinstance(exc, sqlite3.OperationalError) and any(word in str(exc).lower() for word in transient_errors)
+
+
+class queuefull(Exception):
+    def __init__(self, reason: str = "ingest queue full") -> None:
+        super().__init__(reason)
+
+# очередь пачек и один фоновый писатель, коммит каждые N строк или M мс
+class groupcommitwriter:
+    def __init__(
+        self,
+        sink: rowsink,
+        on_commit: commithook,
+        settings: writersettings | None = None,
+    ) -> None:
+        self.settings = settings or writersettings()
+        self.sink = sink
+        self.on_commit = on_commit
+        self.queue: Optional[asyncio.Queue[queueditem]] = None
+        self.task: Optional[asyncio.Task] = None
+        self.committed = ratemeter()
+        self.commits = 0
+        self.rejected = 0
+        self.failed_rows = 0
+        self.failed_flushes = 0
+        self.rejected_batches = 0
+        self.failing = False
+        self.stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.settings.queue_size)
+        self.stopping = False
+        self.failing = False
+        self.task = asyncio.create_task(self.run())
+
+    # future получает число строк после коммита или исключение, если строки потеряны на остановке
+    def submit(self, rows: list[tuple[Any, ...]]) -> asyncio.Future:
+        if self.queue is None or not self.running:
+            raise RuntimeError("writer is not running")
+        committed = asyncio.get_running_loop().create_future()
+        if not rows:
+            committed.set_result(0)
+            return committed
+        # строки уже подтверждены клиентам и ждут повтора коммита: новые не берем, агент повторит по 503
+        if self.failing:
+            self.rejected += 1
+            raise queuefull("ingest writer is failing to commit")
+        try:
+            self.queue.put_nowait((rows, committed))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise queuefull()
+        return committed
+
+    async def stop(self) -> None:
+        if self.queue is None or self.task is None:
+            return
+        self.stopping = True
+        await self.queue.put(([], None))
+        await self.task
+        self.task = None
+        self.queue = None
+
+    async def run(self) -> None:
+        assert self.queue is not None
+        stopping = False
+        while not stopping:
+            first = await self.queue.get()
+            if not first[0]:
+                break
+            pending = [first]
+            count = len(first[0])
+            deadline = time.monotonic() + self.settings.commit_ms / 1000
+            while count < self.settings.commit_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not item[0]:
+                    stopping = True
+                    break
+                pending.append(item)
+                count += len(item[0])
+            await self.flush(pending)
+        # при остановке дописываем всё, что успело попасть в очередь
+        leftover: list[queueditem] = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item[0]:
+                leftover.append(item)
+        if leftover:
+            await self.flush(leftover)
+
+    # подтвержденные строки не выбрасываются: при временной ошибке коммит повторяется, пока sink не заработает
+    # (на остановке — не больше shutdown_attempts раз). постоянная ошибка делит группу по пачкам:
+    # остальные коммитятся, а future пачки, которую база не принимает, получает исключение
+    async def flush(self, items: list[queueditem]) -> None:
+        rows = [row for batch, _ in items for row in batch]
+        attempt = 0
+        while True:
+            try:
+                inserted = await self.sink(rows)
+                break
+            except Exception as exc:
+                if not is_transient(exc):
+                    await self.reject(items, exc)
+                    return
+                attempt += 1
+                self.failed_flushes += 1
+                self.failing = True
+                if self.stopping and attempt >= self.settings.shutdown_attempts:
+                    self.failed_rows += len(rows)
+                    logger.exception("group commit of %d rows failed on shutdown, rows are lost", len(rows))
+                    for _, committed in items:
+                        if committed is not None and not committed.done():
+                            committed.set_exception(RuntimeError("group commit failed"))
+                    return
+                delay = min(self.settings.retry_ms * 2 ** (attempt - 1), self.settings.retry_max_ms)
+                logger.exception("group commit of %d rows failed, retry %d in %d ms", len(rows), attempt, delay)
+                await asyncio.sleep(delay / 1000)
+        self.failing = False
+        for batch, committed in items:
+            if committed is not None and not committed.done():
+                committed.set_result(len(batch))
+        self.commits += 1
+        self.committed.add(len(inserted))
+        try:
+            await self.on_commit(inserted)
+        except Exception:
+            logger.exception("post-commit hook failed")
+
+    async def reject(self, items: list[queueditem], exc: Exception) -> None:
+        # база ответила по существу, значит она доступна
+        self.failing = False
+        if len(items) > 1:
+            for item in items:
+                await self.flush([item])
+            return
+        batch, committed = items[0]
+        self.failed_rows += len(batch)
+        self.rejected_batches += 1
+        logger.error("group commit rejected a batch of %d rows: %s", len(batch), exc)
+        if committed is not None and not committed.done():
+            committed.set_exception(exc)
+
+    def snapshot(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "queue_size": self.settings.queue_size,
+            "commits": self.commits,
+            "committed_events_per_second": round(self.committed.rate(), 2),
+            "rejected": self.rejected,
+            "failing": self.failing,
+            "failed_flushes": self.failed_flushes,
+            "failed_rows": self.failed_rows,
+            "rejected_batches": self.rejected_batches,
+        }
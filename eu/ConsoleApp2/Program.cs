@@ -173,6 +173,7 @@ namespace telemetryclient
     {
         private readonly HttpClient client;
         private readonly Uri ingest_uri;
+        private readonly Uri backlog_uri;
         private readonly string token;
         private readonly byte[] secret_key;
         private readonly diskqueue queue;
@@ -180,19 +181,33 @@ namespace telemetryclient
         {
             client = new HttpClient();
             ingest_uri = new Uri(new Uri(base_url), "/api/ingest");
+            backlog_uri = new Uri(new Uri(base_url), "/api/ingest/backlog");
             this.token = token;
             secret_key = Encoding.UTF8.GetBytes(secret);
             queue = new diskqueue(queue_path);
         }
-        // оффлайн флуш
+        // оффлайн флуш: очередь уходит пачками через /api/ingest/backlog одним подписанным запросом,
+        // уже записанные сервером пачки (по batch_id) подтверждаются без повторной записи
         internal async Task flush_offline()
         {
-            foreach (var entry in queue.pending())
+            while (true)
             {
-                var json = queue.read(entry);
-                await post(json);
-                queue.remove(entry);
-                Console.WriteLine($"{DateTime.UtcNow:o} flushed stored batch {Path.GetFileName(entry)}");
+                var entries = queue.pending().Take(diskqueue.backlog_size).ToList();
+                if (entries.Count == 0) { return; }
+                var builder = new StringBuilder("{\"batches\":[");
+                for (var index = 0; index < entries.Count; index++)
+                {
+                    if (index > 0) { builder.Append(','); }
+                    builder.Append("{\"batch_id\":").Append(JsonConvert.ToString(diskqueue.batch_id(entries[index])));
+                    builder.Append(",\"batch\":").Append(queue.read(entries[index])).Append('}');
+                }
+                builder.Append("]}");
+                var result = JsonConvert.DeserializeObject<backlogresult>(await post(backlog_uri, builder.ToString(), null));
+                foreach (var entry in entries)
+                {
+                    queue.remove(entry);
+                }
+                Console.WriteLine($"{DateTime.UtcNow:o} flushed {entries.Count} stored batches: {result.events} events, {result.duplicates} duplicates, {result.rejected} rejected");
             }
         }
         // апи сенд
@@ -205,33 +220,37 @@ namespace telemetryclient
                 {
                     NullValueHandling = NullValueHandling.Ignore
                 });
+            // batch id переживает перезапуск в имени файла очереди: ретрай не запишет пачку дважды
+            var batch_id = Guid.NewGuid().ToString("N");
             try
             {
-                await post(json);
+                await post(ingest_uri, json, batch_id);
             }
             catch
             {
-                queue.enqueue(json);
+                queue.enqueue(json, batch_id);
                 throw;
             }
         }
 
         // апи пост
-        private async Task post(string json)
+        private async Task<string> post(Uri uri, string json, string batch_id)
         {
-            var request = new HttpRequestMessage(HttpMethod.Post, ingest_uri);
+            var request = new HttpRequestMessage(HttpMethod.Post, uri);
             request.Content = new StringContent(json, Encoding.UTF8, "application/json");
             request.Headers.Add("X-Api-Token", token);
             var timestamp = DateTimeOffset.UtcNow.ToUnixTimeSeconds().ToString();
             var signature = compute_signature(timestamp, json);
             request.Headers.Add("X-Signature-Ts", timestamp);
             request.Headers.Add("X-Signature", signature);
+            if (batch_id != null) { request.Headers.Add("X-Batch-Id", batch_id); }
             var response = await client.SendAsync(request);
+            var body = await response.Content.ReadAsStringAsync();
             if (!response.IsSuccessStatusCode)
             {
-                var body = await response.Content.ReadAsStringAsync();
                 throw new InvalidOperationException($"ingest failed: {(int)response.StatusCode} {body}");
             }
+            return body;
         }
         // проверка HMAC
         private string compute_signature(string timestamp, string json)
@@ -257,6 +276,8 @@ namespace telemetryclient
     // класс для обработки очереди
     internal class diskqueue
     {
+        // не больше INGEST_BACKLOG_MAX_BATCHES сервера
+        internal const int backlog_size = 100;
         private readonly string directory;
 
         internal diskqueue(string directory)
@@ -264,9 +285,9 @@ namespace telemetryclient
             this.directory = directory;
             Directory.CreateDirectory(this.directory);
         }
-        internal void enqueue(string payload)
+        internal void enqueue(string payload, string batch_id)
         {
-            var name = $"{DateTime.UtcNow:yyyyMMddHHmmssffff}_{Guid.NewGuid():N}.json";
+            var name = $"{DateTime.UtcNow:yyyyMMddHHmmssffff}_{batch_id}.json";
             var path = Path.Combine(directory, name);
             File.WriteAllText(path, payload, Encoding.UTF8);
         }
@@ -276,6 +297,13 @@ namespace telemetryclient
             return Directory.GetFiles(directory, "*.json").OrderBy(x => x);
         }
 
+        // имя файла: {время}_{batch id}.json
+        internal static string batch_id(string path)
+        {
+            var name = Path.GetFileNameWithoutExtension(path);
+            return name.Substring(name.IndexOf('_') + 1);
+        }
+
         internal string read(string path)
         {
             return File.ReadAllText(path, Encoding.UTF8);
@@ -297,6 +325,13 @@ namespace telemetryclient
         public string platform { get; set; }
         public List<eventpayload> events { get; set; }
     }
+    // ответ /api/ingest/backlog
+    internal class backlogresult
+    {
+        public int events { get; set; }
+        public int duplicates { get; set; }
+        public int rejected { get; set; }
+    }
     // пейлоад вторичной информации
     internal class eventpayload
     {
@@ -1,14 +1,17 @@
-import React, { useEffect, useMemo, useState } from "react";
+import React, { useEffect, useMemo, useRef, useState } from "react";
 import { eventstable } from "./components/eventstable";
 import { statscard } from "./components/statscard";
 import { dropdown } from "./components/dropdown";
 import { usewebsocket } from "./hooks/usewebsocket";
-import type { eventrecord } from "./types";
+import type { agentstate, eventrecord } from "./types";
 
 const api_base = (import.meta.env.VITE_API_BASE_URL as string | undefined) ?? "http://localhost:8000";
 const api_token = (import.meta.env.VITE_API_TOKEN as string | undefined) ?? "token";
 const history_cap = 500;
 const page_size_options = [25, 50, 100];
+const stream_batch_ms = 250;
+
+type streammessage = eventrecord | { type: string; agent_id?: string | null; agents?: agentstate[] };
 
 const normalize_event = (event: eventrecord): eventrecord => {
   const source = event.ingested_at ?? event.ts;
@@ -17,17 +20,108 @@ const normalize_event = (event: eventrecord): eventrecord => {
   return { ...event, received_at };
 };
 
+const apply_messages = (current: eventrecord[], messages: streammessage[]): eventrecord[] => {
+  const cap = Math.max(history_cap, current.length);
+  let next = current;
+  const incoming: eventrecord[] = [];
+  const flush = () => {
+    if (incoming.length === 0) {
+      return;
+    }
+    const ids = new Set(incoming.map((entry) => entry.id));
+    next = [...incoming.reverse(), ...next.filter((entry) => !ids.has(entry.id))];
+    incoming.length = 0;
+  };
+  for (const message of messages) {
+    if ((message as any).type === "clear") {
+      flush();
+      const agent = (message as any).agent_id;
+      next = agent ? next.filter((entry) => entry.agent_id !== agent) : [];
+      continue;
+    }
+    if ((message as any).type) {
+      continue;
+    }
+    incoming.push(normalize_event(message as eventrecord));
+  }
+  flush();
+  if (next.length > cap) {
+    next = next.slice(0, cap);
+  }
+  return next;
+};
+
+// снимок при подключении заменяет состояние, метрики из потока обновляют его поверх
+const apply_agent_states = (current: Record<string, agentstate>, messages: streammessage[]): Record<string, agentstate> => {
+  let next = current;
+  for (const message of messages) {
+    const kind = (message as any).type;
+    if (kind === "snapshot") {
+      next = {};
+      for (const state of (message as any).agents as agentstate[]) {
+        next[state.agent_id] = state;
+      }
+      continue;
+    }
+    if (kind === "clear") {
+      const agent = (message as any).agent_id;
+      if (agent) {
+        next = { ...next };
+        delete next[agent];
+      } else {
+        next = {};
+      }
+      continue;
+    }
+    if (kind) {
+      continue;
+    }
+    const event = message as eventrecord;
+    const previous = next[event.agent_id] ?? { agent_id: event.agent_id };
+    next = {
+      ...next,
+      [event.agent_id]: {
+        ...previous,
+        platform: event.platform,
+        last_seen: event.ingested_at,
+        last_ts: event.ts,
+        metric: event.event_type === "metric" ? { ts: event.ts, cpu: event.cpu, mem_free: event.mem_free } : previous.metric
+      }
+    };
+  }
+  return next;
+};
+
 const app = () => {
   const [history, set_history] = useState<eventrecord[]>([]);
+  const [agent_states, set_agent_states] = useState<Record<string, agentstate>>({});
   const [agent_filter, set_agent_filter] = useState<string>("");
   const [page, set_page] = useState<number>(1);
   const [page_size, set_page_size] = useState<number>(page_size_options[0]);
+  const [has_more, set_has_more] = useState<boolean>(false);
+  const [loading_older, set_loading_older] = useState<boolean>(false);
+  // resync от сервера (пропущено слишком много) перечитывает историю
+  const [reload, set_reload] = useState<number>(0);
+  const last_id = useRef<number | null>(null);
+
+  const track_ids = (items: streammessage[]) => {
+    for (const item of items) {
+      const id = (item as eventrecord).id;
+      if (!(item as any).type && typeof id === "number" && (last_id.current === null || id > last_id.current)) {
+        last_id.current = id;
+      }
+    }
+  };
 
   const websocket_url = useMemo(() => {
     const origin = api_base.replace(/^https?:\/\//, "");
     const protocol = api_base.startsWith("https") ? "wss" : "ws";
-    const query = agent_filter ? `?agent_id=${encodeURIComponent(agent_filter)}` : "";
-    return `${protocol}://${origin}/ws${query}`;
+    const params = new URLSearchParams();
+    params.set("batch_ms", stream_batch_ms.toString());
+    if (agent_filter) {
+      params.set("agent_id", agent_filter);
+    }
+    return `${protocol}://${origin}/ws?${params.toString()}`;
   }, [agent_filter]);
 
   useEffect(() => {
@@ -43,52 +137,52 @@ const app = () => {
         const response = await fetch(`${api_base}/api/events?${params.toString()}`, { signal: controller.signal });
         if (!response.ok) {
           set_history([]);
+          set_has_more(false);
           set_page(1);
           return;
         }
         const data = await response.json();
         if (Array.isArray(data)) {
           const normalized = data.map((item) => normalize_event(item));
+          track_ids(normalized);
           set_history(normalized);
+          set_has_more(normalized.length === history_cap);
           set_page(1);
         } else {
           set_history([]);
+          set_has_more(false);
           set_page(1);
         }
       } catch {
         set_history([]);
+        set_has_more(false);
         set_page(1);
       }
     };
 
+    last_id.current = null;
     load();
 
     return () => {
       controller.abort();
     };
-  }, [agent_filter]);
+  }, [agent_filter, reload]);
 
   const connection = usewebsocket(websocket_url, {
+    resume_id: () => last_id.current,
     on_message: (event: MessageEvent) => {
       try {
-        const payload = JSON.parse(event.data) as eventrecord | { type: string; agent_id?: string };
-        if ((payload as any).type === "clear") {
-          set_history((current: eventrecord[]) =>
-            (payload as any).agent_id
-              ? current.filter((entry) => entry.agent_id !== (payload as any).agent_id)
-              : []
-          );
+        const payload = JSON.parse(event.data) as streammessage | streammessage[];
+        const messages = Array.isArray(payload) ? payload : [payload];
+        if (messages.length === 0) {
           return;
         }
-        const telemetry = normalize_event(payload as eventrecord);
-        set_history((current: eventrecord[]) => {
-          const filtered = current.filter((item: eventrecord) => item.id !== telemetry.id);
-          filtered.unshift(telemetry);
-          if (filtered.length > history_cap) {
-            filtered.length = history_cap;
-          }
-          return [...filtered];
-        });
+        track_ids(messages);
+        if (messages.some((message) => (message as any).type === "resync")) {
+          set_reload((current: number) => current + 1);
+        }
+        set_history((current: eventrecord[]) => apply_messages(current, messages));
+        set_agent_states((current: Record<string, agentstate>) => apply_agent_states(current, messages));
       } catch {
       }
     }
@@ -109,12 +203,12 @@ const app = () => {
   }, [filtered_events, page, page_size]);
 
   const agents = useMemo(() => {
-    const ids = new Set<string>();
+    const ids = new Set<string>(Object.keys(agent_states));
     for (const entry of history) {
       ids.add(entry.agent_id);
     }
     return Array.from(ids).sort((a: string, b: string) => a.localeCompare(b));
-  }, [history]);
+  }, [history, agent_states]);
 
   const start = (page - 1) * page_size;
   const current_slice = filtered_events.slice(start, start + page_size);
@@ -139,11 +233,44 @@ const app = () => {
         );
       } else {
         set_history([]);
+        set_has_more(false);
       }
       set_page(1);
     }
   };
 
+  const handle_load_older = async () => {
+    if (loading_older || history.length === 0) {
+      return;
+    }
+    const oldest = history.reduce((min, entry) => Math.min(min, entry.id), history[0].id);
+    const params = new URLSearchParams();
+    params.set("limit", history_cap.toString());
+    params.set("before_id", oldest.toString());
+    if (agent_filter) {
+      params.set("agent_id", agent_filter);
+    }
+    set_loading_older(true);
+    try {
+      const response = await fetch(`${api_base}/api/events?${params.toString()}`);
+      if (!response.ok) {
+        return;
+      }
+      const data = await response.json();
+      if (Array.isArray(data)) {
+        const older = data.map((item) => normalize_event(item));
+        set_history((current: eventrecord[]) => {
+          const known = new Set(current.map((entry) => entry.id));
+          return [...current, ...older.filter((entry) => !known.has(entry.id))];
+        });
+        set_has_more(older.length === history_cap);
+      }
+    } catch {
+    } finally {
+      set_loading_older(false);
+    }
+  };
+
   const handle_page_size = (size: number) => {
     set_page_size(size);
     set_page(1);
@@ -198,7 +325,7 @@ const app = () => {
         )
       )
     ),
-    React.createElement(statscard, { events: history, connection })
+    React.createElement(statscard, { agents: Object.values(agent_states), connection })
   );
 
   return React.createElement(
@@ -215,7 +342,10 @@ const app = () => {
         page_size,
         on_page_change: set_page,
         on_page_size_change: handle_page_size,
-        page_size_options
+        page_size_options,
+        has_more,
+        loading_older,
+        on_load_older: handle_load_older
       })
     )
   );
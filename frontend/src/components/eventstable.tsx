@@ -10,6 +10,9 @@ type props = {
   on_page_change: (page: number) => void;
   on_page_size_change: (size: number) => void;
   page_size_options: number[];
+  has_more?: boolean;
+  loading_older?: boolean;
+  on_load_older?: () => void;
 };
 
 const headers = ["agent", "event", "cpu", "memory", "process", "details", "ingested"];
@@ -46,7 +49,10 @@ const build_paginator = (
   page_size: number,
   on_page_change: (page: number) => void,
   on_page_size_change: (size: number) => void,
-  page_size_options: number[]
+  page_size_options: number[],
+  has_more: boolean,
+  loading_older: boolean,
+  on_load_older?: () => void
 ) => {
   const total_pages = Math.max(1, Math.ceil(total / page_size));
   const start = total === 0 ? 0 : (page - 1) * page_size + 1;
@@ -102,7 +108,18 @@ const build_paginator = (
             onClick: () => on_page_change(Math.min(total_pages, page + 1))
           },
           "next"
-        )
+        ),
+        has_more && on_load_older && page >= total_pages
+          ? React.createElement(
+              "button",
+              {
+                className: "rounded-md border border-accent/60 px-3 py-1 text-xs uppercase tracking-wide text-accent transition hover:border-accent hover:bg-accent/10 disabled:cursor-not-allowed disabled:opacity-40",
+                disabled: loading_older,
+                onClick: on_load_older
+              },
+              loading_older ? "loading" : "older"
+            )
+          : null
       )
     )
   );
@@ -155,7 +172,18 @@ const render_row = (event: eventrecord, index: number) => {
 };
 
 export function eventstable(props: props) {
-  const { events, total, page, page_size, on_page_change, on_page_size_change, page_size_options } = props;
+  const {
+    events,
+    total,
+    page,
+    page_size,
+    on_page_change,
+    on_page_size_change,
+    page_size_options,
+    has_more = false,
+    loading_older = false,
+    on_load_older
+  } = props;
 
   const table_header = React.createElement(
     "thead",
@@ -203,7 +231,17 @@ export function eventstable(props: props) {
   return React.createElement(
     "div",
     { className: "overflow-hidden rounded-3xl border border-slate-800/70 bg-gradient-to-br from-panel/90 via-panel/70 to-panel/40 shadow-2xl backdrop-blur-lg" },
-    build_paginator(total, page, page_size, on_page_change, on_page_size_change, page_size_options),
+    build_paginator(
+      total,
+      page,
+      page_size,
+      on_page_change,
+      on_page_size_change,
+      page_size_options,
+      has_more,
+      loading_older,
+      on_load_older
+    ),
     React.createElement(
       "div",
       { className: "overflow-x-auto" },
@@ -1,8 +1,8 @@
 import React, { useMemo } from "react";
-import type { eventrecord, websocketstate } from "../types";
+import type { agentstate, websocketstate } from "../types";
 
 type props = {
-  events: eventrecord[];
+  agents: agentstate[];
   connection: websocketstate;
 };
 
@@ -20,34 +20,34 @@ const stat_card = (title: string, value: string, subtitle?: string, accent?: str
     React.createElement("div", { className: "pointer-events-none absolute -right-6 -top-6 h-24 w-24 rounded-full bg-accent/15 blur-3xl" })
   );
 
-export function statscard({ events, connection }: props) {
+export function statscard({ agents, connection }: props) {
   const metrics = useMemo(() => {
     let cpu_total = 0;
     let cpu_samples = 0;
     let mem_total = 0;
     let mem_samples = 0;
-    const agents = new Set<string>();
 
-    for (const entry of events) {
-      agents.add(entry.agent_id);
-      if (entry.event_type === "metric") {
-        if (typeof entry.cpu === "number") {
-          cpu_total += entry.cpu;
-          cpu_samples += 1;
-        }
-        if (typeof entry.mem_free === "number") {
-          mem_total += entry.mem_free;
-          mem_samples += 1;
-        }
+    for (const state of agents) {
+      const metric = state.metric;
+      if (!metric) {
+        continue;
+      }
+      if (typeof metric.cpu === "number") {
+        cpu_total += metric.cpu;
+        cpu_samples += 1;
+      }
+      if (typeof metric.mem_free === "number") {
+        mem_total += metric.mem_free;
+        mem_samples += 1;
       }
     }
 
     return {
       cpu: cpu_samples > 0 ? cpu_total / cpu_samples : 0,
       mem_free: mem_samples > 0 ? mem_total / mem_samples : 0,
-      agents: agents.size
+      agents: agents.length
     };
-  }, [events]);
+  }, [agents]);
 
   const connection_badge = connection === "open" ? "online" : connection;
   const connection_color = connection === "open" ? "text-emerald-400" : connection === "connecting" ? "text-amber-300" : "text-rose-400";
@@ -55,8 +55,8 @@ export function statscard({ events, connection }: props) {
   return React.createElement(
     "div",
     { className: "grid gap-4 md:grid-cols-3" },
-    stat_card("avg cpu", `${(metrics.cpu * 100).toFixed(1)}%`, "agent metrics"),
-    stat_card("avg free mem", `${(metrics.mem_free / 1024 / 1024).toFixed(0)} MB`, "from metric samples"),
+    stat_card("avg cpu", `${(metrics.cpu * 100).toFixed(1)}%`, "latest per agent"),
+    stat_card("avg free mem", `${(metrics.mem_free / 1024 / 1024).toFixed(0)} MB`, "latest per agent"),
     React.createElement(
       "div",
       { className: "relative overflow-hidden rounded-3xl border border-emerald-500/40 bg-gradient-to-br from-emerald-500/20 via-panel/60 to-panel/40 p-5 text-emerald-200 shadow-xl" },
@@ -3,6 +3,20 @@ import type { websocketstate } from "../types";
 
 type handlerbundle = {
   on_message?: (event: MessageEvent) => void;
+  // последний полученный id: переподключение идет с since_id и догоняет пропущенное
+  resume_id?: () => number | null;
+};
+
+const reconnect_min_ms = 1000;
+const reconnect_max_ms = 15000;
+
+const with_since_id = (url: string, since_id: number | null): string => {
+  if (since_id === null) {
+    return url;
+  }
+  const target = new URL(url);
+  target.searchParams.set("since_id", since_id.toString());
+  return target.toString();
 };
 
 export function usewebsocket(url: string | null, handlers: handlerbundle): websocketstate {
@@ -19,27 +33,45 @@ export function usewebsocket(url: string | null, handlers: handlerbundle): webso
       return;
     }
 
-    set_state("connecting");
-    const socket = new WebSocket(url);
+    let socket: WebSocket | null = null;
+    let timer: number | undefined;
+    let disposed = false;
+    let delay = reconnect_min_ms;
 
-    socket.onopen = () => {
-      set_state("open");
-    };
+    const open = (resume: boolean) => {
+      set_state("connecting");
+      socket = new WebSocket(resume ? with_since_id(url, handlers_ref.current.resume_id?.() ?? null) : url);
 
-    socket.onclose = () => {
-      set_state("closed");
-    };
+      socket.onopen = () => {
+        delay = reconnect_min_ms;
+        set_state("open");
+      };
 
-    socket.onerror = () => {
-      set_state("error");
-    };
+      socket.onclose = () => {
+        if (disposed) {
+          return;
+        }
+        set_state("closed");
+        // разброс задержки, чтобы дашборды не переподключались все разом после рестарта
+        timer = window.setTimeout(() => open(true), delay / 2 + Math.random() * delay);
+        delay = Math.min(delay * 2, reconnect_max_ms);
+      };
 
-    socket.onmessage = (event) => {
-      handlers_ref.current.on_message?.(event);
+      socket.onerror = () => {
+        set_state("error");
+      };
+
+      socket.onmessage = (event) => {
+        handlers_ref.current.on_message?.(event);
+      };
     };
 
+    open(false);
+
     return () => {
-      socket.close();
+      disposed = true;
+      window.clearTimeout(timer);
+      socket?.close();
     };
   }, [url]);
 
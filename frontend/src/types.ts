@@ -13,5 +13,14 @@ export type eventrecord = {
   received_at?: number;
 };
 
+export type agentstate = {
+  agent_id: string;
+  platform?: string | null;
+  last_seen?: string | null;
+  last_ts?: string | null;
+  metric?: { ts: string; cpu?: number | null; mem_free?: number | null } | null;
+  events_per_second?: number;
+};
+
 export type websocketstate = "idle" | "connecting" | "open" | "closed" | "error";
 
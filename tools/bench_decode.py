@@ -0,0 +1,89 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from backend.fastpath import decode_rows, model_rows, render_event  # noqa: E402
+from backend.models import eventrecord, ingestbatch  # noqa: E402
+from load_emitter import make_event  # noqa: E402
+
+
+# тела запросов в том виде, в каком их шлет эмиттер
+def build_bodies(batches: int, agents: int) -> list[bytes]:
+    return [
+        json.dumps(make_event(f"bench-{index % agents:04d}"), separators=(",", ":")).encode()
+        for index in range(batches)
+    ]
+
+
+# строки базы, которые затем отдаются подписчикам
+def build_records(bodies: list[bytes]) -> list[dict]:
+    records = []
+    for body in bodies:
+        for row in decode_rows(body):
+            records.append(
+                {
+                    "id": len(records) + 1,
+                    "agent_id": row[0],
+                    "ts": row[1],
+                    "platform": row[2],
+                    "event_type": row[3],
+                    "cpu": row[4],
+                    "mem_free": row[5],
+                    "pid": row[6],
+                    "proc_name": row[7],
+                    "rss": row[8],
+                    "ingested_at": "2025-11-12 12:00:00",
+                }
+            )
+    return records
+
+
+def pydantic_decode(body: bytes) -> list[tuple]:
+    return model_rows(ingestbatch.model_validate_json(body))
+
+
+def pydantic_render(record: dict) -> dict:
+    return eventrecord.from_row(record).model_dump(mode="json")
+
+
+def run_case(name: str, decode, render, bodies: list[bytes], records: list[dict]) -> dict:
+    started = time.process_time()
+    for body in bodies:
+        decode(body)
+    decode_cpu = time.process_time() - started
+    started = time.process_time()
+    for record in records:
+        render(record)
+    render_cpu = time.process_time() - started
+    return {
+        "case": name,
+        "events": len(records),
+        "decode_us_per_event": round(decode_cpu / len(records) * 1e6, 2),
+        "render_us_per_event": round(render_cpu / len(records) * 1e6, 2),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ingest decode/render CPU benchmark")
+    parser.add_argument("--batches", type=int, default=20000, help="ingest bodies to decode")
+    parser.add_argument("--agents", type=int, default=1000)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    bodies = build_bodies(args.batches, args.agents)
+    records = build_records(bodies)
+    results = [
+        run_case("pydantic", pydantic_decode, pydantic_render, bodies, records),
+        run_case("fastpath", decode_rows, render_event, bodies, records),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
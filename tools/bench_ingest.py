@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from backend import database  # noqa: E402
+from load_emitter import make_event  # noqa: E402
+
+
+# строки в том же виде, что собирает /api/ingest
+def build_rows(batches: int, agents: int) -> list[list[tuple]]:
+    result = []
+    for index in range(batches):
+        payload = make_event(f"bench-{index % agents:04d}")
+        result.append(
+            [
+                (
+                    payload["agent_id"],
+                    payload["ts"],
+                    payload["platform"],
+                    event["type"],
+                    event.get("cpu"),
+                    event.get("mem_free"),
+                    event.get("pid"),
+                    event.get("name"),
+                    event.get("rss"),
+                )
+                for event in payload["events"]
+            ]
+        )
+    return result
+
+
+# тот же insert_events, но по одной строке: цена транзакции и round trip на строку
+async def per_row_insert(rows: list[tuple]) -> list[dict]:
+    inserted = []
+    for row in rows:
+        inserted.extend(await database.insert_events([row]))
+    return inserted
+
+
+async def run_case(name: str, insert, batches: list[list[tuple]]) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        os.environ["DB_PATH"] = str(Path(workdir) / "bench.db")
+        try:
+            await database.init_db()
+            events = sum(len(batch) for batch in batches)
+            started = time.perf_counter()
+            for batch in batches:
+                await insert(batch)
+            elapsed = time.perf_counter() - started
+        finally:
+            await database.close_pool()
+    return {
+        "case": name,
+        "batches": len(batches),
+        "events": events,
+        "seconds": round(elapsed, 3),
+        "events_per_second": round(events / elapsed, 1),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="insert_events benchmark")
+    parser.add_argument("--batches", type=int, default=2000, help="ingest requests to replay")
+    parser.add_argument("--agents", type=int, default=1000)
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    batches = build_rows(args.batches, args.agents)
+    results = [
+        await run_case("per_row", per_row_insert, batches),
+        await run_case("bulk", database.insert_events, batches),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from load_emitter import agent_processes, content_types, encode_body, make_event, signed_headers  # noqa: E402
+
+
+# перцентили по отсортированной выборке, миллисекунды
+def summarize(samples: list[float]) -> dict[str, Any]:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(share: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(share * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+# результаты прогона: latency от плановой отправки (без coordinated omission) и от фактической
+class benchresult:
+    def __init__(self) -> None:
+        self.scheduled: list[float] = []
+        self.service: list[float] = []
+        self.statuses: Counter[str] = Counter()
+        self.errors: Counter[str] = Counter()
+        self.requests = 0
+        self.events = 0
+        self.bytes_sent = 0
+        self.ws_frames = 0
+        self.ws_events = 0
+        self.ws_latency: list[float] = []
+        self.ws_errors: Counter[str] = Counter()
+
+
+class benchsettings:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.agents = args.agents
+        self.interval = args.interval
+        self.procs = args.procs
+        self.duration = args.duration
+        self.subscribers = args.subscribers
+        self.ws_query = args.ws_query
+        self.body_format = args.format
+        self.encoding = args.compress
+        self.token = args.token
+        self.secret = args.secret.encode()
+        self.prefix = args.agent_prefix
+        self.connections = args.connections
+        self.timeout = args.timeout
+        self.seed = args.seed
+        self.noisy = args.noisy
+        self.noisy_interval = args.noisy_interval
+
+
+async def send_report(
+    client: httpx.AsyncClient,
+    url: str,
+    agent_id: str,
+    processes: list[tuple[int, str]],
+    scheduled: float,
+    settings: benchsettings,
+    result: benchresult,
+) -> None:
+    loop = asyncio.get_running_loop()
+    payload = make_event(agent_id, processes)
+    body = encode_body(payload, settings.body_format, settings.encoding)
+    headers = signed_headers(settings.token, settings.secret, body, settings.body_format, settings.encoding)
+    started = loop.time()
+    try:
+        response = await client.post(url, content=body, headers=headers)
+    except httpx.HTTPError as exc:
+        result.errors[type(exc).__name__] += 1
+        return
+    finished = loop.time()
+    result.requests += 1
+    result.bytes_sent += len(body)
+    result.statuses[str(response.status_code)] += 1
+    if response.status_code != 200:
+        result.errors[str(response.status_code)] += 1
+        return
+    result.events += len(payload["events"])
+    result.service.append(finished - started)
+    result.scheduled.append(finished - scheduled)
+
+
+# агент шлет отчет каждые interval секунд со своим сдвигом фазы; отправка не ждет ответа предыдущей
+async def agent_loop(
+    client: httpx.AsyncClient,
+    url: str,
+    agent_id: str,
+    start: float,
+    end: float,
+    settings: benchsettings,
+    result: benchresult,
+    pending: set[asyncio.Task],
+    rng: random.Random,
+    interval: Optional[float] = None,
+) -> None:
+    loop = asyncio.get_running_loop()
+    processes = agent_processes(agent_id, settings.procs)
+    interval = interval or settings.interval
+    offset = rng.uniform(0, interval)
+    tick = 0
+    while True:
+        scheduled = start + offset + tick * interval
+        if scheduled >= end:
+            return
+        await asyncio.sleep(max(0.0, scheduled - loop.time()))
+        task = asyncio.create_task(send_report(client, url, agent_id, processes, scheduled, settings, result))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        tick += 1
+
+
+# подписчик /ws: задержка доставки считается от ts события, выставленного эмиттером
+async def subscribe(ws_url: str, prefix: str, result: benchresult, ready: asyncio.Event, stop: asyncio.Event) -> None:
+    import websockets
+
+    parsed: dict[str, float] = {}
+    try:
+        async with websockets.connect(ws_url, max_size=None) as connection:
+            ready.set()
+            while not stop.is_set():
+                try:
+                    message = await asyncio.wait_for(connection.recv(), 0.25)
+                except asyncio.TimeoutError:
+                    continue
+                received = time.time()
+                frame = json.loads(message)
+                items = frame if isinstance(frame, list) else [frame]
+                result.ws_frames += 1
+                for item in items:
+                    if item.get("type") or not str(item.get("agent_id", "")).startswith(prefix):
+                        continue
+                    ts = item["ts"]
+                    epoch = parsed.get(ts)
+                    if epoch is None:
+                        epoch = parsed[ts] = datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+                    result.ws_events += 1
+                    result.ws_latency.append(received - epoch)
+    except Exception as exc:  # noqa: BLE001
+        result.ws_errors[type(exc).__name__] += 1
+        ready.set()
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+# приложение в этом же процессе на uvicorn; переменные окружения выставляются до импорта backend.main
+async def start_local(settings: benchsettings, directory: str) -> tuple[Any, asyncio.Task, str]:
+    os.environ["DB_PATH"] = str(Path(directory) / "telemetry.db")
+    os.environ["API_TOKEN"] = settings.token
+    os.environ["HMAC_SECRET"] = settings.secret.decode()
+    import uvicorn
+    from backend.main import app
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+            raise RuntimeError("uvicorn exited before startup")
+        await asyncio.sleep(0.05)
+    return server, task, f"http://127.0.0.1:{port}"
+
+
+async def run(settings: benchsettings, base_url: str) -> dict[str, Any]:
+    rng = random.Random(settings.seed)
+    random.seed(settings.seed)
+    result = benchresult()
+    noisy = benchresult()
+    ingest_url = f"{base_url}/api/ingest"
+    ws_url = base_url.replace("http", "ws", 1) + "/ws" + (f"?{settings.ws_query}" if settings.ws_query else "")
+    stop = asyncio.Event()
+    readiness = [asyncio.Event() for _ in range(settings.subscribers)]
+    watchers = [
+        asyncio.create_task(subscribe(ws_url, settings.prefix, result, ready, stop)) for ready in readiness
+    ]
+    await asyncio.gather(*(ready.wait() for ready in readiness))
+
+    loop = asyncio.get_running_loop()
+    pending: set[asyncio.Task] = set()
+    limits = httpx.Limits(max_connections=settings.connections, max_keepalive_connections=settings.connections)
+    async with httpx.AsyncClient(timeout=settings.timeout, limits=limits) as client:
+        start = loop.time()
+        end = start + settings.duration
+        await asyncio.gather(
+            *(
+                agent_loop(
+                    client, ingest_url, f"{settings.prefix}-{index:05d}", start, end, settings, result, pending, rng
+                )
+                for index in range(settings.agents)
+            ),
+            # агенты с INTERVAL_SECONDS около нуля: их отказы и задержки считаются отдельно
+            *(
+                agent_loop(
+                    client,
+                    ingest_url,
+                    f"{settings.prefix}-noisy-{index:03d}",
+                    start,
+                    end,
+                    settings,
+                    noisy,
+                    pending,
+                    rng,
+                    settings.noisy_interval,
+                )
+                for index in range(settings.noisy)
+            ),
+        )
+        if pending:
+            _, unfinished = await asyncio.wait(set(pending), timeout=settings.timeout)
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                result.errors["unfinished"] += len(unfinished)
+        elapsed = loop.time() - start
+        # даем рассылке дослать хвост
+        await asyncio.sleep(1.0)
+        stop.set()
+        await asyncio.gather(*watchers)
+        try:
+            server_stats: Optional[dict] = (await client.get(f"{base_url}/api/stats")).json()
+        except (httpx.HTTPError, ValueError):
+            server_stats = None
+
+    return {
+        "config": {
+            "agents": settings.agents,
+            "interval": settings.interval,
+            "procs": settings.procs,
+            "duration": settings.duration,
+            "subscribers": settings.subscribers,
+            "ws_query": settings.ws_query,
+            "format": settings.body_format,
+            "compress": settings.encoding,
+            "connections": settings.connections,
+            "seed": settings.seed,
+            "target_rps": round(settings.agents / settings.interval, 3),
+            "noisy": settings.noisy,
+            "noisy_interval": settings.noisy_interval,
+        },
+        "elapsed": round(elapsed, 3),
+        "ingest": {
+            "requests": result.requests,
+            "events": result.events,
+            "requests_per_second": round(result.requests / elapsed, 3),
+            "events_per_second": round(result.events / elapsed, 3),
+            "bytes_sent": result.bytes_sent,
+            "statuses": dict(result.statuses),
+            "errors": dict(result.errors),
+            "latency_ms": summarize(result.scheduled),
+            "service_ms": summarize(result.service),
+        },
+        "noisy": {
+            "requests": noisy.requests,
+            "statuses": dict(noisy.statuses),
+            "errors": dict(noisy.errors),
+            "latency_ms": summarize(noisy.scheduled),
+        },
+        "websocket": {
+            "subscribers": settings.subscribers,
+            "frames": result.ws_frames,
+            "events": result.ws_events,
+            "delivered": round(result.ws_events / max(1, result.events * settings.subscribers), 4),
+            "errors": dict(result.ws_errors),
+            "latency_ms": summarize(result.ws_latency),
+        },
+        "server": server_stats,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Telemetry load benchmark: open-loop agents plus websocket subscribers")
+    parser.add_argument("--url", default=None, help="server base url; without it the app is started in-process")
+    parser.add_argument("--token", default=os.getenv("API_TOKEN", "telemetry-secret-token"))
+    parser.add_argument("--secret", default=os.getenv("HMAC_SECRET", "telemetry-hmac-secret"))
+    parser.add_argument("--agents", type=int, default=200, help="simulated agents")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between reports of one agent")
+    parser.add_argument("--procs", type=int, default=40, help="processes per report")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--subscribers", type=int, default=5, help="concurrent /ws clients")
+    parser.add_argument("--ws-query", default="", help="query string for /ws, e.g. batch_ms=250")
+    parser.add_argument("--format", choices=sorted(content_types), default="json", help="ingest body format")
+    parser.add_argument("--compress", choices=("identity", "gzip", "zstd"), default="identity")
+    parser.add_argument("--agent-prefix", default="bench")
+    parser.add_argument("--connections", type=int, default=100, help="http connection pool size")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--noisy", type=int, default=0, help="extra agents that report every --noisy-interval seconds")
+    parser.add_argument("--noisy-interval", type=float, default=0.01)
+    parser.add_argument("--output", default=None, help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    settings = benchsettings(args)
+    if args.url:
+        report = await run(settings, args.url.rstrip("/"))
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            server, task, base_url = await start_local(settings, directory)
+            try:
+                report = await run(settings, base_url)
+            finally:
+                server.should_exit = True
+                await task
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -4,26 +4,56 @@ import hmac
 import json
 import os
 import random
+import sys
 import time
 from datetime import datetime, timezone
 from hashlib import sha256
+from pathlib import Path
 import httpx
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from backend.frames import compress, encode_frame, frame_type  # noqa: E402
+
+content_types = {"json": "application/json", "frame": frame_type, "msgpack": "application/msgpack"}
+
 
 def build_signature(secret: bytes, timestamp: str, body: bytes) -> str:
     digest = hmac.new(secret, timestamp.encode() + b"." + body, sha256).hexdigest()
     return digest
 
 
-def make_event(agent_id: str) -> dict:
+common_processes = (
+    "System", "svchost.exe", "explorer.exe", "chrome.exe", "msedge.exe", "code.exe", "teams.exe",
+    "outlook.exe", "dwm.exe", "csrss.exe", "lsass.exe", "SearchHost.exe", "OneDrive.exe", "python.exe",
+    "java.exe", "node.exe", "postgres.exe", "sqlservr.exe", "MsMpEng.exe", "RuntimeBroker.exe",
+)
+
+
+# у агента стабильный набор процессов (как у реальной машины), меняются только нагрузки
+def agent_processes(agent_id: str, count: int) -> list[tuple[int, str]]:
+    rng = random.Random(agent_id)
+    return [
+        (rng.randint(200, 50_000), common_processes[index] if index < len(common_processes) else f"worker-{index}.exe")
+        for index in range(count)
+    ]
+
+
+def make_event(agent_id: str, processes: list[tuple[int, str]] | None = None) -> dict:
     cpu = random.random()
     mem = random.randint(256, 16_384) * 1024 * 1024
-    processes = [
-        {"type": "proc", "pid": random.randint(200, 50_000), "name": f"proc-{i}", "cpu": random.random()}
-        for i in range(3)
-    ]
+    listing = processes if processes is not None else [(random.randint(200, 50_000), f"proc-{i}") for i in range(3)]
     events = [{"type": "metric", "cpu": cpu, "mem_free": mem}]
-    events.extend(processes)
+    events.extend(
+        {
+            "type": "proc",
+            "pid": pid,
+            "name": name,
+            "cpu": random.random() * 0.2,
+            "rss": random.randint(4, 2048) * 1024 * 1024,
+        }
+        for pid, name in listing
+    )
     return {
         "agent_id": agent_id,
         "ts": datetime.now(timezone.utc).isoformat(),
@@ -32,26 +62,68 @@ def make_event(agent_id: str) -> dict:
     }
 
 
-async def send_loop(url: str, token: str, secret: bytes, rate: int, batch: int, agent_prefix: str) -> None:
-    interval = 1 / max(rate, 1)
+# тело в выбранном формате; подпись считается по нему же, уже сжатому
+def encode_body(payload: dict, body_format: str, encoding: str) -> bytes:
+    if body_format == "frame":
+        body = encode_frame(payload)
+    elif body_format == "msgpack":
+        import msgpack
+
+        body = msgpack.packb(payload)
+    else:
+        body = json.dumps(payload, separators=(",", ":")).encode()
+    if encoding != "identity":
+        body = compress(body, encoding)
+    return body
+
+
+def signed_headers(token: str, secret: bytes, body: bytes, body_format: str, encoding: str) -> dict:
+    timestamp = str(int(time.time()))
+    headers = {
+        "Content-Type": content_types[body_format],
+        "X-Api-Token": token,
+        "X-Signature": build_signature(secret, timestamp, body),
+        "X-Signature-Ts": timestamp,
+    }
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+async def post_once(client: httpx.AsyncClient, url: str, body: bytes, headers: dict) -> None:
+    try:
+        await client.post(url, content=body, headers=headers)
+    except httpx.HTTPError:
+        pass
+
+
+# open loop: запросы уходят по расписанию и не ждут ответов предыдущих, так что --rate соблюдается
+async def send_loop(
+    url: str,
+    token: str,
+    secret: bytes,
+    rate: int,
+    batch: int,
+    agent_prefix: str,
+    body_format: str = "json",
+    encoding: str = "identity",
+) -> None:
+    interval = batch / max(rate, 1)
+    pending: set[asyncio.Task] = set()
+    loop = asyncio.get_running_loop()
     async with httpx.AsyncClient(timeout=5.0) as client:
+        deadline = loop.time()
         while True:
-            payloads = []
             for _ in range(batch):
                 agent_id = f"{agent_prefix}-{random.randint(1, 1000):04d}"
-                payloads.append(make_event(agent_id))
-            for payload in payloads:
-                body = json.dumps(payload, separators=(",", ":")).encode()
-                timestamp = str(int(time.time()))
-                signature = build_signature(secret, timestamp, body)
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-Api-Token": token,
-                    "X-Signature": signature,
-                    "X-Signature-Ts": timestamp,
-                }
-                await client.post(url, content=body, headers=headers)
-                await asyncio.sleep(interval)
+                body = encode_body(make_event(agent_id), body_format, encoding)
+                task = asyncio.create_task(
+                    post_once(client, url, body, signed_headers(token, secret, body, body_format, encoding))
+                )
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            deadline += interval
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
 
 
 def parse_args() -> argparse.Namespace:
@@ -59,15 +131,26 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--url", default=os.getenv("API_URL", "http://localhost:8000/api/ingest"))
     parser.add_argument("--token", default=os.getenv("API_TOKEN", "telemetry-secret-token"))
     parser.add_argument("--secret", default=os.getenv("HMAC_SECRET", "telemetry-hmac-secret"))
-    parser.add_argument("--rate", type=int, default=100, help="events per second")
+    parser.add_argument("--rate", type=int, default=100, help="requests per second")
     parser.add_argument("--batch", type=int, default=5, help="requests per loop")
     parser.add_argument("--agent-prefix", default="loadgen")
+    parser.add_argument("--format", choices=sorted(content_types), default="json", help="ingest body format")
+    parser.add_argument("--compress", choices=("identity", "gzip", "zstd"), default="identity")
     return parser.parse_args()
 
 
 async def main() -> None:
     args = parse_args()
-    await send_loop(args.url, args.token, args.secret.encode(), args.rate, args.batch, args.agent_prefix)
+    await send_loop(
+        args.url,
+        args.token,
+        args.secret.encode(),
+        args.rate,
+        args.batch,
+        args.agent_prefix,
+        args.format,
+        args.compress,
+    )
 
 
 if __name__ == "__main__":